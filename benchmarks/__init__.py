@@ -0,0 +1,59 @@
+"""
+Performance benchmarks for the chatbot.
+
+Each module is a standalone script, run from the project root, e.g.::
+
+    python -m benchmarks.bench_chain_registry
+"""
+
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django():
+    """Configure Django so benchmarks can import the ``chatbot`` app."""
+    if str(BASE_DIR) not in sys.path:
+        sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "chatbot_project.settings")
+    # Benchmarks never call the Groq API: models come from the local fake
+    # provider, and the key only lets Groq clients be constructed.
+    os.environ.setdefault("CHATBOT_LLM_BACKEND", "chatbot.providers.FakeProvider")
+    os.environ.setdefault("GROQ_API_KEY", "benchmark-placeholder-key")
+
+    import django
+
+    django.setup()
+
+
+def timeit(func, iterations):
+    """Call ``func`` ``iterations`` times and return per-call timings in seconds."""
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    return {
+        "mean_us": statistics.fmean(ordered) * 1e6,
+        "p50_us": ordered[len(ordered) // 2] * 1e6,
+        "p99_us": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e6,
+    }
+
+
+def print_table(rows):
+    """Print ``{name: summary}`` rows as an aligned table."""
+    print(f"{'case':<32}{'mean (us)':>12}{'p50 (us)':>12}{'p99 (us)':>12}")
+    for name, stats in rows.items():
+        print(
+            f"{name:<32}{stats['mean_us']:>12.1f}"
+            f"{stats['p50_us']:>12.1f}{stats['p99_us']:>12.1f}"
+        )
@@ -0,0 +1,78 @@
+"""
+Load test of the sync and async chat service paths against the fake provider.
+
+Every request waits ``latency`` seconds inside the "model", like a real
+upstream call. The sync path runs ``ask_groq`` on a pool of ``threads`` worker
+threads (a threaded WSGI worker); the async path runs ``aask_groq`` for all
+requests concurrently on one event loop (an ASGI worker). All requests arrive
+at once, so latency includes time spent queued for a free thread.
+
+    python -m benchmarks.bench_async [requests] [threads] [latency]
+"""
+
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import setup_django
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(name, timings, elapsed):
+    print(
+        f"{name:<8}{len(timings) / elapsed:>12.1f}"
+        f"{percentile(timings, 0.50) * 1000:>12.1f}"
+        f"{percentile(timings, 0.95) * 1000:>12.1f}"
+        f"{elapsed:>12.2f}"
+    )
+
+
+def main(requests=500, threads=16, latency=0.5):
+    setup_django()
+
+    from chatbot import services
+    from chatbot.memory import LRUSessionStore
+    from chatbot.providers import FakeProvider
+
+    services.session_store = LRUSessionStore()
+    services.provider = FakeProvider(latency=latency)
+    services.chain_registry.clear()
+
+    def sync_call(i, start):
+        services.ask_groq(f"question {i}", f"sync_{i}", bypass_cache=True)
+        return time.perf_counter() - start
+
+    async def async_call(i, start):
+        await services.aask_groq(f"question {i}", f"async_{i}", bypass_cache=True)
+        return time.perf_counter() - start
+
+    async def async_run(start):
+        return await asyncio.gather(*(async_call(i, start) for i in range(requests)))
+
+    print(
+        f"{requests} requests, {latency * 1000:.0f} ms model latency, "
+        f"{threads} sync threads"
+    )
+    print(f"{'path':<8}{'req/s':>12}{'p50 (ms)':>12}{'p95 (ms)':>12}{'total (s)':>12}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        timings = list(pool.map(sync_call, range(requests), [start] * requests))
+    report("sync", timings, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    timings = asyncio.run(async_run(start))
+    report("async", timings, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(
+        *(int(arg) for arg in args[:2]),
+        *(float(arg) for arg in args[2:3]),
+    )
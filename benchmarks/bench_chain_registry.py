@@ -0,0 +1,57 @@
+"""
+Per-call overhead of preparing the LLM chain in ``ask_groq``.
+
+Compares the original code path, which built a ``ChatGroq`` client, read
+``system_prompt.txt`` and wrapped a new ``RunnableWithMessageHistory`` on every
+message, against a lookup in the long-lived ``ChainRegistry``. No request is
+sent to the model; only the preparation work is timed.
+
+    python -m benchmarks.bench_chain_registry [iterations]
+"""
+
+import os
+import sys
+
+from . import print_table, setup_django, summarize, timeit
+
+
+def main(iterations=200):
+    setup_django()
+
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.runnables.history import RunnableWithMessageHistory
+    from langchain_groq import ChatGroq
+
+    from chatbot import services
+
+    def per_call_build():
+        llm = ChatGroq(
+            model=services.DEFAULT_MODEL, groq_api_key=os.environ["GROQ_API_KEY"]
+        )
+        with open(services.SYSTEM_PROMPT_PATH, "r", encoding="utf-8") as file:
+            system_prompt = file.read().strip()
+        prompt = ChatPromptTemplate.from_messages(
+            [("system", system_prompt), MessagesPlaceholder(variable_name="messages")]
+        )
+        return RunnableWithMessageHistory(
+            prompt | llm, services.get_session_history, input_messages_key="messages"
+        )
+
+    def registry_lookup():
+        return services.chain_registry.get_steps(
+            services.DEFAULT_MODEL, services.DEFAULT_LANGUAGE
+        )
+
+    services.chain_registry.warm_up()
+    per_call_build()  # import and pydantic warm-up, not measured
+
+    print_table(
+        {
+            "per-call build (before)": summarize(timeit(per_call_build, iterations)),
+            "chain registry (after)": summarize(timeit(registry_lookup, iterations)),
+        }
+    )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,94 @@
+"""
+Chat row write throughput against the configured database, by worker count.
+
+Each worker is a process that saves chat turns, one ``Chat.objects.create``
+per turn as the chat views do with the chat writer disabled, for ``seconds``
+seconds. With SQLite every write takes the file lock, so throughput stays
+flat as workers are added; with PostgreSQL (``POSTGRES_DB`` set, see
+settings.py) it should grow with them. The rows go to a throwaway test
+database.
+
+    python -m benchmarks.bench_db_writes [seconds] [max_workers]
+"""
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from . import setup_django
+
+
+def worker(test_settings, user_id, seconds, results):
+    setup_django()
+
+    from django.db import connection
+
+    from chatbot.models import Chat
+
+    connection.close()
+    connection.settings_dict.update(test_settings)
+    written = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        Chat.objects.create(
+            user_id=user_id,
+            session_id=f"bench_{os.getpid()}",
+            message="How do I keep writes fast?",
+            response="Batch them, or use a database with row-level locks.",
+        )
+        written += 1
+    connection.close()
+    results.put(written)
+
+
+def main(seconds=3.0, max_workers=8):
+    setup_django()
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+
+    test_dir = tempfile.mkdtemp(prefix="bench-db-writes-")
+    if connection.vendor == "sqlite":
+        # A file, so that worker processes share it.
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(
+            test_dir, "db.sqlite3"
+        )
+    old_name = connection.creation.create_test_db(verbosity=0)
+    test_settings = {"NAME": connection.settings_dict["NAME"]}
+    try:
+        user = User.objects.create(username="bench_writer")
+        connection.close()
+
+        print(f"{connection.vendor}, {seconds:.0f} s per run")
+        print(f"{'workers':<10}{'rows/s':>12}{'per worker':>12}")
+        context = multiprocessing.get_context("spawn")
+        workers = 1
+        while workers <= max_workers:
+            results = context.Queue()
+            processes = [
+                context.Process(
+                    target=worker, args=(test_settings, user.pk, seconds, results)
+                )
+                for _ in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            written = sum(results.get() for _ in processes)
+            for process in processes:
+                process.join()
+            print(
+                f"{workers:<10}{written / seconds:>12.0f}"
+                f"{written / seconds / workers:>12.0f}"
+            )
+            workers *= 2
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(*(float(arg) for arg in args[:1]), *(int(arg) for arg in args[1:2]))
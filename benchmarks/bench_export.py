@@ -0,0 +1,125 @@
+"""
+Memory and throughput of the streaming chat export.
+
+Fills a throwaway test database with ``rows`` chats (default one million) of
+a single user, then drains ``export_chats`` in each format, with and without
+gzip, sampling the process's resident set size after every chunk. The peak
+growth over the RSS before the export should stay flat however many rows are
+exported. For contrast, ``materialized`` serializes ``BASELINE_ROWS`` of them
+the way a list endpoint would, all at once; it runs last, as the memory it
+takes is not given back to the OS. RSS is read from ``/proc``, so Linux only.
+
+    python -m benchmarks.bench_export [rows]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from itertools import islice
+
+from . import setup_django
+
+BATCH_SIZE = 5000
+BASELINE_ROWS = 100_000
+
+
+def rss_mb():
+    with open("/proc/self/statm") as statm:
+        pages = int(statm.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def fill(connection, rows, user_id):
+    from django.db import transaction
+    from django.utils import timezone
+
+    now = timezone.now()
+    sql = (
+        "INSERT INTO chatbot_chat (user_id, session_id, message, response, "
+        "response_html, response_html_version, created_at) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s)"
+    )
+    chats = (
+        (
+            user_id,
+            f"session_{i // 50}",
+            f"Question {i}: how do I keep memory flat while exporting rows?",
+            f"Answer {i}: " + "stream the rows, one chunk at a time. " * 10,
+            "",
+            "",
+            now,
+        )
+        for i in range(rows)
+    )
+    while batch := list(islice(chats, BATCH_SIZE)):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, batch)
+
+
+def measure(export):
+    """Drain ``export()``; ``(seconds, bytes, peak RSS growth in MB)``."""
+    start_rss = peak = rss_mb()
+    size = 0
+    start = time.perf_counter()
+    for chunk in export():
+        size += len(chunk)
+        peak = max(peak, rss_mb())
+    return time.perf_counter() - start, size, peak - start_rss
+
+
+def main(rows=1_000_000):
+    setup_django()
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+
+    from chatbot.export import EXPORT_FORMATS, export_chats
+    from chatbot.models import Chat
+    from chatbot.serializers import ChatSerializer
+
+    test_dir = tempfile.mkdtemp(prefix="bench-export-")
+    if connection.vendor == "sqlite":
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(
+            test_dir, "db.sqlite3"
+        )
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create(username="exporter")
+        fill(connection, rows, user.pk)
+        chats = Chat.objects.filter(user_id=user.pk)
+
+        cases = {}
+        for format in EXPORT_FORMATS:
+            cases[format] = (rows, lambda format=format: export_chats(chats, format))
+            cases[f"{format} gzip"] = (
+                rows,
+                lambda format=format: export_chats(chats, format, compress=True),
+            )
+        baseline = min(rows, BASELINE_ROWS)
+        cases["materialized"] = (
+            baseline,
+            lambda: [
+                str(ChatSerializer(list(chats[:baseline]), many=True).data).encode()
+            ],
+        )
+
+        print(f"{connection.vendor}: exporting {rows} chats of one user")
+        print(
+            f"{'case':<16}{'rows':>10}{'seconds':>10}{'rows/s':>10}"
+            f"{'MB out':>10}{'RSS +MB':>10}"
+        )
+        for name, (count, export) in cases.items():
+            seconds, size, growth = measure(export)
+            print(
+                f"{name:<16}{count:>10}{seconds:>10.1f}{count / seconds:>10.0f}"
+                f"{size / 2**20:>10.1f}{growth:>10.1f}"
+            )
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
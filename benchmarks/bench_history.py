@@ -0,0 +1,64 @@
+"""
+Chat history page load: the full unpaginated list versus keyset pages.
+
+For each history size a user is given that many chats in a throwaway test
+database; the "full" case loads all of them, as the chat page used to, while
+the "first" and "deep" cases fetch one ``history_page`` at the newest end and
+at the middle of the history.
+
+    python -m benchmarks.bench_history [iterations]
+"""
+
+import sys
+from datetime import timedelta
+
+from . import print_table, setup_django, summarize, timeit
+
+SIZES = (100, 1000, 10000, 50000)
+
+
+def main(iterations=50):
+    setup_django()
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.utils import timezone
+
+    from chatbot.models import Chat
+    from chatbot.pagination import encode_cursor, history_page
+
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        rows = {}
+        start = timezone.now()
+        for size in SIZES:
+            user = User.objects.create(username=f"bench_{size}")
+            Chat.objects.bulk_create(
+                Chat(
+                    user=user,
+                    message=f"question {i}",
+                    response=f"answer {i}",
+                    created_at=start + timedelta(seconds=i),
+                )
+                for i in range(size)
+            )
+            chats = Chat.objects.filter(user=user)
+            middle = chats.order_by("created_at", "id")[size // 2]
+            cursor = encode_cursor(middle)
+
+            rows[f"full list ({size})"] = summarize(
+                timeit(lambda: list(chats.all()), max(1, iterations // 10))
+            )
+            rows[f"first page ({size})"] = summarize(
+                timeit(lambda: history_page(chats), iterations)
+            )
+            rows[f"deep page ({size})"] = summarize(
+                timeit(lambda: history_page(chats, before=cursor), iterations)
+            )
+        print_table(rows)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,99 @@
+"""
+Startup import cost, measured with ``python -X importtime``.
+
+Each case runs in a fresh interpreter: Django is set up first, then the case's
+modules are imported and only their imports are counted. ``urls`` is what a
+worker (or a management command that checks the URLconf) pays before it can
+serve a request; the LLM stack must not be part of it, and the script exits
+non-zero if it is. ``services`` is the stack itself, loaded by the first chat
+turn, and ``wsgi`` a worker started with ``CHATBOT_WARM_UP``, which loads it
+and builds the chains up front. The slowest imports of each case are listed
+under the table.
+
+    python -m benchmarks.bench_import [runs]
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from . import BASE_DIR, print_table, summarize
+
+CASES = {
+    "urls": "import chatbot.urls",
+    "services": "import chatbot.services",
+    "wsgi": "import chatbot_project.wsgi",
+}
+# Loaded on the first chat turn, never by the URLconf.
+LAZY_MODULES = ["langchain_core", "langchain_groq", "groq", "httpx", "numpy"]
+MARK = "bench-import-start"
+
+SCRIPT = """
+import json, sys
+import django
+django.setup()
+sys.stderr.write({mark!r} + "\\n")
+sys.stderr.flush()
+{statement}
+print(json.dumps(sorted(m for m in {lazy!r} if m in sys.modules)))
+"""
+
+
+def run(statement):
+    """Import ``statement`` after Django setup; ``(timings, lazy modules loaded)``."""
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": "chatbot_project.settings",
+        "CHATBOT_LLM_BACKEND": "chatbot.providers.FakeProvider",
+        "GROQ_API_KEY": os.environ.get("GROQ_API_KEY", "benchmark-placeholder-key"),
+        "CHATBOT_WARM_UP": "1",
+    }
+    code = SCRIPT.format(mark=MARK, statement=statement, lazy=LAZY_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    lines = result.stderr.split(MARK + "\n", 1)[1].splitlines()
+    # "import time: self [us] | cumulative | name"; nested imports are
+    # indented, so the top-level lines add up to the statement's cost.
+    timings = []
+    for line in lines:
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        timings.append((int(cumulative), name[1:].rstrip()))
+    return timings, json.loads(result.stdout.splitlines()[-1])
+
+
+def main(runs=5):
+    results = {}
+    slowest = {}
+    lazy_loaded = {}
+    for case, statement in CASES.items():
+        totals = []
+        for _ in range(runs):
+            timings, lazy_loaded[case] = run(statement)
+            totals.append(
+                sum(us for us, name in timings if not name.startswith(" ")) / 1e6
+            )
+        results[case] = summarize(totals)
+        slowest[case] = sorted(timings, reverse=True)[:8]
+    print_table(results)
+
+    for case, timings in slowest.items():
+        print(f"\n{case}: slowest imports (cumulative ms)")
+        for us, name in timings:
+            print(f"{us / 1000:>10.1f}  {name.strip()}")
+
+    if lazy_loaded["urls"]:
+        print(f"\nFAIL: importing the URLconf loaded {', '.join(lazy_loaded['urls'])}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
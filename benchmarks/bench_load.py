@@ -0,0 +1,558 @@
+"""
+Load test of the chat endpoints: replay a corpus of conversations through the
+full Django stack, under WSGI and under ASGI, against the fake provider.
+
+A corpus is a JSONL file with one conversation per line::
+
+    {"id": "c0001", "endpoint": "api", "turns": ["Hi", "Tell me more", ...]}
+
+``endpoint`` is ``api`` (POST /api/chat/), ``api_stream`` (POST
+/api/chat/stream/) or ``web`` (the logged-in chat page). Turns of one
+conversation are sent in order, in one session; up to ``--concurrency``
+conversations run at once, on worker threads under WSGI and on one event loop
+under ASGI. Without ``--corpus`` a corpus is generated from ``--seed``;
+``--generate PATH`` writes it out to be replayed later.
+
+For each server the run reports throughput, latency percentiles, database
+queries per request and memory growth per session, and writes them to
+``--output`` as JSON. ``--baseline`` compares the run with an earlier results
+file and exits with status 1 if anything regressed by more than
+``--tolerance``, so CI can keep a stored baseline::
+
+    python -m benchmarks.bench_load --output bench.json --baseline baseline.json
+
+Each server runs in its own process, since the views a worker serves are
+chosen when it starts (``CHATBOT_ASYNC_VIEWS``).
+"""
+
+import argparse
+import asyncio
+import contextvars
+import gc
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from . import BASE_DIR, setup_django
+
+SERVERS = ("wsgi", "asgi")
+ENDPOINTS = ("api", "api_stream", "web")
+
+WORDS = (
+    "please explain how the cache and the database work together when a "
+    "request arrives and what happens to my previous messages in this session "
+    "compare python django streaming latency memory tokens history summary"
+).split()
+
+# (path, direction, absolute change below which differences are noise)
+CHECKS = (
+    ("throughput_rps", "higher", 0.0),
+    ("latency_ms.p50", "lower", 1.0),
+    ("latency_ms.p95", "lower", 1.0),
+    ("latency_ms.p99", "lower", 1.0),
+    ("queries_per_request.mean", "lower", 0.1),
+    ("memory.rss_bytes_per_session", "lower", 16 * 1024),
+    ("memory.session_bytes_per_session", "lower", 256),
+)
+ENDPOINT_CHECKS = (
+    ("latency_ms.p95", "lower", 1.0),
+    ("queries_per_request.mean", "lower", 0.1),
+)
+
+
+def generate_corpus(conversations, seed=0, max_turns=20):
+    """Conversations of varying length, mostly short with a long tail."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(conversations):
+        turns = min(max_turns, 1 + int(rng.expovariate(1 / 4)))
+        corpus.append(
+            {
+                "id": f"c{i:05d}",
+                "endpoint": rng.choices(ENDPOINTS, weights=(6, 3, 1))[0],
+                "turns": [
+                    " ".join(rng.choices(WORDS, k=rng.randint(3, 40)))
+                    for _ in range(turns)
+                ],
+            }
+        )
+    return corpus
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_corpus(corpus, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for conversation in corpus:
+            f.write(json.dumps(conversation) + "\n")
+
+
+def corpus_digest(corpus):
+    payload = "\n".join(json.dumps(c, sort_keys=True) for c in corpus)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def rss_bytes():
+    """Current resident set size, or the peak where that is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Queries run on behalf of the request being timed, counted through every
+# database connection; the context is copied into sync_to_async threads.
+_query_count = contextvars.ContextVar("bench_query_count", default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    counter = _query_count.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter():
+    from django.db import connections
+    from django.db.backends.signals import connection_created
+
+    def add_wrapper(connection, **kwargs):
+        if count_queries not in connection.execute_wrappers:
+            connection.execute_wrappers.append(count_queries)
+
+    connection_created.connect(add_wrapper, weak=False)
+    for connection in connections.all():
+        add_wrapper(connection)
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = []
+        self.errors = 0
+
+    def add(self, endpoint, seconds, queries, ok):
+        self.samples.append((endpoint, seconds, queries))
+        if not ok:
+            self.errors += 1
+
+
+def request_args(endpoint, message, session_id):
+    if endpoint == "web":
+        return "/", {"message": message}
+    path = "/api/chat/stream/" if endpoint == "api_stream" else "/api/chat/"
+    return path, {"message": message, "session_id": session_id}
+
+
+def make_client(client_class, user, endpoint):
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    if endpoint == "web":
+        client = client_class()
+        client.force_login(user)
+        return client, {}
+    token = RefreshToken.for_user(user).access_token
+    return client_class(), {"Authorization": f"Bearer {token}"}
+
+
+def run_wsgi(conversations, users, concurrency, recorder):
+    from django.db import connection
+    from django.test import Client
+
+    def replay(index, conversation):
+        endpoint = conversation["endpoint"]
+        client, headers = make_client(Client, users[index % len(users)], endpoint)
+        try:
+            for message in conversation["turns"]:
+                path, data = request_args(endpoint, message, conversation["id"])
+                counter = [0]
+                token = _query_count.set(counter)
+                start = time.perf_counter()
+                try:
+                    response = client.post(path, data, headers=headers)
+                    if response.streaming:
+                        b"".join(response.streaming_content)
+                finally:
+                    _query_count.reset(token)
+                recorder.add(
+                    endpoint,
+                    time.perf_counter() - start,
+                    counter[0],
+                    response.status_code < 400,
+                )
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(replay, *item) for item in enumerate(conversations)]:
+            future.result()
+
+
+def run_asgi(conversations, users, concurrency, recorder):
+    from django.test import AsyncClient
+
+    # Logging in touches the database, so clients are set up before the loop.
+    clients = [
+        make_client(AsyncClient, users[index % len(users)], c["endpoint"])
+        for index, c in enumerate(conversations)
+    ]
+
+    async def replay(conversation, client, headers, limit):
+        endpoint = conversation["endpoint"]
+        async with limit:
+            for message in conversation["turns"]:
+                path, data = request_args(endpoint, message, conversation["id"])
+                counter = [0]
+                token = _query_count.set(counter)
+                start = time.perf_counter()
+                try:
+                    response = await client.post(path, data, headers=headers)
+                    if response.streaming:
+                        async for _ in response.streaming_content:
+                            pass
+                finally:
+                    _query_count.reset(token)
+                recorder.add(
+                    endpoint,
+                    time.perf_counter() - start,
+                    counter[0],
+                    response.status_code < 400,
+                )
+
+    async def run_all():
+        limit = asyncio.Semaphore(concurrency)
+        await asyncio.gather(
+            *(
+                replay(conversation, client, headers, limit)
+                for conversation, (client, headers) in zip(conversations, clients)
+            )
+        )
+
+    asyncio.run(run_all())
+
+
+def summarize_samples(samples):
+    timings = [seconds for _, seconds, _ in samples]
+    queries = [count for _, _, count in samples]
+    return {
+        "requests": len(samples),
+        "latency_ms": {
+            "mean": sum(timings) / len(timings) * 1000,
+            "p50": percentile(timings, 0.50) * 1000,
+            "p95": percentile(timings, 0.95) * 1000,
+            "p99": percentile(timings, 0.99) * 1000,
+        },
+        "queries_per_request": {
+            "mean": sum(queries) / len(queries),
+            "max": max(queries),
+        },
+    }
+
+
+def run_server(server, corpus, options):
+    """Replay ``corpus`` in this process and return the server's results."""
+    os.environ["CHATBOT_ASYNC_VIEWS"] = "1" if server == "asgi" else "0"
+    # Rate limits are not what is being measured; every turn must run.
+    os.environ["CHATBOT_ADMISSION"] = "0"
+    setup_django()
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    from chatbot import services
+    from chatbot.providers import FakeProvider
+
+    setup_test_environment()
+    services.provider = FakeProvider(latency=options.latency)
+    services.chain_registry.clear()
+
+    # A file rather than an in-memory database, so worker threads each get
+    # their own connection to the same data.
+    test_dir = tempfile.mkdtemp(prefix="bench-load-")
+    connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(
+        test_dir, "db.sqlite3"
+    )
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode=WAL")
+        install_query_counter()
+        users = [
+            User.objects.create_user(f"load_{i}", password="load-test-password")
+            for i in range(options.users)
+        ]
+        run = run_asgi if server == "asgi" else run_wsgi
+
+        # One untimed conversation per endpoint imports and builds everything.
+        warm_up = [
+            {"id": f"warm_{endpoint}", "endpoint": endpoint, "turns": ["hello"]}
+            for endpoint in ENDPOINTS
+        ]
+        run(warm_up, users, options.concurrency, Recorder())
+
+        gc.collect()
+        rss_before = rss_bytes()
+        sessions_before = services.session_store.stats()
+        recorder = Recorder()
+        start = time.perf_counter()
+        run(corpus, users, options.concurrency, recorder)
+        elapsed = time.perf_counter() - start
+        gc.collect()
+        rss_after = rss_bytes()
+        sessions_after = services.session_store.stats()
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+    results = summarize_samples(recorder.samples)
+    new_sessions = max(1, sessions_after["sessions"] - sessions_before["sessions"])
+    results.update(
+        {
+            "errors": recorder.errors,
+            "elapsed_s": elapsed,
+            "throughput_rps": len(recorder.samples) / elapsed,
+            "memory": {
+                "rss_bytes_per_session": (rss_after - rss_before) / len(corpus),
+                "session_bytes_per_session": (
+                    sessions_after["bytes"] - sessions_before["bytes"]
+                )
+                / new_sessions,
+            },
+            "endpoints": {
+                endpoint: summarize_samples(
+                    [s for s in recorder.samples if s[0] == endpoint]
+                )
+                for endpoint in ENDPOINTS
+                if any(s[0] == endpoint for s in recorder.samples)
+            },
+        }
+    )
+    return results
+
+
+def run_in_subprocess(server, corpus_path, options):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output = f.name
+    try:
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.bench_load",
+                "--server",
+                server,
+                "--corpus",
+                corpus_path,
+                "--output",
+                output,
+                "--concurrency",
+                str(options.concurrency),
+                "--users",
+                str(options.users),
+                "--latency",
+                str(options.latency),
+                "--quiet",
+            ],
+            cwd=BASE_DIR,
+            check=True,
+        )
+        with open(output, encoding="utf-8") as f:
+            return json.load(f)["servers"][server]
+    finally:
+        os.remove(output)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def lookup(results, path):
+    for key in path.split("."):
+        results = results[key]
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a description of every metric that regressed against ``baseline``."""
+    regressions = []
+    for server, current in results["servers"].items():
+        previous = baseline.get("servers", {}).get(server)
+        if previous is None:
+            continue
+        if current["errors"] > previous["errors"]:
+            regressions.append(
+                f"{server} errors: {previous['errors']} -> {current['errors']}"
+            )
+        checks = [(server, current, previous, check) for check in CHECKS]
+        for endpoint, stats in current["endpoints"].items():
+            if endpoint in previous.get("endpoints", {}):
+                checks.extend(
+                    (
+                        f"{server} {endpoint}",
+                        stats,
+                        previous["endpoints"][endpoint],
+                        check,
+                    )
+                    for check in ENDPOINT_CHECKS
+                )
+        for name, stats, old_stats, (path, direction, noise) in checks:
+            new, old = lookup(stats, path), lookup(old_stats, path)
+            change = new - old if direction == "lower" else old - new
+            if change > noise and change > abs(old) * tolerance:
+                regressions.append(f"{name} {path}: {old:.2f} -> {new:.2f}")
+    return regressions
+
+
+def print_results(results):
+    print(
+        f"{'server':<8}{'endpoint':<12}{'requests':>10}{'req/s':>10}"
+        f"{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'queries':>9}"
+    )
+    for server, stats in results["servers"].items():
+        rows = [("all", stats)] + list(stats["endpoints"].items())
+        for endpoint, row in rows:
+            throughput = (
+                f"{stats['throughput_rps']:>10.1f}" if endpoint == "all" else " " * 10
+            )
+            print(
+                f"{server:<8}{endpoint:<12}{row['requests']:>10}{throughput}"
+                f"{row['latency_ms']['p50']:>10.1f}{row['latency_ms']['p95']:>10.1f}"
+                f"{row['latency_ms']['p99']:>10.1f}"
+                f"{row['queries_per_request']['mean']:>9.1f}"
+            )
+        memory = stats["memory"]
+        print(
+            f"{server:<8}{stats['errors']} errors, "
+            f"{memory['rss_bytes_per_session'] / 1024:.1f} KiB RSS and "
+            f"{memory['session_bytes_per_session'] / 1024:.1f} KiB of session "
+            "memory per session"
+        )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.bench_load", description=__doc__.split("\n\n")[0]
+    )
+    parser.add_argument("--server", choices=SERVERS + ("both",), default="both")
+    parser.add_argument("--corpus", help="JSONL conversations to replay")
+    parser.add_argument("--generate", metavar="PATH", help="write the corpus here")
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="fake model latency (seconds)"
+    )
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    parser.add_argument("--quiet", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    if options.corpus:
+        corpus, corpus_path = load_corpus(options.corpus), options.corpus
+    else:
+        corpus = generate_corpus(options.conversations, options.seed)
+        corpus_path = options.generate
+    if options.generate:
+        write_corpus(corpus, options.generate)
+
+    results = {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "corpus": {
+                "path": options.corpus,
+                "sha256": corpus_digest(corpus),
+                "conversations": len(corpus),
+                "requests": sum(len(c["turns"]) for c in corpus),
+            },
+            "concurrency": options.concurrency,
+            "users": options.users,
+            "latency_s": options.latency,
+        },
+        "servers": {},
+    }
+
+    if options.server == "both":
+        temporary = corpus_path is None
+        if temporary:
+            with tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False) as f:
+                corpus_path = f.name
+            write_corpus(corpus, corpus_path)
+        try:
+            for server in SERVERS:
+                results["servers"][server] = run_in_subprocess(
+                    server, corpus_path, options
+                )
+        finally:
+            if temporary:
+                os.remove(corpus_path)
+    else:
+        results["servers"][options.server] = run_server(options.server, corpus, options)
+
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if options.quiet:
+        return 0
+
+    meta = results["meta"]
+    print(
+        f"{meta['corpus']['conversations']} conversations, "
+        f"{meta['corpus']['requests']} requests, concurrency "
+        f"{options.concurrency}, {options.latency * 1000:.0f} ms model latency"
+    )
+    print_results(results)
+
+    if options.baseline:
+        with open(options.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["meta"]["corpus"]["sha256"] != meta["corpus"]["sha256"]:
+            print("warning: the baseline was recorded with a different corpus")
+        regressions = compare(results, baseline, options.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions against {options.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions against {options.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
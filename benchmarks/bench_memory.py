@@ -0,0 +1,108 @@
+"""
+Memory held by in-process session histories: message objects versus compact.
+
+Fills an ``LRUSessionStore`` with ``sessions`` conversations of ``TURNS``
+turns each, once keeping the LangChain message objects (the default) and once
+with ``compact``, and measures what the store holds with ``tracemalloc``.
+The table gives the bytes per message, the overhead on top of the UTF-8 text
+itself, the number of such sessions that fit in a gigabyte, the store's own
+size estimate (what ``max_bytes`` is enforced against), and the time to get
+one session's ``messages`` for a prompt, which the compact store rebuilds
+from its buffer on each call.
+
+    python -m benchmarks.bench_memory [sessions]
+"""
+
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from . import setup_django
+
+TURNS = 20
+WORDS = (
+    "the a to of and in is it you that for on with as this be are can model "
+    "answer question memory session context token prompt response request "
+    "python django cache latency budget history buffer stream export über "
+    "naïve café"
+).split()
+
+
+def text(rng, length):
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def conversation(rng):
+    """``TURNS`` question/answer pairs: ~80 characters asked, ~600 answered."""
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    messages = []
+    for _ in range(TURNS):
+        messages.append(HumanMessage(content=text(rng, 80)))
+        messages.append(AIMessage(content=text(rng, 600)))
+    return messages
+
+
+def fill(store, sessions):
+    """Add ``sessions`` conversations to ``store``; the UTF-8 bytes added."""
+    rng = random.Random(0)
+    text_bytes = 0
+    for index in range(sessions):
+        messages = conversation(rng)
+        text_bytes += sum(len(message.content.encode()) for message in messages)
+        store.get_or_create(f"session_{index}").add_messages(messages)
+    return text_bytes
+
+
+def main(sessions=2000):
+    setup_django()
+
+    from chatbot.memory import LRUSessionStore
+
+    messages = sessions * TURNS * 2
+    print(f"{sessions} sessions of {TURNS * 2} messages ({messages} messages)")
+    print(
+        f"{'store':<10}{'MB':>10}{'B/message':>12}{'overhead':>10}"
+        f"{'sessions/GB':>13}{'estimate MB':>13}{'messages us':>13}"
+    )
+    for name, compact in (("objects", False), ("compact", True)):
+        store = LRUSessionStore(
+            max_sessions=sessions,
+            max_bytes=sys.maxsize,
+            max_messages=TURNS * 2,
+            compact=compact,
+        )
+        gc.collect()
+        tracemalloc.start()
+        # The store keeps no reference to the messages it was given, so
+        # what is still allocated once they are collected is its own.
+        text_bytes = fill(store, sessions)
+        gc.collect()
+        held, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        history = store.get("session_0")
+        start = time.perf_counter()
+        for _ in range(100):
+            history.messages
+        rebuild = (time.perf_counter() - start) / 100
+
+        print(
+            f"{name:<10}{held / 2**20:>10.1f}{held / messages:>12.0f}"
+            f"{held / text_bytes:>9.2f}x{2**30 * sessions / held:>13.0f}"
+            f"{store.stats()['bytes'] / 2**20:>13.1f}{rebuild * 1e6:>13.1f}"
+        )
+        del store, history
+        gc.collect()
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,62 @@
+"""
+Chat page render time with per-request Markdown rendering versus HTML stored
+on the ``Chat`` rows, over a synthetic history.
+
+    python -m benchmarks.bench_render [messages] [iterations]
+"""
+
+import sys
+
+from . import print_table, setup_django, summarize, timeit
+
+RESPONSE = """Here is a summary of **{i}**:
+
+1. The first point, with `inline code` and a [link](https://example.com/{i}).
+2. The second point, which is *emphasized*.
+
+```python
+def answer():
+    return {i}
+```
+
+> A short quote to finish."""
+
+
+def main(messages=5000, iterations=5):
+    setup_django()
+
+    from django.template import Context, Template
+
+    from chatbot.models import Chat
+
+    chats = []
+    for i in range(messages):
+        chat = Chat(id=i, message=f"question {i}", response=RESPONSE.format(i=i))
+        chat.render_response()
+        chats.append(chat)
+
+    per_request = Template(
+        "{% load markdownify %}{% for chat in chats %}"
+        "{{ chat.message }}{{ chat.response | markdownify }}{% endfor %}"
+    )
+    stored = Template(
+        "{% for chat in chats %}"
+        "{{ chat.message }}{{ chat.rendered_response }}{% endfor %}"
+    )
+    context = Context({"chats": chats})
+
+    print(f"{messages} messages, {iterations} renders each")
+    print_table(
+        {
+            "markdownify per request": summarize(
+                timeit(lambda: per_request.render(context), iterations)
+            ),
+            "stored html": summarize(
+                timeit(lambda: stored.render(context), iterations)
+            ),
+        }
+    )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
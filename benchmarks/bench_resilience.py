@@ -0,0 +1,82 @@
+"""
+Chat calls against the fake provider with injected faults, under different
+resilience policies.
+
+``failure_rate`` of the model calls raise a transient error and ``slow_rate``
+of them stall for ``slow_latency`` seconds. For each policy the script reports
+how many of the ``requests`` turns were answered and the latency of those
+answers.
+
+    python -m benchmarks.bench_resilience [requests] [failure_rate] [slow_rate]
+"""
+
+import sys
+import time
+
+from . import setup_django
+
+POLICIES = {
+    "no retries": {"retries": 0},
+    "retries": {"retries": 2, "backoff_base": 0.005},
+    "retries + hedging": {
+        "retries": 2,
+        "backoff_base": 0.005,
+        "hedge": True,
+        "hedge_min_delay": 0.02,
+    },
+    "retries + timeout": {"retries": 2, "backoff_base": 0.005, "timeout": 0.1},
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main(requests=400, failure_rate=0.1, slow_rate=0.03):
+    setup_django()
+
+    from chatbot import services
+    from chatbot.memory import LRUSessionStore
+    from chatbot.providers import FakeProvider
+    from chatbot.resilience import ChatError, Resilience
+
+    services.session_store = LRUSessionStore()
+
+    print(
+        f"{requests} requests, {failure_rate:.0%} failures, "
+        f"{slow_rate:.0%} stalls of 500 ms, 10 ms normal latency"
+    )
+    print(f"{'policy':<22}{'answered':>10}{'p50 (ms)':>12}{'p99 (ms)':>12}")
+    for name, options in POLICIES.items():
+        services.provider = FakeProvider(
+            latency=0.01,
+            failure_rate=failure_rate,
+            slow_rate=slow_rate,
+            slow_latency=0.5,
+            seed=1,
+        )
+        services.chain_registry.clear()
+        services.upstream = Resilience(breaker_failures=requests, **options)
+
+        timings = []
+        for i in range(requests):
+            start = time.perf_counter()
+            try:
+                services.ask_groq(f"question {i}", f"{name}_{i}", bypass_cache=True)
+            except ChatError:
+                continue
+            timings.append(time.perf_counter() - start)
+        print(
+            f"{name:<22}{len(timings) / requests:>10.1%}"
+            f"{percentile(timings, 0.50) * 1000:>12.1f}"
+            f"{percentile(timings, 0.99) * 1000:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(
+        *(int(arg) for arg in args[:1]),
+        *(float(arg) for arg in args[1:3]),
+    )
@@ -0,0 +1,132 @@
+"""
+Chat search latency: the full-text index against a ``LIKE`` scan.
+
+Fills a throwaway test database with ``rows`` synthetic chats (default one
+million) spread over ``users`` users, one of whom owns a tenth of them, then
+times ``search_chats`` and the equivalent ``icontains`` query for a typical
+user and for the heavy one, with rare, common and two-word queries. Inserts go
+through the index triggers, so the fill rate shows the cost of incremental
+indexing too.
+
+    python -m benchmarks.bench_search [rows] [users]
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from itertools import accumulate, islice
+
+from . import print_table, setup_django, summarize, timeit
+
+BATCH_SIZE = 5000
+
+
+def vocabulary(size, rng):
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa", "qu"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(syllables, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+def fill(connection, rows, users, rng):
+    from django.db import transaction
+    from django.utils import timezone
+
+    words = vocabulary(5000, rng)
+    # Zipf-like: a few words are everywhere, most are rare.
+    weights = list(accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    heavy = users[0]
+    now = timezone.now()
+
+    def chats():
+        for _ in range(rows):
+            user = heavy if rng.random() < 0.1 else rng.choice(users)
+            yield (
+                user,
+                "s",
+                " ".join(rng.choices(words, cum_weights=weights, k=10)),
+                " ".join(rng.choices(words, cum_weights=weights, k=60)),
+                "",
+                "",
+                now,
+            )
+
+    sql = (
+        "INSERT INTO chatbot_chat (user_id, session_id, message, response, "
+        "response_html, response_html_version, created_at) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s)"
+    )
+    generated = chats()
+    # Only the inserts are timed, not making up the text.
+    seconds = 0.0
+    while batch := list(islice(generated, BATCH_SIZE)):
+        start = time.perf_counter()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, batch)
+        seconds += time.perf_counter() - start
+    return words, seconds
+
+
+def main(rows=1_000_000, users=1000):
+    setup_django()
+
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.db.models import Q
+
+    from chatbot.models import Chat
+    from chatbot.search import search_chats
+
+    test_dir = tempfile.mkdtemp(prefix="bench-search-")
+    if connection.vendor == "sqlite":
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = os.path.join(
+            test_dir, "db.sqlite3"
+        )
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        User.objects.bulk_create(User(username=f"searcher{i}") for i in range(users))
+        user_ids = list(User.objects.values_list("pk", flat=True))
+        rng = random.Random(19)
+        words, seconds = fill(connection, rows, user_ids, rng)
+        print(
+            f"{connection.vendor}: {rows} chats, {users} users, "
+            f"filled at {rows / seconds:.0f} rows/s (indexed on insert)"
+        )
+
+        queries = {
+            "rare": [words[-1]],
+            "common": [words[0]],
+            "two words": [words[3], words[40]],
+        }
+        owners = {"typical": user_ids[1], "heavy": user_ids[0]}
+
+        def like(user_id, terms):
+            chats = Chat.objects.filter(user_id=user_id)
+            for term in terms:
+                chats = chats.filter(
+                    Q(message__icontains=term) | Q(response__icontains=term)
+                )
+            return list(chats.order_by("-id")[:20])
+
+        results = {}
+        for owner, user_id in owners.items():
+            for name, terms in queries.items():
+                query = " ".join(terms)
+                results[f"fts {owner} {name}"] = summarize(
+                    timeit(lambda: search_chats(user_id, query), 20)
+                )
+                results[f"like {owner} {name}"] = summarize(
+                    timeit(lambda: like(user_id, terms), 5)
+                )
+        print_table(results)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(test_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
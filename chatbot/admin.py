@@ -3,4 +3,11 @@ from .models import Chat
 
 # Register your models here.
 
-admin.site.register(Chat)
+
+@admin.register(Chat)
+class ChatAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "session_id", "created_at")
+    # Chat.__str__ reads the username; fetch users with the page, not per row.
+    list_select_related = ("user",)
+    raw_id_fields = ("user",)
+    search_fields = ("user__username", "session_id")
@@ -0,0 +1,586 @@
+"""
+Admission control for chat requests.
+
+Before a chat turn reaches the model it must pass two per-user token buckets,
+one counting requests and one counting estimated LLM tokens, and then obtain
+one of ``MAX_IN_FLIGHT`` global slots. Requests that find every slot taken
+wait in a fair queue: waiters are grouped by user and served round-robin, so
+one user's burst cannot starve everybody else. Rejections carry a
+``Retry-After`` hint.
+
+The limits and slots are shared by every worker (see below), but each worker
+keeps its own queue: it is fair among the requests waiting in one worker, and
+the workers' queues then compete for free slots on equal terms.
+
+Bucket and slot state lives in an ``AdmissionBackend``. The default
+``SQLiteAdmissionBackend`` keeps it in a small SQLite file that every worker
+process on the host opens, so the limits hold across workers without an
+external service::
+
+    CHATBOT_ADMISSION = {
+        "BACKEND": "chatbot.admission.SQLiteAdmissionBackend",
+        "OPTIONS": {"path": "/var/run/chatbot/admission.sqlite3"},
+        "REQUESTS_PER_MINUTE": 30,
+        "MAX_IN_FLIGHT": 32,
+    }
+"""
+
+import asyncio
+import logging
+import math
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .metrics import stage
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_DEFAULTS = {
+    "ENABLED": True,
+    "BACKEND": "chatbot.admission.SQLiteAdmissionBackend",
+    "OPTIONS": {},
+    # Per-user request bucket: sustained rate and burst size.
+    "REQUESTS_PER_MINUTE": 30,
+    "REQUEST_BURST": 10,
+    # Per-user bucket of estimated LLM tokens (prompt + expected response).
+    "TOKENS_PER_MINUTE": 20000,
+    "TOKEN_BURST": 8000,
+    "RESPONSE_TOKENS": 512,
+    # Chat turns in flight across all workers, and the queue in front of them.
+    "MAX_IN_FLIGHT": 32,
+    "MAX_QUEUE": 100,
+    "QUEUE_TIMEOUT": 10,
+    # A slot held longer than this (e.g. by a killed worker) is reclaimed.
+    "SLOT_LEASE": 300,
+    "POLL_INTERVAL": 0.05,
+}
+
+CHARS_PER_TOKEN = 4
+
+
+class AdmissionRejected(Exception):
+    """A chat request was refused by admission control."""
+
+    MESSAGES = {
+        "requests": "Too many messages, please slow down",
+        "tokens": "Message token quota exceeded, please slow down",
+        "queue_full": "The chatbot is busy, please retry later",
+        "queue_timeout": "The chatbot is busy, please retry later",
+    }
+
+    def __init__(self, reason, retry_after):
+        super().__init__(self.MESSAGES[reason])
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+    @property
+    def status(self):
+        return 429 if self.reason in ("requests", "tokens") else 503
+
+    def as_dict(self):
+        return {
+            "error": str(self),
+            "code": self.reason,
+            "retry_after": self.retry_after,
+        }
+
+
+def refill(tokens, updated, now, capacity, rate):
+    """Bucket level at ``now``, or a full bucket if it has no state yet."""
+    if tokens is None:
+        return capacity
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+def charge(levels, buckets):
+    """
+    Charge ``buckets`` (see ``AdmissionBackend.take``) whose current token
+    counts are ``levels``; return the new counts and the waits.
+    """
+    costs = [min(cost, capacity) for _, cost, capacity, _ in buckets]
+    waits = [
+        0 if tokens >= cost else (cost - tokens) / rate
+        for tokens, cost, (_, _, _, rate) in zip(levels, costs, buckets)
+    ]
+    if not any(waits):
+        levels = [tokens - cost for tokens, cost in zip(levels, costs)]
+    return levels, waits
+
+
+class AdmissionBackend:
+    def take(self, buckets):
+        """
+        Take tokens from several token buckets at once. ``buckets`` lists
+        ``(key, cost, capacity, rate)``: take ``cost`` from the bucket
+        ``key``, refilled at ``rate`` per second up to ``capacity``.
+
+        Returns a wait per bucket: all 0 if the tokens were taken, otherwise
+        the seconds until each bucket will hold its cost. Unless every bucket
+        holds its cost, nothing is taken from any of them.
+        """
+        raise NotImplementedError
+
+    def acquire_slot(self, limit, lease):
+        """Return an id for one of ``limit`` slots, or ``None`` if all are held."""
+        raise NotImplementedError
+
+    def release_slot(self, slot):
+        raise NotImplementedError
+
+    def in_flight(self):
+        raise NotImplementedError
+
+
+class LocalAdmissionBackend(AdmissionBackend):
+    """In-process state: limits apply to each worker process separately."""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._slots = {}
+
+    def take(self, buckets):
+        with self._lock:
+            now = self.clock()
+            levels = []
+            for key, _, capacity, rate in buckets:
+                tokens, updated = self._buckets.get(key, (None, now))
+                levels.append(refill(tokens, updated, now, capacity, rate))
+            levels, waits = charge(levels, buckets)
+            for (key, _, _, _), tokens in zip(buckets, levels):
+                self._buckets[key] = (tokens, now)
+            return waits
+
+    def acquire_slot(self, limit, lease):
+        with self._lock:
+            now = self.clock()
+            for slot, expires in list(self._slots.items()):
+                if expires < now:
+                    del self._slots[slot]
+            if len(self._slots) >= limit:
+                return None
+            slot = uuid.uuid4().hex
+            self._slots[slot] = now + lease
+            return slot
+
+    def release_slot(self, slot):
+        with self._lock:
+            self._slots.pop(slot, None)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._slots)
+
+
+class SQLiteAdmissionBackend(AdmissionBackend):
+    """
+    State in a SQLite file shared by every worker process on the host.
+
+    Each operation is one short ``BEGIN IMMEDIATE`` transaction, which SQLite
+    serializes across processes.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS buckets "
+        "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS slots (id TEXT PRIMARY KEY, expires REAL NOT NULL)",
+    )
+
+    def __init__(self, path=None, timeout=5.0, clock=time.time):
+        self.path = str(
+            path or Path(tempfile.gettempdir()) / "chatbot-admission.sqlite3"
+        )
+        self.timeout = timeout
+        self.clock = clock
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def take(self, buckets):
+        with self._transaction() as db:
+            now = self.clock()
+            levels = []
+            for key, _, capacity, rate in buckets:
+                row = db.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                levels.append(
+                    refill(row and row[0], row and row[1], now, capacity, rate)
+                )
+            levels, waits = charge(levels, buckets)
+            db.executemany(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) "
+                "VALUES (?, ?, ?)",
+                [(key, tokens, now) for (key, *_), tokens in zip(buckets, levels)],
+            )
+            return waits
+
+    def acquire_slot(self, limit, lease):
+        with self._transaction() as db:
+            now = self.clock()
+            db.execute("DELETE FROM slots WHERE expires < ?", (now,))
+            (held,) = db.execute("SELECT COUNT(*) FROM slots").fetchone()
+            if held >= limit:
+                return None
+            slot = uuid.uuid4().hex
+            db.execute(
+                "INSERT INTO slots (id, expires) VALUES (?, ?)", (slot, now + lease)
+            )
+            return slot
+
+    def release_slot(self, slot):
+        with self._transaction() as db:
+            db.execute("DELETE FROM slots WHERE id = ?", (slot,))
+
+    def in_flight(self):
+        (held,) = (
+            self._connection()
+            .execute("SELECT COUNT(*) FROM slots WHERE expires >= ?", (self.clock(),))
+            .fetchone()
+        )
+        return held
+
+
+class Waiter:
+    def __init__(self, key):
+        self.key = key
+        # Set to wake a sync waiter early; async waiters poll.
+        self.event = threading.Event()
+
+
+class FairQueue:
+    """
+    Waiters grouped by user and served round-robin across users. One per
+    worker process; see the module docstring.
+    """
+
+    def __init__(self):
+        # user key -> deque of waiters; the next user to be served is first.
+        self._users = OrderedDict()
+        self.size = 0
+
+    def push(self, waiter):
+        self._users.setdefault(waiter.key, deque()).append(waiter)
+        self.size += 1
+
+    def head(self):
+        for waiters in self._users.values():
+            return waiters[0]
+        return None
+
+    def remove(self, waiter):
+        """Drop ``waiter``; if it was being served, its user goes to the back."""
+        waiters = self._users.get(waiter.key)
+        if not waiters or waiter not in waiters:
+            return
+        served = waiters[0] is waiter and self.head() is waiter
+        waiters.remove(waiter)
+        self.size -= 1
+        if not waiters:
+            del self._users[waiter.key]
+        elif served:
+            self._users.move_to_end(waiter.key)
+
+
+class AdmittedStream:
+    """
+    Iterate ``events`` while holding an admission slot.
+
+    The slot is released when the stream is exhausted or closed, including
+    when the response is closed before it was ever iterated.
+    """
+
+    def __init__(self, controller, slot, events):
+        self.controller = controller
+        self.slot = slot
+        self.events = events
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.events)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.slot is not None:
+            slot, self.slot = self.slot, None
+            self.controller.release(slot)
+        close = getattr(self.events, "close", None)
+        if close is not None:
+            close()
+
+
+class AsyncAdmittedStream(AdmittedStream):
+    """
+    ``AdmittedStream`` over async ``events``.
+
+    A separate class because ``StreamingHttpResponse`` treats anything that
+    supports ``iter()`` as a sync stream. The slot is released off the event
+    loop, as the backend may block on SQLite.
+    """
+
+    __iter__ = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.events.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if self.slot is not None:
+            slot, self.slot = self.slot, None
+            await sync_to_async(self.controller.release)(slot)
+        aclose = getattr(self.events, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    def close(self):
+        # Called by Django's ASGI handler through sync_to_async once the
+        # response is sent, so there is an event loop to run aclose() on.
+        async_to_sync(self.aclose)()
+
+
+class AdmissionController:
+    def __init__(self, backend, options):
+        self.backend = backend
+        self.enabled = options["ENABLED"]
+        self.request_rate = options["REQUESTS_PER_MINUTE"] / 60
+        self.request_burst = options["REQUEST_BURST"]
+        self.token_rate = options["TOKENS_PER_MINUTE"] / 60
+        self.token_burst = options["TOKEN_BURST"]
+        self.response_tokens = options["RESPONSE_TOKENS"]
+        self.max_in_flight = options["MAX_IN_FLIGHT"]
+        self.max_queue = options["MAX_QUEUE"]
+        self.queue_timeout = options["QUEUE_TIMEOUT"]
+        self.slot_lease = options["SLOT_LEASE"]
+        self.poll_interval = options["POLL_INTERVAL"]
+        self._lock = threading.Lock()
+        self._queue = FairQueue()
+        self.counts = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected": {reason: 0 for reason in AdmissionRejected.MESSAGES},
+        }
+        self.queue_wait_seconds = 0.0
+
+    def estimate_tokens(self, message):
+        return len(message or "") // CHARS_PER_TOKEN + self.response_tokens
+
+    def stats(self):
+        in_flight = self.backend.in_flight()
+        with self._lock:
+            return {
+                "admitted": self.counts["admitted"],
+                "queued": self.counts["queued"],
+                "rejected": dict(self.counts["rejected"]),
+                "queue_wait_seconds": self.queue_wait_seconds,
+                "waiting": self._queue.size,
+                "in_flight": in_flight,
+            }
+
+    def _reject(self, reason, retry_after):
+        with self._lock:
+            self.counts["rejected"][reason] += 1
+        logger.info("Chat request rejected by admission control: %s", reason)
+        return AdmissionRejected(reason, retry_after)
+
+    def check_rate(self, user, *messages):
+        """
+        Charge ``user``'s buckets for one request carrying ``messages`` (one
+        chat turn, or the prompts of a batch) or raise ``AdmissionRejected``.
+        """
+        if not self.enabled:
+            return
+        # Both or neither: a rejected request must not use up the other quota.
+        waits = self.backend.take(
+            [
+                (f"requests:{user.pk}", 1, self.request_burst, self.request_rate),
+                (
+                    f"tokens:{user.pk}",
+                    sum(map(self.estimate_tokens, messages)),
+                    self.token_burst,
+                    self.token_rate,
+                ),
+            ]
+        )
+        for reason, wait in zip(("requests", "tokens"), waits):
+            if wait:
+                raise self._reject(reason, wait)
+
+    def _try_acquire(self, waiter):
+        """One attempt at a slot; only the head of the fair queue may try."""
+        with self._lock:
+            if waiter is None and self._queue.size:
+                return None
+            if waiter is not None and self._queue.head() is not waiter:
+                return None
+        return self.backend.acquire_slot(self.max_in_flight, self.slot_lease)
+
+    def _enqueue(self, user):
+        with self._lock:
+            if self._queue.size >= self.max_queue:
+                full = True
+            else:
+                full = False
+                waiter = Waiter(user.pk)
+                self._queue.push(waiter)
+                self.counts["queued"] += 1
+        if full:
+            raise self._reject("queue_full", self.queue_timeout)
+        return waiter
+
+    def _dequeue(self, waiter, admitted_after=None):
+        with self._lock:
+            self._queue.remove(waiter)
+            head = self._queue.head()
+            if admitted_after is not None:
+                self.counts["admitted"] += 1
+                self.queue_wait_seconds += admitted_after
+        if head is not None:
+            head.event.set()
+
+    def _admitted(self):
+        with self._lock:
+            self.counts["admitted"] += 1
+
+    def enter(self, user, message, charge=True):
+        """
+        Admit one chat turn for ``user`` and return its slot, waiting in the
+        fair queue if needed; raises ``AdmissionRejected``. With ``charge``
+        off, the turn's rates were already checked (say, for its batch).
+        """
+        if not self.enabled:
+            return None
+        with stage("admission"):
+            if charge:
+                self.check_rate(user, message)
+            slot = self._try_acquire(None)
+            if slot is not None:
+                self._admitted()
+                return slot
+
+            waiter = self._enqueue(user)
+            start = time.monotonic()
+            try:
+                while True:
+                    slot = self._try_acquire(waiter)
+                    if slot is not None:
+                        self._dequeue(waiter, time.monotonic() - start)
+                        return slot
+                    remaining = start + self.queue_timeout - time.monotonic()
+                    if remaining <= 0:
+                        raise self._reject("queue_timeout", self.queue_timeout)
+                    waiter.event.wait(min(remaining, self.poll_interval))
+                    waiter.event.clear()
+            except BaseException:
+                self._dequeue(waiter)
+                raise
+
+    async def aenter(self, user, message, charge=True):
+        """Async ``enter``; waiting does not hold a thread."""
+        if not self.enabled:
+            return None
+        with stage("admission"):
+            if charge:
+                await sync_to_async(self.check_rate)(user, message)
+            slot = await sync_to_async(self._try_acquire)(None)
+            if slot is not None:
+                self._admitted()
+                return slot
+
+            waiter = self._enqueue(user)
+            start = time.monotonic()
+            try:
+                while True:
+                    slot = await sync_to_async(self._try_acquire)(waiter)
+                    if slot is not None:
+                        self._dequeue(waiter, time.monotonic() - start)
+                        return slot
+                    remaining = start + self.queue_timeout - time.monotonic()
+                    if remaining <= 0:
+                        raise self._reject("queue_timeout", self.queue_timeout)
+                    await asyncio.sleep(min(remaining, self.poll_interval))
+            except BaseException:
+                self._dequeue(waiter)
+                raise
+
+    def release(self, slot):
+        if slot is None:
+            return
+        self.backend.release_slot(slot)
+        with self._lock:
+            head = self._queue.head()
+        if head is not None:
+            head.event.set()
+
+    @contextmanager
+    def admit(self, user, message, charge=True):
+        slot = self.enter(user, message, charge)
+        try:
+            yield
+        finally:
+            self.release(slot)
+
+    @asynccontextmanager
+    async def aadmit(self, user, message, charge=True):
+        slot = await self.aenter(user, message, charge)
+        try:
+            yield
+        finally:
+            await sync_to_async(self.release)(slot)
+
+    def hold(self, slot, events):
+        """Wrap a response stream so that it keeps ``slot`` until it ends."""
+        if hasattr(events, "__aiter__"):
+            return AsyncAdmittedStream(self, slot, events)
+        return AdmittedStream(self, slot, events)
+
+
+def create_admission_controller():
+    options = {**ADMISSION_DEFAULTS, **getattr(settings, "CHATBOT_ADMISSION", {})}
+    backend = import_string(options["BACKEND"])(**options["OPTIONS"])
+    return AdmissionController(backend, options)
+
+
+admission = create_admission_controller()
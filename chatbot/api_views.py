@@ -1,11 +1,43 @@
+from datetime import datetime, time, timedelta
+
 from rest_framework import generics, permissions, status
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 from django.contrib.auth.models import User
-from .serializers import UserSerializer, ChatSerializer
-from .models import Chat
-from .services import ask_groq
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .serializers import (
+    UserSerializer,
+    ChatSerializer,
+    ChatJobSerializer,
+    ConversationSerializer,
+)
+from .models import Chat, ChatJob, Conversation
+from .pagination import (
+    HISTORY_PAGE_SIZE,
+    ChatCursorPagination,
+    ConversationCursorPagination,
+)
+from .batch import batch_results, parse_batch, run_batch, save_batch
+from .export import EXPORT_FORMATS, aexport_chats, export_chats
+from .persistence import chat_writer
+from .resilience import ChatError
+from .search import (
+    MAX_SEARCH_PAGE_SIZE,
+    SEARCH_PAGE_SIZE,
+    search_chats,
+    search_terms,
+)
+from .admission import AdmissionRejected, admission
+from .authentication import ClaimsUserOnReadMixin, token_cache
+from .jobs import QueueFull, enqueue_chat, job_queue
+from .metrics import stage
+from .streaming import event_stream_response, stream_chat_events
 
 
 class RegisterView(generics.CreateAPIView):
@@ -14,14 +46,42 @@ class RegisterView(generics.CreateAPIView):
     serializer_class = UserSerializer
 
 
-class ChatListCreateView(generics.ListCreateAPIView):
+class ChatListCreateView(ClaimsUserOnReadMixin, generics.ListCreateAPIView):
+    """
+    Chat history, newest first, one cursor page at a time.
+
+    Follow ``next`` to load older chats; ``?page_size=`` sets the page length.
+    """
+
     serializer_class = ChatSerializer
     permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = ChatCursorPagination
 
     def get_queryset(self):
-        return Chat.objects.filter(user=self.request.user).order_by("created_at")
+        return Chat.objects.filter(user_id=self.request.user.id)
+
+    def list(self, request, *args, **kwargs):
+        # The newest page also shows turns not yet written to the database.
+        newest = self.paginator.cursor_query_param not in request.query_params
+        pending = chat_writer.pending(request.user.id) if newest else []
+        response = super().list(request, *args, **kwargs)
+        seen = {chat["id"] for chat in response.data["results"]}
+        unseen = [chat for chat in reversed(pending) if chat.pk not in seen]
+        if unseen:
+            response.data["results"] = (
+                self.get_serializer(unseen, many=True).data + response.data["results"]
+            )
+        return response
 
     def create(self, request, *args, **kwargs):
+        # The LLM stack is loaded by the first chat turn, not at startup.
+        from .services import (
+            ask_groq,
+            request_flag,
+            request_language,
+            wants_fresh_response,
+        )
+
         message = request.data.get("message")
         session_id = request.data.get("session_id")
 
@@ -29,22 +89,317 @@ class ChatListCreateView(generics.ListCreateAPIView):
             return Response(
                 {"error": "Message is required"}, status=status.HTTP_400_BAD_REQUEST
             )
+        try:
+            language = request_language(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         if not session_id:
             # Default to a persistent session for the user if none provided
             session_id = f"user_{request.user.id}"
 
-        response_text = ask_groq(message, session_id)
+        if request_flag(request.data, "background"):
+            # The job queue bounds concurrency itself; only rates apply here.
+            try:
+                admission.check_rate(request.user, message)
+            except AdmissionRejected as e:
+                return chat_error_response(e)
+            return enqueue_response(
+                request.user,
+                message,
+                session_id,
+                language,
+                bypass_cache=wants_fresh_response(request.data),
+            )
+
+        try:
+            with admission.admit(request.user, message):
+                response_text = ask_groq(
+                    message,
+                    session_id,
+                    language,
+                    bypass_cache=wants_fresh_response(request.data),
+                    user_id=request.user.id,
+                )
+        except (AdmissionRejected, ChatError) as e:
+            return chat_error_response(e)
+
+        with stage("db_write"):
+            chat = Chat(
+                user=request.user,
+                session_id=session_id,
+                message=message,
+                response=response_text,
+            )
+            # The response carries the row's id.
+            chat_writer.write(chat)
+
+        with stage("serialize"):
+            data = self.get_serializer(chat).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+class ChatBatchView(APIView):
+    """
+    Answer a batch of independent prompts concurrently (see chatbot/batch.py).
+
+    ``prompts`` lists messages or ``{"message", "session_id", "language"}``
+    objects. The results come back in the same order, each with its chat or
+    with an ``error`` and ``code``.
+    """
+
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request):
+        from .services import wants_fresh_response
+
+        try:
+            items = parse_batch(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            admission.check_rate(request.user, *(item.message for item in items))
+        except AdmissionRejected as e:
+            return chat_error_response(e)
+        run_batch(request.user, items, bypass_cache=wants_fresh_response(request.data))
+        save_batch(request.user, items)
+        with stage("serialize"):
+            results = batch_results(items, lambda chat: ChatSerializer(chat).data)
+        return Response({"results": results})
+
+
+def chat_error_response(error):
+    headers = {}
+    if error.retry_after is not None:
+        headers["Retry-After"] = str(error.retry_after)
+    return Response(error.as_dict(), status=error.status, headers=headers)
+
+
+def enqueue_response(user, message, session_id, language, bypass_cache=False):
+    """Queue a chat message as a background job; 202 with its id, or 429."""
+    try:
+        job = enqueue_chat(
+            user, message, session_id, language, bypass_cache=bypass_cache
+        )
+    except QueueFull as e:
+        return Response(
+            {"error": "Too many messages are queued, please retry later"},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    return Response(
+        {"job_id": str(job.pk), "status": job.status},
+        status=status.HTTP_202_ACCEPTED,
+    )
+
+
+class ChatSearchView(ClaimsUserOnReadMixin, APIView):
+    """
+    Full-text search of the user's chats, newest first.
+
+    ``?q=`` holds the words to find, all of which must match. Follow ``next``
+    for older results; ``?page_size=`` sets the page length. Snippets are HTML
+    with the matched words in ``<mark>`` (see chatbot/search.py).
+    """
+
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request):
+        query = request.query_params.get("q", "")
+        if not search_terms(query):
+            return Response(
+                {"error": "A search query is required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            before = request.query_params.get("before")
+            before = int(before) if before else None
+            page_size = int(request.query_params.get("page_size", SEARCH_PAGE_SIZE))
+        except ValueError:
+            return Response(
+                {"error": "before and page_size must be integers"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        page_size = min(max(page_size, 1), MAX_SEARCH_PAGE_SIZE)
+
+        with stage("search"):
+            results, next_before = search_chats(
+                request.user.id, query, before, page_size
+            )
+        next_url = None
+        if next_before is not None:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), "before", next_before
+            )
+        return Response({"next": next_url, "results": results})
+
+
+def parse_bound(value, end=False):
+    """
+    An aware datetime for a ``since``/``until`` date or datetime, or ``None``.
+
+    A bare date stands for its whole day: the start of it, or with ``end``
+    the start of the next one.
+    """
+    try:
+        # Before parse_datetime(), which reads a bare date as its midnight.
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        return None
+    if day is not None:
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time())
+    if moment is None:
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class ExportNegotiation(DefaultContentNegotiation):
+    """Leaves ``?format=`` to the export view; its errors are always JSON."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class ChatExportView(ClaimsUserOnReadMixin, APIView):
+    """
+    Download the user's chat history, oldest first, streamed as it is read.
+
+    ``?format=`` is ``jsonl`` (the default), ``csv`` or ``md``. ``?since=``
+    and ``?until=`` (dates or ISO datetimes; a date ends with its day) bound
+    the chats' creation time, ``?conversation=`` keeps one conversation's
+    chats, and ``?gzip=1`` compresses the file (see chatbot/export.py).
+    """
+
+    permission_classes = (permissions.IsAuthenticated,)
+    renderer_classes = (JSONRenderer,)
+    content_negotiation_class = ExportNegotiation
+
+    def get(self, request):
+        params = request.query_params
+        format = params.get("format", "jsonl")
+        if format not in EXPORT_FORMATS:
+            return Response(
+                {"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        chats = Chat.objects.filter(user_id=request.user.id)
+        for name, lookup in (("since", "created_at__gte"), ("until", "created_at__lt")):
+            if params.get(name):
+                bound = parse_bound(params[name], end=name == "until")
+                if bound is None:
+                    return Response(
+                        {"error": f"{name} must be a date or an ISO datetime"},
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
+                chats = chats.filter(**{lookup: bound})
+        if params.get("conversation"):
+            try:
+                conversation_id = int(params["conversation"])
+            except ValueError:
+                return Response(
+                    {"error": "conversation must be an integer"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            conversation = generics.get_object_or_404(
+                Conversation.objects.filter(user_id=request.user.id),
+                pk=conversation_id,
+            )
+            chats = chats.filter(conversation=conversation)
+        compress = str(params.get("gzip", "")).lower() in ("1", "true", "yes", "on")
+
+        # Written first, so that the export has the latest turns.
+        chat_writer.flush()
+        _, content_type = EXPORT_FORMATS[format]
+        filename = f"chats-{timezone.now():%Y%m%d}.{format}"
+        if compress:
+            content_type = "application/gzip"
+            filename += ".gz"
+        # An ASGI server is handed an async stream, which it reads as it sends.
+        stream = (
+            aexport_chats if isinstance(request._request, ASGIRequest) else export_chats
+        )
+        response = StreamingHttpResponse(
+            stream(chats, format, compress), content_type=content_type
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        # Stop nginx from buffering the stream.
+        response["X-Accel-Buffering"] = "no"
+        return response
+
 
-        chat = Chat.objects.create(
-            user=request.user,
-            message=message,
-            response=response_text,
-            created_at=timezone.now(),
+class ChatJobView(ClaimsUserOnReadMixin, generics.RetrieveAPIView):
+    """
+    Status of a background chat job.
+
+    Pass ``?wait=<seconds>`` (at most ``MAX_WAIT``) to long-poll until the job
+    finishes instead of returning its current status right away.
+    """
+
+    MAX_WAIT = 30
+
+    serializer_class = ChatJobSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    lookup_url_kwarg = "job_id"
+
+    def get_queryset(self):
+        return ChatJob.objects.filter(user_id=self.request.user.id).select_related(
+            "chat"
         )
 
-        serializer = self.get_serializer(chat)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    def get_object(self):
+        job = super().get_object()
+        if not job.is_finished and job_queue.reap([job.pk]):
+            job.refresh_from_db()
+        try:
+            wait = min(float(self.request.query_params.get("wait", 0)), self.MAX_WAIT)
+        except ValueError:
+            wait = 0
+        if wait > 0 and not job.is_finished:
+            job_queue.wait(job.pk, wait)
+            job = super().get_object()
+        return job
+
+
+class ChatStreamView(APIView):
+    """Stream the response to a chat message as server-sent events."""
+
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request):
+        from .services import request_language, wants_fresh_response
+
+        message = request.data.get("message")
+        session_id = request.data.get("session_id")
+
+        if not message:
+            return Response(
+                {"error": "Message is required"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            language = request_language(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not session_id:
+            session_id = f"user_{request.user.id}"
+
+        try:
+            slot = admission.enter(request.user, message)
+        except AdmissionRejected as e:
+            return chat_error_response(e)
+
+        events = stream_chat_events(
+            request.user,
+            message,
+            session_id,
+            language,
+            serialize=lambda chat: ChatSerializer(chat).data,
+            bypass_cache=wants_fresh_response(request.data),
+        )
+        return event_stream_response(admission.hold(slot, events))
 
 
 class ClearSessionView(APIView):
@@ -58,9 +413,102 @@ class ClearSessionView(APIView):
         if not session_id:
             session_id = f"user_{request.user.id}"
 
-        from .services import session_store
+        from .services import session_key, session_store
 
-        if session_id in session_store:
-            del session_store[session_id]
+        if session_store.delete(session_key(request.user.id, session_id)):
             return Response({"message": "Session history cleared"})
         return Response({"message": "No active session to clear"})
+
+
+class ConversationListView(ClaimsUserOnReadMixin, generics.ListAPIView):
+    """
+    The user's conversations, most recent first, with their last message.
+
+    Follow ``next`` to load older conversations; ``?page_size=`` sets the page
+    length.
+    """
+
+    serializer_class = ConversationSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = ConversationCursorPagination
+
+    def get_queryset(self):
+        return Conversation.objects.filter(user_id=self.request.user.id)
+
+
+class ConversationDetailView(ClaimsUserOnReadMixin, generics.RetrieveDestroyAPIView):
+    """One conversation; ``DELETE`` removes it along with its chats and memory."""
+
+    serializer_class = ConversationSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get_queryset(self):
+        return Conversation.objects.filter(user_id=self.request.user.id)
+
+    def perform_destroy(self, instance):
+        from .services import session_key, session_store
+
+        # Written first, so that no buffered turn re-creates the conversation.
+        chat_writer.flush()
+        session_store.delete(session_key(instance.user_id, instance.session_id))
+        instance.delete()
+
+
+class ConversationResumeView(APIView):
+    """
+    Pick a conversation back up: rebuild its memory from the database if this
+    worker no longer holds it, and return it with its latest chats. Continue
+    it by posting to the chat API with the returned ``session_id``.
+    """
+
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request, pk):
+        from .services import session_key, session_store
+
+        conversation = generics.get_object_or_404(
+            Conversation.objects.filter(user_id=request.user.id), pk=pk
+        )
+        chat_writer.flush()
+        # Turns whose memory was cleared keep their conversation but lose
+        # their session_id, and stay out of the rebuilt memory.
+        chats = conversation.chats.filter(session_id=conversation.session_id)
+
+        def load_turns(limit):
+            rows = chats.order_by("-id").values_list("message", "response")
+            return list(rows[:limit] if limit else rows)[::-1]
+
+        with stage("history"):
+            session_store.resume(
+                session_key(conversation.user_id, conversation.session_id),
+                load_turns,
+            )
+            recent = list(conversation.chats.order_by("-id")[:HISTORY_PAGE_SIZE])
+        return Response(
+            {
+                **ConversationSerializer(conversation).data,
+                "chats": ChatSerializer(recent[::-1], many=True).data,
+            }
+        )
+
+
+class StatsView(APIView):
+    """Counters of the chat pipeline, for operators."""
+
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        from .services import response_cache, router, session_store, upstream
+
+        return Response(
+            {
+                "admission": admission.stats(),
+                "upstream": upstream.stats(),
+                "routing": router.stats(),
+                "response_cache": response_cache.stats(),
+                "sessions": session_store.stats(),
+                "jobs": job_queue.stats(),
+                "auth_cache": token_cache.stats(),
+                "chat_writer": chat_writer.stats(),
+            }
+        )
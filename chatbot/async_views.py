@@ -0,0 +1,306 @@
+"""
+Async versions of the chat views, routed instead of the sync ones when
+``CHATBOT_ASYNC_VIEWS`` is enabled (the default under ASGI).
+
+A chat turn is handled on the event loop, so an in-flight model call does not
+pin a thread. Requests that only read from the database (page renders,
+history lists) are handed to the existing sync views.
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+
+from . import api_views, views
+from .admission import AdmissionRejected, admission
+from .batch import arun_batch, batch_results, parse_batch, save_batch
+from .authentication import CachedJWTAuthentication
+from .jobs import QueueFull, enqueue_chat
+from .metrics import stage
+from .models import Chat
+from .persistence import chat_writer
+from .resilience import ChatError
+from .serializers import ChatSerializer
+from .streaming import astream_chat_events, event_stream_response
+
+chat_list_view = api_views.ChatListCreateView.as_view()
+
+
+async def authenticate(request):
+    """
+    Authenticate an API request with its JWT, as DRF would.
+
+    Returns ``(user, None)`` on success or ``(None, error_response)``.
+    """
+    try:
+        result = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return None, JsonResponse({"detail": e.detail}, status=401)
+    if result is None:
+        return None, JsonResponse(
+            {"detail": "Authentication credentials were not provided."}, status=401
+        )
+    return result[0], None
+
+
+def request_data(request):
+    """The request's form or JSON data; raises ``ValueError`` if not an object."""
+    if request.content_type != "application/json":
+        return request.POST
+    data = json.loads(request.body or b"{}")
+    if not isinstance(data, dict):
+        raise ValueError("The request body must be a JSON object")
+    return data
+
+
+def bad_request(error):
+    return JsonResponse({"error": str(error)}, status=400)
+
+
+async def get_chat_session_id(request, user):
+    """Async ``views.get_chat_session_id``."""
+    session_id = await request.session.aget("chat_session_id")
+    if not session_id:
+        session_id = f"user_{user.id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
+        await request.session.aset("chat_session_id", session_id)
+    return session_id
+
+
+@login_required(login_url="chatbot:login")
+async def chatbot(request):
+    if request.method != "POST":
+        return await sync_to_async(views.chatbot)(request)
+    from .services import aask_groq, request_language, wants_fresh_response
+
+    user = await request.auser()
+    message = request.POST.get("message")
+    if not message:
+        return JsonResponse({"error": "Message is required"}, status=400)
+    try:
+        language = request_language(request.POST)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    session_id = await get_chat_session_id(request, user)
+
+    try:
+        async with admission.aadmit(user, message):
+            response = await aask_groq(
+                message,
+                session_id,
+                language,
+                bypass_cache=wants_fresh_response(request.POST),
+                user_id=user.id,
+            )
+    except (AdmissionRejected, ChatError) as e:
+        return views.chat_error_response(e)
+    with stage("db_write"):
+        await chat_writer.asubmit(
+            Chat(
+                user=user,
+                session_id=session_id,
+                message=message,
+                response=response,
+            )
+        )
+    return JsonResponse(
+        {"message": message, "response": response, "session_id": session_id}
+    )
+
+
+@login_required(login_url="chatbot:login")
+async def chatbot_stream(request):
+    from .services import request_language, wants_fresh_response
+
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    message = request.POST.get("message")
+    if not message:
+        return JsonResponse({"error": "Message is required"}, status=400)
+    try:
+        language = request_language(request.POST)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    user = await request.auser()
+    session_id = await get_chat_session_id(request, user)
+    try:
+        slot = await admission.aenter(user, message)
+    except AdmissionRejected as e:
+        return views.chat_error_response(e)
+
+    def serialize(chat):
+        return {
+            "message": chat.message,
+            "response": chat.response,
+            "response_html": chat.rendered_response,
+            "session_id": session_id,
+        }
+
+    events = astream_chat_events(
+        user,
+        message,
+        session_id,
+        language,
+        serialize,
+        bypass_cache=wants_fresh_response(request.POST),
+    )
+    return event_stream_response(admission.hold(slot, events))
+
+
+@csrf_exempt
+async def api_chat(request):
+    if request.method != "POST":
+        return await sync_to_async(chat_list_view)(request)
+    from .services import (
+        aask_groq,
+        request_flag,
+        request_language,
+        wants_fresh_response,
+    )
+
+    user, error = await authenticate(request)
+    if error:
+        return error
+    try:
+        data = request_data(request)
+    except ValueError as e:
+        return bad_request(e)
+    message = data.get("message")
+    session_id = data.get("session_id")
+
+    if not message:
+        return JsonResponse({"error": "Message is required"}, status=400)
+    try:
+        language = request_language(data)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    if not session_id:
+        session_id = f"user_{user.id}"
+
+    if request_flag(data, "background"):
+        try:
+            await sync_to_async(admission.check_rate)(user, message)
+        except AdmissionRejected as e:
+            return views.chat_error_response(e)
+        try:
+            job = await sync_to_async(enqueue_chat)(
+                user,
+                message,
+                session_id,
+                language,
+                bypass_cache=wants_fresh_response(data),
+            )
+        except QueueFull as e:
+            response = JsonResponse(
+                {"error": "Too many messages are queued, please retry later"},
+                status=429,
+            )
+            response["Retry-After"] = str(e.retry_after)
+            return response
+        return JsonResponse({"job_id": str(job.pk), "status": job.status}, status=202)
+
+    try:
+        async with admission.aadmit(user, message):
+            response_text = await aask_groq(
+                message,
+                session_id,
+                language,
+                bypass_cache=wants_fresh_response(data),
+                user_id=user.id,
+            )
+    except (AdmissionRejected, ChatError) as e:
+        return views.chat_error_response(e)
+    with stage("db_write"):
+        chat = Chat(
+            user=user,
+            session_id=session_id,
+            message=message,
+            response=response_text,
+        )
+        # The response carries the row's id.
+        await chat_writer.awrite(chat)
+    with stage("serialize"):
+        data = ChatSerializer(chat).data
+    return JsonResponse(data, status=201)
+
+
+@csrf_exempt
+async def api_chat_stream(request):
+    if request.method != "POST":
+        return JsonResponse(
+            {"detail": f'Method "{request.method}" not allowed.'}, status=405
+        )
+    from .services import request_language, wants_fresh_response
+
+    user, error = await authenticate(request)
+    if error:
+        return error
+    try:
+        data = request_data(request)
+    except ValueError as e:
+        return bad_request(e)
+    message = data.get("message")
+    session_id = data.get("session_id")
+
+    if not message:
+        return JsonResponse({"error": "Message is required"}, status=400)
+    try:
+        language = request_language(data)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    if not session_id:
+        session_id = f"user_{user.id}"
+
+    try:
+        slot = await admission.aenter(user, message)
+    except AdmissionRejected as e:
+        return views.chat_error_response(e)
+
+    events = astream_chat_events(
+        user,
+        message,
+        session_id,
+        language,
+        serialize=lambda chat: ChatSerializer(chat).data,
+        bypass_cache=wants_fresh_response(data),
+    )
+    return event_stream_response(admission.hold(slot, events))
+
+
+@csrf_exempt
+async def api_chat_batch(request):
+    if request.method != "POST":
+        return JsonResponse(
+            {"detail": f'Method "{request.method}" not allowed.'}, status=405
+        )
+    from .services import wants_fresh_response
+
+    user, error = await authenticate(request)
+    if error:
+        return error
+    try:
+        data = request_data(request)
+    except ValueError as e:
+        return bad_request(e)
+    try:
+        items = parse_batch(data)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    try:
+        await sync_to_async(admission.check_rate)(
+            user, *(item.message for item in items)
+        )
+    except AdmissionRejected as e:
+        return views.chat_error_response(e)
+    await arun_batch(user, items, bypass_cache=wants_fresh_response(data))
+    await sync_to_async(save_batch)(user, items)
+    with stage("serialize"):
+        results = batch_results(items, lambda chat: ChatSerializer(chat).data)
+    return JsonResponse({"results": results})
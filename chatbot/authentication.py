@@ -0,0 +1,162 @@
+"""
+JWT authentication for the API.
+
+``CachedJWTAuthentication`` remembers the user each verified access token
+belongs to, so repeat requests with the same token neither re-verify it nor
+query the database. Entries live until the token expires or ``MAX_AGE``
+seconds pass, whichever is first, and a user's entries are dropped when the
+user is saved (a password change, deactivation, ...). The cache is per
+process: ``MAX_AGE`` bounds how long another worker may keep accepting a user
+it has not seen change. Logging out of a session does not revoke a JWT, so it
+leaves the cache alone too. Each request gets its own copy of the cached user.
+
+``ClaimsJWTAuthentication`` skips the user lookup altogether and gives the
+request a ``TokenUser`` built from the token's claims. It suits read-only
+endpoints that only need ``request.user.id`` and can accept a revoked token,
+or the token of a deactivated user, until it expires; use
+``ClaimsUserOnReadMixin`` to apply it to a view's safe methods.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .metrics import stage
+
+AUTH_CACHE_DEFAULTS = {
+    "MAX_ENTRIES": 10000,
+    "MAX_AGE": 300,
+}
+auth_cache_settings = {
+    **AUTH_CACHE_DEFAULTS,
+    **getattr(settings, "CHATBOT_AUTH_CACHE", {}),
+}
+
+
+class TokenCache:
+    """Bounded LRU map of raw access token -> ``(user, validated_token)``."""
+
+    def __init__(self, max_entries=10000, max_age=300, clock=time.time):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.clock = clock
+        self._lock = threading.Lock()
+        # raw token -> (user, validated token, expires at); oldest use first.
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, raw_token):
+        with self._lock:
+            entry = self._entries.get(raw_token)
+            if entry is not None and entry[2] > self.clock():
+                self._entries.move_to_end(raw_token)
+                self.hits += 1
+                # Not the cached instance: requests may run concurrently.
+                return copy.copy(entry[0]), entry[1]
+            if entry is not None:
+                del self._entries[raw_token]
+            self.misses += 1
+            return None
+
+    def set(self, raw_token, user, validated_token):
+        expires_at = self.clock() + self.max_age
+        if "exp" in validated_token:
+            expires_at = min(expires_at, validated_token["exp"])
+        with self._lock:
+            self._entries[raw_token] = (user, validated_token, expires_at)
+            self._entries.move_to_end(raw_token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            stale = [
+                raw_token
+                for raw_token, entry in self._entries.items()
+                if entry[0].pk == user_id
+            ]
+            for raw_token in stale:
+                del self._entries[raw_token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+token_cache = TokenCache(
+    auth_cache_settings["MAX_ENTRIES"], auth_cache_settings["MAX_AGE"]
+)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_saved_user(instance, **kwargs):
+    token_cache.invalidate_user(instance.pk)
+
+
+class TimedJWTAuthentication(JWTAuthentication):
+    """``JWTAuthentication`` that records its work as the ``auth`` stage."""
+
+    def authenticate(self, request):
+        with stage("auth"):
+            return self.authenticate_token(request)
+
+    def authenticate_token(self, request):
+        return super().authenticate(request)
+
+
+class CachedJWTAuthentication(TimedJWTAuthentication):
+    """JWT authentication backed by ``token_cache``; see the module docstring."""
+
+    def authenticate_token(self, request):
+        header = self.get_header(request)
+        raw_token = None if header is None else self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        cached = token_cache.get(raw_token)
+        if cached is not None:
+            return cached
+        result = super().authenticate_token(request)
+        if result is not None:
+            token_cache.set(raw_token, *result)
+        return result
+
+
+class ClaimsJWTAuthentication(TimedJWTAuthentication):
+    """
+    JWT authentication that trusts the token's claims instead of loading the
+    user; ``request.user`` is a ``TokenUser`` with the id and no database row.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        return api_settings.TOKEN_USER_CLASS(validated_token)
+
+
+class ClaimsUserOnReadMixin:
+    """Authenticate a view's safe methods with ``ClaimsJWTAuthentication``."""
+
+    def get_authenticators(self):
+        if self.request.method in SAFE_METHODS:
+            return [ClaimsJWTAuthentication()]
+        return super().get_authenticators()
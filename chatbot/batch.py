@@ -0,0 +1,217 @@
+"""
+Batches of independent chat prompts, answered concurrently.
+
+A batch is a list of prompts, each with an optional ``session_id``. Prompts
+of the same session are answered one after the other, in order, since each
+turn is part of the next one's context. Different sessions are answered
+concurrently, at most ``CONCURRENCY`` at a time, so a batch takes about as
+long as its slowest session rather than the sum of its calls. A prompt
+without a session is answered on its own, with no history, and its turn is
+stored outside any conversation.
+
+A batch is charged to the user's rate limits once, as one request carrying
+the estimated tokens of all its prompts, and is refused as a whole if that
+fails. Each prompt then takes a global in-flight slot like a single chat
+turn; one that gets none, or that the model cannot answer, gets an error in
+its slot of the results while the others are answered. The answered turns
+are then written with one ``bulk_create`` (see ``persistence.insert_chats``).
+It is configured with the ``CHATBOT_BATCH`` setting.
+"""
+
+import asyncio
+import contextvars
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .admission import AdmissionRejected, admission
+from .metrics import stage
+from .models import Chat
+from .persistence import chat_writer, insert_chats
+from .resilience import ChatError
+
+BATCH_DEFAULTS = {
+    # Prompts accepted in one request.
+    "MAX_ITEMS": 50,
+    # Sessions of a batch answered at the same time.
+    "CONCURRENCY": 8,
+}
+batch_settings = {**BATCH_DEFAULTS, **getattr(settings, "CHATBOT_BATCH", {})}
+
+
+class BatchItem:
+    """One prompt of a batch and, once answered, its turn or its error."""
+
+    def __init__(self, index, message, session_id="", language="English"):
+        self.index = index
+        self.message = message
+        self.session_id = session_id
+        self.language = language
+        # Session whose memory answers the prompt; a throwaway one if none.
+        self.memory_key = session_id or f"batch_{uuid.uuid4().hex}"
+        self.answer = None
+        self.answered_at = None
+        self.error = None
+        self.chat = None
+
+
+def parse_batch(data, max_items=None):
+    """
+    The ``BatchItem``s of a batch request, or raise ``ValueError``.
+
+    ``data["prompts"]`` lists messages or ``{"message", "session_id",
+    "language"}`` objects; ``data["language"]`` is the default language.
+    """
+    from .services import request_language
+
+    max_items = max_items or batch_settings["MAX_ITEMS"]
+    prompts = data.get("prompts")
+    if not isinstance(prompts, list) or not prompts:
+        raise ValueError("prompts must be a non-empty list")
+    if len(prompts) > max_items:
+        raise ValueError(f"A batch holds at most {max_items} prompts")
+    language = request_language(data)
+    items = []
+    for index, prompt in enumerate(prompts):
+        if isinstance(prompt, str):
+            prompt = {"message": prompt}
+        if not isinstance(prompt, dict):
+            raise ValueError(f"prompts[{index}] must be a string or an object")
+        message = prompt.get("message")
+        session_id = prompt.get("session_id") or ""
+        if not isinstance(message, str) or not message:
+            raise ValueError(f"prompts[{index}] has no message")
+        if not isinstance(session_id, str):
+            raise ValueError(f"prompts[{index}].session_id must be a string")
+        try:
+            item_language = request_language(
+                {"language": prompt.get("language") or language}
+            )
+        except ValueError as e:
+            raise ValueError(f"prompts[{index}]: {e}") from None
+        items.append(BatchItem(index, message, session_id, item_language))
+    return items
+
+
+def session_groups(items):
+    """``items`` grouped by session, in order; sessionless items stand alone."""
+    groups = {}
+    for item in items:
+        groups.setdefault(item.session_id or item.index, []).append(item)
+    return list(groups.values())
+
+
+def answer_group(user, group, bypass_cache):
+    from .services import ask_groq, session_key, session_store
+
+    try:
+        for item in group:
+            try:
+                with admission.admit(user, item.message, charge=False):
+                    item.answer = ask_groq(
+                        item.message,
+                        item.memory_key,
+                        item.language,
+                        bypass_cache,
+                        user_id=user.id,
+                    )
+                item.answered_at = timezone.now()
+            except (AdmissionRejected, ChatError) as e:
+                item.error = e
+            finally:
+                if not item.session_id:
+                    session_store.forget(session_key(user.id, item.memory_key))
+    finally:
+        # Nothing else closes the connections of the pool's threads.
+        connections.close_all()
+
+
+def run_batch(user, items, bypass_cache=False, concurrency=None):
+    """Answer ``items`` on a pool of threads; see the module docstring."""
+    groups = session_groups(items)
+    workers = min(concurrency or batch_settings["CONCURRENCY"], len(groups))
+    with ThreadPoolExecutor(workers, thread_name_prefix="chat-batch") as pool:
+        futures = [
+            # Each thread reports its stages to the request's trace.
+            pool.submit(
+                contextvars.copy_context().run,
+                answer_group,
+                user,
+                group,
+                bypass_cache,
+            )
+            for group in groups
+        ]
+        for future in futures:
+            future.result()
+
+
+async def aanswer_group(user, group, bypass_cache, semaphore):
+    from .services import aask_groq, session_key, session_store
+
+    async with semaphore:
+        for item in group:
+            try:
+                async with admission.aadmit(user, item.message, charge=False):
+                    item.answer = await aask_groq(
+                        item.message,
+                        item.memory_key,
+                        item.language,
+                        bypass_cache,
+                        user_id=user.id,
+                    )
+                item.answered_at = timezone.now()
+            except (AdmissionRejected, ChatError) as e:
+                item.error = e
+            finally:
+                if not item.session_id:
+                    await sync_to_async(session_store.forget)(
+                        session_key(user.id, item.memory_key)
+                    )
+
+
+async def arun_batch(user, items, bypass_cache=False, concurrency=None):
+    """Async ``run_batch``: the sessions are tasks on the event loop."""
+    semaphore = asyncio.Semaphore(concurrency or batch_settings["CONCURRENCY"])
+    await asyncio.gather(
+        *(
+            aanswer_group(user, group, bypass_cache, semaphore)
+            for group in session_groups(items)
+        )
+    )
+
+
+def save_batch(user, items):
+    """Write the answered turns of ``items`` in one query, setting ``item.chat``."""
+    for item in items:
+        if item.answer is not None:
+            item.chat = Chat(
+                user=user,
+                session_id=item.session_id,
+                message=item.message,
+                response=item.answer,
+                created_at=item.answered_at,
+            )
+    chats = [item.chat for item in items if item.chat is not None]
+    if chats:
+        with stage("db_write"):
+            # Earlier turns of these sessions still buffered go in first.
+            chat_writer.flush()
+            insert_chats(chats)
+
+
+def batch_results(items, serialize):
+    """The outcome of each of ``items``, in order, for the response."""
+    results = []
+    for item in items:
+        result = {"index": item.index, "session_id": item.session_id}
+        if item.error is not None:
+            result.update(message=item.message, **item.error.as_dict())
+        else:
+            result.update(serialize(item.chat))
+        results.append(result)
+    return results
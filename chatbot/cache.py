@@ -0,0 +1,241 @@
+"""
+Response cache for stateless first turns.
+
+The exact tier maps a normalized prompt (scoped by model, language and system
+prompt) to a stored answer. The optional semantic tier embeds prompts locally
+with feature hashing and serves a stored answer when a new prompt is close
+enough to a cached one, which catches rephrasings such as different casing,
+punctuation or word order. Trigram similarity alone cannot tell "with
+alcohol" from "without alcohol", so a semantic hit also requires both prompts
+to have the same content words (the words left after dropping stopwords).
+"""
+
+import hashlib
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+_WORD_RE = re.compile(r"\w+")
+_SPACE_RE = re.compile(r"\s+")
+
+# Words that do not change what a prompt asks. Negations and prepositions
+# such as "not", "no" and "without" are left out on purpose.
+STOPWORDS = frozenset("""
+    a an the is are was were be been am do does did can could should would
+    will shall may might must i me my you your we our it its this that these
+    those there here what which who whom how please tell to of in on at for
+    with by from about as and or so just
+    """.split())
+
+
+def normalize_prompt(text):
+    text = _SPACE_RE.sub(" ", text.strip().lower())
+    return text.strip(" .!?")
+
+
+def content_words(prompt):
+    """The words of a normalized ``prompt`` that are not ``STOPWORDS``."""
+    return frozenset(_WORD_RE.findall(prompt)) - STOPWORDS
+
+
+class HashingEmbedder:
+    """
+    Dependency-free text embedding: word unigrams and character trigrams are
+    hashed into a fixed number of signed dimensions and L2-normalized.
+    """
+
+    def __init__(self, dimensions=512):
+        self.dimensions = dimensions
+
+    def features(self, text):
+        words = _WORD_RE.findall(text)
+        yield from words
+        for word in words:
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                yield padded[i : i + 3]
+
+    def embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in self.features(text):
+            digest = zlib.crc32(feature.encode("utf-8"))
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            vector[digest % self.dimensions] += sign
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector
+
+
+class SemanticIndex:
+    """
+    Fixed-capacity ring buffer of prompt embeddings searched by cosine.
+
+    Each embedding is stored with its exact-tier key and the prompt's content
+    words. A removed entry keeps its slot, with a zero vector, until the ring
+    comes around to it.
+    """
+
+    def __init__(self, max_entries, dimensions):
+        self.max_entries = max_entries
+        self.vectors = np.zeros((max_entries, dimensions), dtype=np.float32)
+        self.entries = [None] * max_entries
+        self.size = 0
+        self._next = 0
+        # exact-tier key -> slot
+        self._slots = {}
+
+    def __len__(self):
+        return len(self._slots)
+
+    def add(self, vector, key, words):
+        self.remove(key)
+        slot = self._next
+        if self.entries[slot] is not None:
+            del self._slots[self.entries[slot][0]]
+        self.vectors[slot] = vector
+        self.entries[slot] = (key, words)
+        self._slots[key] = slot
+        self._next = (slot + 1) % self.max_entries
+        self.size = min(self.size + 1, self.max_entries)
+
+    def remove(self, key):
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self.vectors[slot] = 0
+            self.entries[slot] = None
+
+    def search(self, vector, threshold):
+        """Yield the ``(key, words)`` of prompts at least ``threshold`` close."""
+        if not self.size:
+            return
+        scores = self.vectors[: self.size] @ vector
+        for slot in np.argsort(scores)[::-1]:
+            if scores[slot] < threshold:
+                return
+            if self.entries[slot] is not None:
+                yield self.entries[slot]
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries=10000,
+        ttl=24 * 60 * 60,
+        semantic=False,
+        semantic_threshold=0.9,
+        semantic_max_entries=5000,
+        dimensions=512,
+        clock=time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic = semantic
+        self.semantic_threshold = semantic_threshold
+        self.semantic_max_entries = semantic_max_entries
+        self.clock = clock
+        self.embedder = HashingEmbedder(dimensions)
+        self._lock = threading.Lock()
+        # key -> (answer, expires_at, scope); least recently used first.
+        self._entries = OrderedDict()
+        # scope -> SemanticIndex of the entries' prompts.
+        self._indexes = {}
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+        self.bypassed = 0
+
+    @staticmethod
+    def scope(model, language, system_prompt_digest):
+        return f"{model}\0{language}\0{system_prompt_digest}"
+
+    @staticmethod
+    def key(scope, prompt):
+        digest = hashlib.sha256(f"{scope}\0{prompt}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, scope, message):
+        prompt = normalize_prompt(message)
+        key = self.key(scope, prompt)
+        now = self.clock()
+        with self._lock:
+            answer = self._lookup(key, now)
+            if answer is not None:
+                self.hits["exact"] += 1
+                return answer
+
+            index = self._indexes.get(scope) if self.semantic else None
+            if index is not None:
+                words = content_words(prompt)
+                vector = self.embedder.embed(prompt)
+                for match, match_words in list(
+                    index.search(vector, self.semantic_threshold)
+                ):
+                    if match_words != words:
+                        continue
+                    answer = self._lookup(match, now)
+                    if answer is not None:
+                        self.hits["semantic"] += 1
+                        return answer
+
+            self.misses += 1
+            return None
+
+    def _lookup(self, key, now):
+        """The live answer stored under ``key``; drops it if it expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            self._evict(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _evict(self, key):
+        """Drop ``key`` from the exact tier and its prompt from the index."""
+        _, _, scope = self._entries.pop(key)
+        index = self._indexes.get(scope)
+        if index is not None:
+            index.remove(key)
+
+    def set(self, scope, message, answer):
+        prompt = normalize_prompt(message)
+        key = self.key(scope, prompt)
+        expires_at = self.clock() + self.ttl
+        with self._lock:
+            self._entries[key] = (answer, expires_at, scope)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+            if self.semantic:
+                index = self._indexes.get(scope)
+                if index is None:
+                    index = self._indexes[scope] = SemanticIndex(
+                        self.semantic_max_entries, self.embedder.dimensions
+                    )
+                index.add(self.embedder.embed(prompt), key, content_words(prompt))
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._indexes.clear()
+
+    def stats(self):
+        with self._lock:
+            hits = sum(self.hits.values())
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": dict(self.hits),
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
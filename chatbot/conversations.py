@@ -0,0 +1,91 @@
+"""
+Upkeep of ``Conversation`` rows as chat turns are written.
+
+Turns are written one at a time by ``Chat.save`` or in batches by the chat
+writer (chatbot/persistence.py). Either way, ``attach_conversations`` links
+them to the conversation of their session, creating it for a session's first
+turn, and once they are in the database ``record_turns`` folds them into the
+conversation's last message and count with one UPDATE per conversation.
+"""
+
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+
+from .models import Conversation
+
+
+def preview(text):
+    """``text`` on one line, cut to fit ``Conversation.PREVIEW_LENGTH``."""
+    text = " ".join(text.split())
+    limit = Conversation.PREVIEW_LENGTH
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def attach_conversations(chats):
+    """Set the conversation of each unsaved chat in ``chats`` from its session."""
+    chats = [chat for chat in chats if chat.conversation_id is None and chat.session_id]
+    if not chats:
+        return
+    keys = {(chat.user_id, chat.session_id) for chat in chats}
+    found = Conversation.objects.filter(
+        user_id__in={user_id for user_id, _ in keys},
+        session_id__in={session_id for _, session_id in keys},
+    ).values_list("user_id", "session_id", "id")
+    conversations = {(user_id, session_id): pk for user_id, session_id, pk in found}
+    for chat in chats:
+        key = (chat.user_id, chat.session_id)
+        if key not in conversations:
+            conversations[key] = create_conversation(chat)
+        chat.conversation_id = conversations[key]
+
+
+def create_conversation(first_chat):
+    """Id of a new conversation started by ``first_chat``, or ``None``."""
+    try:
+        with transaction.atomic():
+            return Conversation.objects.create(
+                user_id=first_chat.user_id,
+                session_id=first_chat.session_id,
+                title=preview(first_chat.message),
+                last_message_at=first_chat.created_at,
+                created_at=first_chat.created_at,
+            ).pk
+    except IntegrityError:
+        # Another worker created it first, or the user was deleted.
+        return (
+            Conversation.objects.filter(
+                user_id=first_chat.user_id, session_id=first_chat.session_id
+            )
+            .values_list("pk", flat=True)
+            .first()
+        )
+
+
+def record_turns(chats):
+    """Fold ``chats``, just written, into their conversations' summary columns."""
+    counts = Counter()
+    latest = {}
+    for chat in chats:
+        pk = chat.conversation_id
+        if pk is None:
+            continue
+        counts[pk] += 1
+        if pk not in latest or chat.created_at >= latest[pk].created_at:
+            latest[pk] = chat
+    for pk, chat in latest.items():
+        # Workers may write a conversation's turns out of order; only a newer
+        # turn replaces the last message.
+        newer = Q(last_message_at__lte=chat.created_at)
+        Conversation.objects.filter(pk=pk).update(
+            message_count=F("message_count") + counts[pk],
+            last_message=Case(
+                When(newer, then=Value(preview(chat.message))),
+                default=F("last_message"),
+            ),
+            last_message_at=Case(
+                When(newer, then=Value(chat.created_at)),
+                default=F("last_message_at"),
+            ),
+        )
@@ -0,0 +1,127 @@
+"""
+Streaming export of a user's chat history.
+
+``export_chats`` turns a queryset of chats into the bytes of a JSON Lines, CSV
+or Markdown file as the rows are read. Rows are fetched ``EXPORT_CHUNK_SIZE``
+at a time through ``QuerySet.iterator()`` (a server-side cursor on
+PostgreSQL), written into a buffer that is handed on once it holds
+``BUFFER_SIZE`` characters, and optionally gzipped on the fly, so an export
+holds one chunk of rows and one buffer in memory however long the history is.
+``aexport_chats`` hands the same chunks to an ASGI server one at a time.
+"""
+
+import csv
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+
+# Rows fetched per database round trip.
+EXPORT_CHUNK_SIZE = 2000
+# Characters of output gathered before a chunk is sent to the client.
+BUFFER_SIZE = 64 * 1024
+
+FIELDS = ("id", "conversation_id", "session_id", "created_at", "message", "response")
+
+
+def jsonl_rows(rows):
+    for row in rows:
+        record = dict(zip(FIELDS, row))
+        record["created_at"] = record["created_at"].isoformat()
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+class LineBuffer:
+    """File-like target for ``csv.writer`` that returns each line it is given."""
+
+    def write(self, line):
+        return line
+
+
+def csv_rows(rows):
+    writer = csv.writer(LineBuffer())
+    yield writer.writerow(FIELDS)
+    for row in rows:
+        yield writer.writerow(row[:3] + (row[3].isoformat(),) + row[4:])
+
+
+def markdown_rows(rows):
+    yield "# Chat history\n"
+    session_id = None
+    for _, _, session, created_at, message, response in rows:
+        if session != session_id:
+            session_id = session
+            yield f"\n## Session {session or '(none)'}\n"
+        yield (
+            f"\n### {created_at:%Y-%m-%d %H:%M:%S %Z}\n\n"
+            f"**You:** {message}\n\n**Assistant:** {response}\n"
+        )
+
+
+# format -> (row formatter, content type)
+EXPORT_FORMATS = {
+    "jsonl": (jsonl_rows, "application/x-ndjson"),
+    "csv": (csv_rows, "text/csv; charset=utf-8"),
+    "md": (markdown_rows, "text/markdown; charset=utf-8"),
+}
+
+
+def buffered(parts, size=BUFFER_SIZE):
+    """Join the strings of ``parts`` into UTF-8 chunks of about ``size``."""
+    buffer = []
+    length = 0
+    for part in parts:
+        buffer.append(part)
+        length += len(part)
+        if length >= size:
+            yield "".join(buffer).encode("utf-8")
+            buffer.clear()
+            length = 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def gzipped(chunks):
+    """Compress ``chunks`` into a gzip stream as they come."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chats(chats, format="jsonl", compress=False):
+    """
+    The chats of ``chats``, oldest first, as chunks of a ``format`` file.
+
+    ``format`` is a key of ``EXPORT_FORMATS``; with ``compress`` the chunks
+    make up a gzip file instead.
+    """
+    formatter, _ = EXPORT_FORMATS[format]
+    rows = (
+        chats.order_by("created_at", "id")
+        .values_list(*FIELDS)
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    chunks = buffered(formatter(rows))
+    return gzipped(chunks) if compress else chunks
+
+
+async def aexport_chats(chats, format="jsonl", compress=False):
+    """
+    Async ``export_chats``, for responses served under ASGI.
+
+    Django would read a sync stream to the end before sending any of it to
+    an ASGI server; here each chunk is produced in a thread as it is needed.
+    """
+    chunks = export_chats(chats, format, compress)
+    try:
+        while True:
+            chunk = await sync_to_async(next)(chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        # Releases the rows' cursor if the client went away.
+        await sync_to_async(chunks.close)()
@@ -0,0 +1,134 @@
+"""
+The chat model behind ``providers.FakeProvider``.
+
+It lives apart from ``providers`` because defining it imports LangChain, which
+only has to be loaded once a model is actually built.
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from .providers import TransientProviderError
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic local chat model.
+
+    The reply echoes the last message and is padded to ``response_tokens``
+    words. Each call waits ``latency`` seconds before the first token and then
+    produces ``tokens_per_second`` tokens per second; ``slow_rate`` of the
+    calls stall for ``slow_latency`` seconds instead, and ``failure_rate`` of
+    them raise ``TransientProviderError``. Both are drawn from a generator
+    seeded with ``seed``.
+    """
+
+    model_name: str = "fake"
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    response_tokens: int = 20
+    failure_rate: float = 0.0
+    slow_rate: float = 0.0
+    slow_latency: float = 0.0
+    seed: int = 0
+
+    def model_post_init(self, __context):
+        self._random = random.Random(self.seed)
+        self._lock = threading.Lock()
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    def _should_fail(self):
+        if not self.failure_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+    def _latency(self):
+        if self.slow_rate:
+            with self._lock:
+                if self._random.random() < self.slow_rate:
+                    return self.slow_latency
+        return self.latency
+
+    def _tokens(self, messages):
+        prompt = str(messages[-1].content) if messages else ""
+        words = f"[{self.model_name}] {prompt}".split()
+        filler = ["lorem", "ipsum", "dolor", "sit", "amet"]
+        while len(words) < self.response_tokens:
+            words.append(filler[len(words) % len(filler)])
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+    def _token_delay(self):
+        return 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _usage(self, messages, tokens):
+        # Whitespace-separated words stand in for tokens.
+        prompt_tokens = sum(len(str(message.content).split()) for message in messages)
+        return {
+            "input_tokens": prompt_tokens,
+            "output_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+
+    def _result(self, messages, tokens):
+        message = AIMessage(
+            content="".join(tokens), usage_metadata=self._usage(messages, tokens)
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        time.sleep(self._latency() + self._token_delay() * len(tokens))
+        if self._should_fail():
+            raise TransientProviderError("Injected failure from the fake provider")
+        return self._result(messages, tokens)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self._latency() + self._token_delay() * len(tokens))
+        if self._should_fail():
+            raise TransientProviderError("Injected failure from the fake provider")
+        return self._result(messages, tokens)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._latency())
+        if self._should_fail():
+            raise TransientProviderError("Injected failure from the fake provider")
+        delay = self._token_delay()
+        tokens = self._tokens(messages)
+        for token in tokens:
+            if delay:
+                time.sleep(delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        # Like providers that report usage on streams, in a final empty chunk.
+        yield ChatGenerationChunk(
+            message=AIMessageChunk(
+                content="", usage_metadata=self._usage(messages, tokens)
+            )
+        )
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._latency())
+        if self._should_fail():
+            raise TransientProviderError("Injected failure from the fake provider")
+        delay = self._token_delay()
+        tokens = self._tokens(messages)
+        for token in tokens:
+            if delay:
+                await asyncio.sleep(delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        # Like providers that report usage on streams, in a final empty chunk.
+        yield ChatGenerationChunk(
+            message=AIMessageChunk(
+                content="", usage_metadata=self._usage(messages, tokens)
+            )
+        )
@@ -0,0 +1,257 @@
+"""
+Background processing of chat messages.
+
+A job is a ``ChatJob`` row, so its status can be read by any worker. The
+default ``LocalJobQueue`` runs jobs on a pool of threads in the process that
+accepted them, with a bounded queue so that a slow upstream turns into
+``QueueFull`` (HTTP 429) instead of an ever-growing backlog. The backend is
+selected with the ``CHATBOT_JOB_QUEUE`` setting::
+
+    CHATBOT_JOB_QUEUE = {
+        "BACKEND": "chatbot.jobs.LocalJobQueue",
+        "OPTIONS": {"workers": 8, "max_depth": 100},
+    }
+
+Jobs do not survive their process: when it restarts, the jobs it had
+accepted are left queued or running. ``LocalJobQueue.reap`` fails those that
+have not changed for ``stale_after`` seconds, as each process starts its
+workers and whenever a client polls such a job, so clients stop waiting.
+"""
+
+import logging
+import queue
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Chat, ChatJob
+
+logger = logging.getLogger(__name__)
+
+ABANDONED = "The server restarted before the message was answered; please resend it"
+
+
+class QueueFull(Exception):
+    """The job queue is at its configured depth."""
+
+    def __init__(self, retry_after):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+def run_job(job_id):
+    """Run one queued job and record its outcome on the ``ChatJob`` row."""
+    from .persistence import chat_writer
+    from .services import ask_groq
+
+    job = ChatJob.objects.get(pk=job_id)
+    job.status = ChatJob.Status.RUNNING
+    job.save(update_fields=["status", "updated_at"])
+    try:
+        response = ask_groq(
+            job.message,
+            job.session_id,
+            job.language,
+            bypass_cache=job.bypass_cache,
+            user_id=job.user_id,
+        )
+        chat = Chat(
+            user_id=job.user_id,
+            session_id=job.session_id,
+            message=job.message,
+            response=response,
+        )
+        chat_writer.write(chat)
+        # Without an id, the turn stays buffered for the flush thread to write.
+        job.chat = chat if chat.pk is not None else None
+        job.status = ChatJob.Status.DONE
+    except Exception as e:
+        logger.exception("Chat job %s failed", job_id)
+        job.status = ChatJob.Status.FAILED
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "chat", "error", "finished_at", "updated_at"])
+
+
+class BaseJobQueue:
+    def submit(self, job):
+        """Queue ``job`` for execution or raise ``QueueFull``."""
+        raise NotImplementedError
+
+    def wait(self, job_id, timeout):
+        """Block until the job finishes or ``timeout`` seconds pass."""
+        raise NotImplementedError
+
+    def reap(self, job_ids=None):
+        """Fail abandoned jobs (of ``job_ids`` if given); return their number."""
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class LocalJobQueue(BaseJobQueue):
+    """Thread pool fed by a bounded in-memory queue; no external services."""
+
+    def __init__(
+        self,
+        workers=8,
+        max_depth=100,
+        retry_after=5,
+        poll_interval=0.5,
+        stale_after=15 * 60,
+    ):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.retry_after = retry_after
+        self.poll_interval = poll_interval
+        # Longer than a job may wait in a full queue and then run.
+        self.stale_after = stale_after
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._lock = threading.Lock()
+        self._threads = []
+        # job id -> Event set when a job accepted by this process finishes.
+        self._done = {}
+        self.rejected = 0
+        self.completed = 0
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name=f"chat-job-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        threading.Thread(
+            target=self._sweep, name="chat-job-reaper", daemon=True
+        ).start()
+
+    def _sweep(self):
+        try:
+            reaped = self.reap()
+            if reaped:
+                logger.warning("Failed %d abandoned chat jobs", reaped)
+        except Exception:
+            logger.exception("Could not reap abandoned chat jobs")
+        finally:
+            close_old_connections()
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                run_job(job_id)
+            except Exception as e:
+                logger.exception("Chat job %s could not be run", job_id)
+                try:
+                    ChatJob.objects.filter(pk=job_id).update(
+                        status=ChatJob.Status.FAILED,
+                        error=str(e),
+                        finished_at=timezone.now(),
+                        updated_at=timezone.now(),
+                    )
+                except Exception:
+                    logger.exception("Could not mark chat job %s as failed", job_id)
+            finally:
+                close_old_connections()
+                with self._lock:
+                    self.completed += 1
+                    event = self._done.pop(job_id, None)
+                if event is not None:
+                    event.set()
+                self._queue.task_done()
+
+    def submit(self, job):
+        self._start()
+        with self._lock:
+            self._done[job.pk] = threading.Event()
+        try:
+            self._queue.put_nowait(job.pk)
+        except queue.Full:
+            with self._lock:
+                self._done.pop(job.pk, None)
+                self.rejected += 1
+            raise QueueFull(self.retry_after)
+
+    def wait(self, job_id, timeout):
+        with self._lock:
+            event = self._done.get(job_id)
+        if event is not None:
+            event.wait(timeout)
+            return
+        # Accepted by another worker process: poll its row instead.
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = (
+                ChatJob.objects.filter(pk=job_id)
+                .values_list("status", flat=True)
+                .first()
+            )
+            if status in (None, ChatJob.Status.DONE, ChatJob.Status.FAILED):
+                return
+            time.sleep(self.poll_interval)
+
+    def reap(self, job_ids=None):
+        """
+        Fail the unfinished jobs that have not changed for ``stale_after``
+        seconds, other than those this process still holds.
+        """
+        now = timezone.now()
+        jobs = ChatJob.objects.filter(
+            status__in=(ChatJob.Status.QUEUED, ChatJob.Status.RUNNING),
+            updated_at__lt=now - timedelta(seconds=self.stale_after),
+        )
+        if job_ids is not None:
+            jobs = jobs.filter(pk__in=job_ids)
+        with self._lock:
+            held = list(self._done)
+        return jobs.exclude(pk__in=held).update(
+            status=ChatJob.Status.FAILED,
+            error=ABANDONED,
+            finished_at=now,
+            updated_at=now,
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "depth": self._queue.qsize(),
+                "max_depth": self.max_depth,
+                "workers": self.workers,
+                "rejected": self.rejected,
+                "completed": self.completed,
+            }
+
+
+def create_job_queue():
+    config = getattr(settings, "CHATBOT_JOB_QUEUE", {})
+    backend = import_string(config.get("BACKEND", "chatbot.jobs.LocalJobQueue"))
+    return backend(**config.get("OPTIONS", {}))
+
+
+job_queue = create_job_queue()
+
+
+def enqueue_chat(user, message, session_id, language="English", bypass_cache=False):
+    """Create a job for a chat message and queue it; raises ``QueueFull``."""
+    job = ChatJob.objects.create(
+        user=user,
+        session_id=session_id,
+        message=message,
+        language=language,
+        bypass_cache=bypass_cache,
+    )
+    try:
+        job_queue.submit(job)
+    except QueueFull:
+        job.delete()
+        raise
+    return job
@@ -0,0 +1,144 @@
+from itertools import islice
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.core.serializers import sort_dependencies
+from django.db import connections, router, transaction
+
+SOURCE_ALIAS = "copy_from_sqlite"
+# Rows that ``migrate`` creates in every database; copying replaces them.
+MIGRATE_CREATED = {"contenttypes.contenttype", "auth.permission"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy every table of an existing SQLite database into the configured "
+        "database (e.g. PostgreSQL) in bulk, keeping primary keys. Run "
+        "`migrate` against the target first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path of the SQLite database to copy.")
+        parser.add_argument(
+            "--database",
+            default="default",
+            help="Database to copy into (default: default).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=2000,
+            help="Rows read and inserted per query (default: 2000).",
+        )
+        parser.add_argument(
+            "--replace",
+            action="store_true",
+            help="Delete rows already in the target tables before copying.",
+        )
+
+    def handle(self, *args, path, database, batch_size, replace, **options):
+        connections.settings[SOURCE_ALIAS] = {
+            **connections.settings[database],
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": path,
+            "OPTIONS": {},
+            "CONN_MAX_AGE": 0,
+        }
+        source = connections[SOURCE_ALIAS]
+        target = connections[database]
+        try:
+            models = self._models(database)
+            tables = set(source.introspection.table_names())
+            missing = [
+                m._meta.db_table for m in models if m._meta.db_table not in tables
+            ]
+            if missing:
+                raise CommandError(
+                    f"{path} has no table {', '.join(missing)}; run `migrate` on "
+                    "it first so both databases have the same schema."
+                )
+            if not replace:
+                self._check_empty(models, database)
+
+            with transaction.atomic(using=database):
+                target.ops.execute_sql_flush(
+                    target.ops.sql_flush(
+                        no_style(),
+                        [m._meta.db_table for m in models],
+                        allow_cascade=True,
+                    )
+                )
+                for model in models:
+                    copied = self._copy(model, source, target, batch_size)
+                    self.stdout.write(f"{model._meta.label}: {copied} rows")
+                with target.cursor() as cursor:
+                    for sql in target.ops.sequence_reset_sql(no_style(), models):
+                        cursor.execute(sql)
+        finally:
+            source.close()
+            del connections[SOURCE_ALIAS]
+            del connections.settings[SOURCE_ALIAS]
+
+        self.stdout.write(self.style.SUCCESS(f"Copied {path} into '{database}'."))
+
+    def _models(self, database):
+        """Concrete models in an order where rows only refer to earlier ones."""
+        ordered = sort_dependencies(
+            [(app_config, None) for app_config in apps.get_app_configs()],
+            allow_cycles=True,
+        )
+        ordered += [
+            model
+            for model in apps.get_models(include_auto_created=True)
+            if model._meta.auto_created
+        ]
+        return [
+            model
+            for model in ordered
+            if model._meta.managed
+            and not model._meta.proxy
+            and router.allow_migrate_model(database, model)
+        ]
+
+    def _check_empty(self, models, database):
+        for model in models:
+            if model._meta.label_lower in MIGRATE_CREATED:
+                continue
+            if model._base_manager.using(database).exists():
+                raise CommandError(
+                    f"{model._meta.label} already has rows in '{database}'; "
+                    "pass --replace to delete them."
+                )
+
+    def _copy(self, model, source, target, batch_size):
+        # Raw inserts, so that neither save() nor auto_now fields change the
+        # copied values.
+        fields = model._meta.concrete_fields
+        quote = target.ops.quote_name
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            quote(model._meta.db_table),
+            ", ".join(quote(field.column) for field in fields),
+            ", ".join(["%s"] * len(fields)),
+        )
+        rows = (
+            model._base_manager.using(source.alias)
+            .order_by("pk")
+            .values_list(*(field.attname for field in fields))
+            .iterator(chunk_size=batch_size)
+        )
+        copied = 0
+        with target.cursor() as cursor:
+            while batch := list(islice(rows, batch_size)):
+                cursor.executemany(
+                    sql,
+                    [
+                        [
+                            field.get_db_prep_save(value, target)
+                            for field, value in zip(fields, row)
+                        ]
+                        for row in batch
+                    ],
+                )
+                copied += len(batch)
+        return copied
@@ -0,0 +1,91 @@
+import os
+import socket
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.persistence import (
+    WriteLog,
+    chat_from_record,
+    chat_writer_settings,
+    insert_chats,
+)
+
+
+def is_running(host, pid):
+    if host != socket.gethostname():
+        # Cannot tell; only --force recovers another machine's logs.
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Command(BaseCommand):
+    help = (
+        "Insert the chat turns that crashed workers logged but never wrote to "
+        "the database, then delete their logs. Logs of running workers are "
+        "skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "directory",
+            nargs="?",
+            help="Directory holding the logs (default: CHATBOT_CHAT_WRITER LOG_DIR).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Turns inserted per query (default: 1000).",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Also recover logs whose worker looks alive or is on another host.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many turns each log would restore.",
+        )
+
+    def handle(self, *args, directory, batch_size, force, dry_run, **options):
+        directory = directory or chat_writer_settings["LOG_DIR"]
+        if not directory:
+            raise CommandError(
+                "No log directory: pass one or set CHATBOT_CHAT_WRITER LOG_DIR."
+            )
+        paths = sorted(Path(directory).glob("chats-*.log"))
+        if not paths:
+            self.stdout.write(f"No chat logs in {directory}.")
+            return
+
+        total = 0
+        for path in paths:
+            host, pid = WriteLog.process_of(path)
+            if not force and is_running(host, pid):
+                self.stdout.write(f"{path.name}: worker {pid} on {host} may be live")
+                continue
+            records = WriteLog.unflushed(path)
+            if dry_run:
+                self.stdout.write(f"{path.name}: {len(records)} turns to restore")
+                continue
+            for start in range(0, len(records), batch_size):
+                insert_chats(
+                    [
+                        chat_from_record(record)
+                        for record in records[start : start + batch_size]
+                    ]
+                )
+            path.unlink()
+            total += len(records)
+            self.stdout.write(f"{path.name}: restored {len(records)} turns")
+
+        if not dry_run:
+            self.stdout.write(self.style.SUCCESS(f"Restored {total} chat turns."))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.models import Chat
+from chatbot.rendering import render_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Render and store the HTML of chat responses whose stored HTML is "
+        "missing or was produced under different markdownify settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Rows rendered and written per query (default: 500).",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Re-render every row, not only the stale ones.",
+        )
+
+    def handle(self, *args, batch_size, **options):
+        version = render_version()
+        chats = Chat.objects.only("id", "response").order_by("id")
+        if not options["all"]:
+            chats = chats.exclude(response_html_version=version)
+
+        rendered = 0
+        last_id = 0
+        while True:
+            batch = list(chats.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            for chat in batch:
+                chat.render_response()
+            Chat.objects.bulk_update(batch, ["response_html", "response_html_version"])
+            rendered += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f"Rendered {rendered} chats", ending="\r")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rendered {rendered} chats (version {version}).")
+        )
@@ -0,0 +1,605 @@
+"""
+In-process conversation memory used by ``services.get_session_history``.
+
+The backend is selected with the ``CHATBOT_SESSION_STORE`` setting, in the same
+shape as Django's ``CACHES``::
+
+    CHATBOT_SESSION_STORE = {
+        "BACKEND": "chatbot.memory.LRUSessionStore",
+        "OPTIONS": {"max_sessions": 10000, "idle_ttl": 3600},
+    }
+
+Sessions are keyed by ``(user_id, session_id)``: clients choose their
+session ids, so two users may well pick the same one.
+
+``LRUSessionStore`` keeps history only in the current process.
+``DatabaseSessionStore`` rebuilds it from the ``Chat`` table, so every worker
+sees the same conversation and history survives restarts. With the
+``compact`` option, either keeps its messages as ``CompactMessages`` instead
+of LangChain message objects, which takes a fraction of the memory.
+"""
+
+import itertools
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from .persistence import chat_writer
+
+# Rough per-message cost of the LangChain message object, on top of its text.
+MESSAGE_OVERHEAD_BYTES = 1024
+
+
+def estimate_message_size(message):
+    content = message.content
+    if not isinstance(content, str):
+        content = str(content)
+    return sys.getsizeof(content) + MESSAGE_OVERHEAD_BYTES
+
+
+class BoundedChatMessageHistory(BaseChatMessageHistory):
+    """
+    Message history that keeps at most ``max_messages`` messages and reports
+    size changes back to the store that owns it.
+    """
+
+    def __init__(self, session_id, max_messages=None, on_resize=None):
+        self.session_id = session_id
+        self.max_messages = max_messages
+        self.on_resize = on_resize
+        self.messages = []
+        self.size = 0
+        # Rolling-summary state owned by services.ContextAssembler.
+        self.context_state = None
+
+    def add_messages(self, messages):
+        delta = 0
+        for message in messages:
+            self.messages.append(message)
+            delta += estimate_message_size(message)
+        if self.max_messages and len(self.messages) > self.max_messages:
+            overflow = len(self.messages) - self.max_messages
+            for message in self.messages[:overflow]:
+                delta -= estimate_message_size(message)
+            del self.messages[:overflow]
+        self._resize(delta)
+
+    def clear(self):
+        self.messages = []
+        self.context_state = None
+        self._resize(-self.size)
+
+    # Everything is in memory, so skip the executor hop of the default
+    # async implementations.
+    async def aget_messages(self):
+        return list(self.messages)
+
+    async def aadd_messages(self, messages):
+        self.add_messages(messages)
+
+    def _resize(self, delta):
+        self.size += delta
+        if self.on_resize is not None and delta:
+            self.on_resize(self, delta)
+
+
+# Message type -> role code, and role code -> message class.
+ROLE_CODES = {"human": 0, "ai": 1, "system": 2}
+MESSAGE_CLASSES = (HumanMessage, AIMessage, SystemMessage)
+# Tells apart the message ids of different CompactMessages.
+_generations = itertools.count()
+
+
+class CompactMessages:
+    """
+    The text and role of a conversation's messages, without the messages.
+
+    Each LangChain message object costs about a kilobyte besides its text, in
+    its pydantic fields and dicts. Here the texts share one UTF-8 buffer, and
+    a message is a byte in the role table and four in the length table.
+    Message objects are only built, with their content alone, when iterated
+    over to assemble a prompt; each gets an ``id`` that stays the same across
+    rebuilds (see ``services.ContextState``).
+    """
+
+    __slots__ = ("_roles", "_lengths", "_text", "_first", "_generation")
+
+    def __init__(self, messages=()):
+        self._roles = array("B")
+        # In characters of the decoded text.
+        self._lengths = array("I")
+        self._text = bytearray()
+        # Position in the conversation of the first message held.
+        self._first = 0
+        self._generation = next(_generations)
+        self.extend(messages)
+
+    def extend(self, messages):
+        for message in messages:
+            role = ROLE_CODES.get(message.type)
+            if role is None:
+                raise ValueError(f"Cannot store a {message.type} message compactly")
+            content = message.content
+            if not isinstance(content, str):
+                content = str(content)
+            self._roles.append(role)
+            self._lengths.append(len(content))
+            self._text += content.encode("utf-8")
+
+    def __len__(self):
+        return len(self._roles)
+
+    def __iter__(self):
+        text = self._text.decode("utf-8")
+        start = 0
+        for index, (role, length) in enumerate(zip(self._roles, self._lengths)):
+            yield MESSAGE_CLASSES[role](
+                content=text[start : start + length],
+                id=f"{self._generation}.{self._first + index}",
+            )
+            start += length
+
+    def __delitem__(self, key):
+        """Drop the oldest messages; only ``del messages[:count]`` is supported."""
+        if not isinstance(key, slice) or key.start or key.step:
+            raise TypeError("Only the oldest messages can be deleted")
+        count = len(self._roles[key])
+        chars = sum(self._lengths[:count])
+        dropped = self._text.decode("utf-8")[:chars].encode("utf-8")
+        del self._roles[:count]
+        del self._lengths[:count]
+        del self._text[: len(dropped)]
+        self._first += count
+
+    @property
+    def size(self):
+        """Bytes held for the messages."""
+        return (
+            len(self._text)
+            + len(self._roles) * self._roles.itemsize
+            + len(self._lengths) * self._lengths.itemsize
+        )
+
+
+def messages_size(messages):
+    if isinstance(messages, CompactMessages):
+        return messages.size
+    return sum(estimate_message_size(message) for message in messages)
+
+
+class CompactChatMessageHistory(BaseChatMessageHistory):
+    """``BoundedChatMessageHistory`` holding its messages as ``CompactMessages``."""
+
+    def __init__(self, session_id, max_messages=None, on_resize=None):
+        self.session_id = session_id
+        self.max_messages = max_messages
+        self.on_resize = on_resize
+        self.size = 0
+        # Rolling-summary state owned by services.ContextAssembler.
+        self.context_state = None
+        self._messages = CompactMessages()
+
+    @property
+    def messages(self):
+        return list(self._messages)
+
+    def add_messages(self, messages):
+        self._messages.extend(messages)
+        if self.max_messages and len(self._messages) > self.max_messages:
+            del self._messages[: len(self._messages) - self.max_messages]
+        self._resize(self._messages.size - self.size)
+
+    def clear(self):
+        self._messages = CompactMessages()
+        self.context_state = None
+        self._resize(-self.size)
+
+    async def aget_messages(self):
+        return self.messages
+
+    async def aadd_messages(self, messages):
+        self.add_messages(messages)
+
+    def _resize(self, delta):
+        self.size += delta
+        if self.on_resize is not None and delta:
+            self.on_resize(self, delta)
+
+
+class BaseSessionStore:
+    """
+    Interface for session-memory backends.
+
+    Stores map a ``(user_id, session_id)`` key to a
+    ``BaseChatMessageHistory`` and support ``in``, ``len()`` and ``del`` so
+    callers can treat them like a dict.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def get_or_create(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Drop a session; return ``True`` if it existed."""
+        raise NotImplementedError
+
+    def forget(self, key):
+        """
+        Drop a session from this worker's memory only, leaving any turns
+        stored for it alone; for sessions used once and thrown away.
+        """
+        return self.delete(key)
+
+    def resume(self, key, load_turns):
+        """
+        Return the history of session ``key``, rebuilding it if this store no
+        longer has it. ``load_turns(limit)`` returns the session's latest
+        ``limit`` (all if ``None``) turns as ``(message, response)`` pairs,
+        oldest first.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        history = self.get(key)
+        if history is None:
+            raise KeyError(key)
+        return history
+
+    def __delitem__(self, key):
+        if not self.delete(key):
+            raise KeyError(key)
+
+
+class LRUSessionStore(BaseSessionStore):
+    """
+    Bounded store with LRU eviction, an idle TTL and a total memory budget.
+
+    ``max_bytes`` is enforced against an estimate of the message text plus a
+    fixed per-message overhead, which is what dominates a session's footprint;
+    with ``compact``, against the bytes the ``CompactMessages`` hold.
+    """
+
+    def __init__(
+        self,
+        max_sessions=10000,
+        max_bytes=256 * 1024 * 1024,
+        idle_ttl=60 * 60,
+        max_messages=200,
+        compact=False,
+        clock=time.monotonic,
+    ):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.compact = compact
+        self.clock = clock
+        self._lock = threading.RLock()
+        # key -> (history, last_access); oldest access first.
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {"lru": 0, "ttl": 0, "memory": 0}
+
+    def get(self, key):
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            entry = self._sessions.get(key)
+            if entry is None:
+                return None
+            self._sessions[key] = (entry[0], now)
+            self._sessions.move_to_end(key)
+            return entry[0]
+
+    def get_or_create(self, key):
+        with self._lock:
+            history = self.get(key)
+            if history is not None:
+                self.hits += 1
+                return history
+            self.misses += 1
+            history = self._create_history(key)
+            self._sessions[key] = (history, self.clock())
+            while len(self._sessions) > self.max_sessions:
+                self._evict_oldest("lru")
+            return history
+
+    def resume(self, key, load_turns):
+        history = self.get(key)
+        if history is not None:
+            return history
+        # Loaded outside the lock, which guards every session.
+        limit = (self.max_messages + 1) // 2 if self.max_messages else None
+        messages = []
+        for message, response in load_turns(limit):
+            messages.append(HumanMessage(content=message))
+            messages.append(AIMessage(content=response))
+        with self._lock:
+            history = self.get_or_create(key)
+            if not history.messages:
+                history.add_messages(messages)
+            return history
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._sessions.pop(key, None)
+            if entry is None:
+                return False
+            self._detach(entry[0])
+            return True
+
+    def clear(self):
+        with self._lock:
+            for history, _ in self._sessions.values():
+                history.on_resize = None
+            self._sessions.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": dict(self.evictions),
+            }
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _create_history(self, key):
+        history_class = (
+            CompactChatMessageHistory if self.compact else BoundedChatMessageHistory
+        )
+        return history_class(
+            key, max_messages=self.max_messages, on_resize=self._on_resize
+        )
+
+    def _on_resize(self, history, delta):
+        with self._lock:
+            self._bytes += delta
+            while self._bytes > self.max_bytes and len(self._sessions) > 1:
+                self._evict_oldest("memory")
+
+    def _expire(self, now):
+        if not self.idle_ttl:
+            return
+        while self._sessions:
+            _, last_access = next(iter(self._sessions.values()))
+            if now - last_access < self.idle_ttl:
+                break
+            self._evict_oldest("ttl")
+
+    def _evict_oldest(self, reason):
+        _, (history, _) = self._sessions.popitem(last=False)
+        self._detach(history)
+        self.evictions[reason] += 1
+
+    def _detach(self, history):
+        self._bytes -= history.size
+        history.on_resize = None
+
+
+class DatabaseChatMessageHistory(BaseChatMessageHistory):
+    """
+    History rebuilt from the ``Chat`` rows of one user's session.
+
+    Every worker holds a cached copy and, on each read, fetches only the rows
+    written since the last one it has seen, so a follow-up that lands on a
+    different worker (or after a restart) still gets the full context. Messages
+    added by the model chain are kept as pending until the view persists the
+    turn as a ``Chat`` row, at which point the row replaces them; rows of
+    other turns, say from another worker, leave them pending.
+    """
+
+    def __init__(
+        self, user_id, session_id, max_messages=None, on_resize=None, compact=False
+    ):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.max_messages = max_messages
+        self.on_resize = on_resize
+        self.size = 0
+        # Rolling-summary state owned by services.ContextAssembler.
+        self.context_state = None
+        # Holds the messages of the rows; pending ones stay objects.
+        self._container = CompactMessages if compact else list
+        self._messages = self._container()
+        self._pending = []
+        # Highest Chat id folded into ``_messages``; ``None`` until first load.
+        self._last_id = None
+
+    @property
+    def messages(self):
+        self._sync()
+        return list(self._messages) + self._pending
+
+    async def aget_messages(self):
+        await sync_to_async(self._sync)()
+        return list(self._messages) + self._pending
+
+    def add_messages(self, messages):
+        self._pending.extend(messages)
+        self._resize(sum(estimate_message_size(message) for message in messages))
+
+    async def aadd_messages(self, messages):
+        self.add_messages(messages)
+
+    def clear(self):
+        from .models import Chat
+
+        # Detach the rows rather than deleting them: they remain in the user's
+        # chat history but no longer feed the model's context. Buffered turns
+        # are written first so that they are detached too.
+        chat_writer.flush()
+        Chat.objects.filter(user_id=self.user_id, session_id=self.session_id).update(
+            session_id=""
+        )
+        self._messages = self._container()
+        self._pending = []
+        self._last_id = 0
+        self.context_state = None
+        self._resize(-self.size)
+
+    async def aclear(self):
+        await sync_to_async(self.clear)()
+
+    def _rows(self):
+        from .models import Chat
+
+        return Chat.objects.filter(
+            user_id=self.user_id, session_id=self.session_id
+        ).values_list("id", "message", "response")
+
+    def _sync(self):
+        if self._last_id is None:
+            self._reload()
+            return
+        rows = list(self._rows().filter(id__gte=self._last_id).order_by("id"))
+        if self._last_id:
+            if not rows or rows[0][0] != self._last_id:
+                # The session was cleared or rewritten by another worker.
+                self._reload()
+                return
+            rows = rows[1:]
+        if rows:
+            settled = self._settle(rows)
+            start = len(self._messages)
+            self._messages.extend(self._to_messages(rows))
+            self._rebase(settled, rows, start)
+            self._last_id = rows[-1][0]
+            self._trim()
+            self._recount()
+
+    def _reload(self):
+        rows = self._rows().order_by("-id")
+        if self.max_messages:
+            rows = rows[: (self.max_messages + 1) // 2]
+        rows = list(rows)[::-1]
+        self._settle(rows)
+        self._messages = self._container(self._to_messages(rows))
+        self.context_state = None
+        self._last_id = rows[-1][0] if rows else 0
+        self._trim()
+        self._recount()
+
+    def _settle(self, rows):
+        """
+        Drop the pending turns that ``rows`` now hold; return them as a dict
+        of Chat id -> the turn's two pending messages.
+        """
+        settled = {}
+        for chat_id, message, response in rows:
+            for index in range(len(self._pending) - 1):
+                human, ai = self._pending[index : index + 2]
+                if (
+                    human.type == "human"
+                    and ai.type == "ai"
+                    and human.content == message
+                    and ai.content == response
+                ):
+                    settled[chat_id] = (human, ai)
+                    del self._pending[index : index + 2]
+                    break
+        return settled
+
+    def _rebase(self, settled, rows, start):
+        """
+        If the summary's boundary was a pending message that ``rows`` settled,
+        move it to the message that replaces it, which ``rows`` put at
+        ``start`` onwards; otherwise the already summarized turns would look
+        new to the ``ContextAssembler`` and be summarized again.
+        """
+        state = self.context_state
+        if state is None or state.boundary is None:
+            return
+        for offset, (chat_id, _, _) in enumerate(rows):
+            for position, message in enumerate(settled.get(chat_id, ())):
+                if message is state.boundary:
+                    state.boundary = list(self._messages)[start + 2 * offset + position]
+                    return
+
+    @staticmethod
+    def _to_messages(rows):
+        messages = []
+        for _, message, response in rows:
+            messages.append(HumanMessage(content=message))
+            messages.append(AIMessage(content=response))
+        return messages
+
+    def _trim(self):
+        if self.max_messages and len(self._messages) > self.max_messages:
+            del self._messages[: len(self._messages) - self.max_messages]
+
+    def _recount(self):
+        size = messages_size(self._messages) + messages_size(self._pending)
+        self._resize(size - self.size)
+
+    def _resize(self, delta):
+        self.size += delta
+        if self.on_resize is not None and delta:
+            self.on_resize(self, delta)
+
+
+class DatabaseSessionStore(LRUSessionStore):
+    """
+    ``LRUSessionStore`` whose histories are backed by the ``Chat`` table.
+
+    The LRU only bounds each worker's cache; evicting a session loses nothing,
+    since it is rebuilt from the database on its next use.
+    """
+
+    def _create_history(self, key):
+        user_id, session_id = key
+        return DatabaseChatMessageHistory(
+            user_id,
+            session_id,
+            max_messages=self.max_messages,
+            on_resize=self._on_resize,
+            compact=self.compact,
+        )
+
+    def resume(self, key, load_turns):
+        # The history loads its own rows on first use.
+        return self.get_or_create(key)
+
+    def forget(self, key):
+        return super().delete(key)
+
+    def delete(self, key):
+        from .models import Chat
+
+        user_id, session_id = key
+        chat_writer.flush()
+        detached = Chat.objects.filter(user_id=user_id, session_id=session_id).update(
+            session_id=""
+        )
+        return super().delete(key) or bool(detached)
+
+
+def create_session_store():
+    config = getattr(settings, "CHATBOT_SESSION_STORE", {})
+    backend = import_string(config.get("BACKEND", "chatbot.memory.LRUSessionStore"))
+    return backend(**config.get("OPTIONS", {}))
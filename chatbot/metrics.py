@@ -0,0 +1,615 @@
+"""
+Request instrumentation and Prometheus metrics.
+
+``MetricsMiddleware`` gives every request a ``RequestTrace``; code on the hot
+path times its work with ``stage("name")`` (a no-op outside a request) and
+reports sizes with ``observe``. When the request ends its stage timings are
+folded into histograms, which ``metrics_view`` serves in the Prometheus text
+format at ``/metrics``. Metrics are per process, as with any Prometheus client
+in a pre-fork server: scrape each worker, or sum them in the query.
+
+With ``PROFILE_SAMPLE_RATE`` set, a sample of requests also runs under
+cProfile and the profiles of the ``PROFILE_KEEP`` slowest ones are written to
+``PROFILE_DIR`` for ``python -m pstats`` or snakeviz.
+"""
+
+import contextvars
+import cProfile
+import heapq
+import hmac
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+METRICS_DEFAULTS = {
+    "ENABLED": True,
+    # Scrapers send "Authorization: Bearer <TOKEN>"; logged-in staff may
+    # always read /metrics.
+    "TOKEN": None,
+    # Client addresses trusted without a token. Opt-in: behind a reverse
+    # proxy on the same host, every request comes from 127.0.0.1.
+    "ALLOWED_IPS": [],
+    "PROFILE_SAMPLE_RATE": 0.0,
+    "PROFILE_KEEP": 10,
+    "PROFILE_DIR": None,
+}
+metrics_settings = {**METRICS_DEFAULTS, **getattr(settings, "CHATBOT_METRICS", {})}
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"),
+        )
+        for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label values -> [bucket counts..., +Inf count, sum]
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                bucket_labels = _format_labels(labels + [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(values[-1])}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = []
+        # Callables returning ``(name, type, help, [(labels, value), ...])``
+        # tuples, read at scrape time from the components' own counters.
+        self.collectors = []
+
+    def histogram(self, *args, **kwargs):
+        histogram = Histogram(*args, **kwargs)
+        self.histograms.append(histogram)
+        return histogram
+
+    def render(self):
+        lines = []
+        for histogram in self.histograms:
+            lines.extend(histogram.collect())
+        for collector in self.collectors:
+            try:
+                families = list(collector())
+            except Exception:
+                logger.exception("Metrics collector %r failed", collector)
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(
+                        f"{name}{_format_labels(sorted(labels.items()))} "
+                        f"{_format_value(value)}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_seconds = registry.histogram(
+    "chatbot_request_duration_seconds",
+    "Time to produce a response, by view, method and status.",
+    ("view", "method", "status"),
+)
+stage_seconds = registry.histogram(
+    "chatbot_stage_duration_seconds",
+    "Time spent in each stage of a request.",
+    ("view", "stage"),
+)
+stream_seconds = registry.histogram(
+    "chatbot_stream_duration_seconds",
+    "Time from the start of a request until its streamed response ended.",
+    ("view",),
+)
+route_seconds = registry.histogram(
+    "chatbot_route_latency_seconds",
+    "Time until a routed model call answered, or streamed its first chunk.",
+    ("route",),
+)
+sizes = {
+    name: registry.histogram(
+        f"chatbot_{name}", documentation, ("view",), buckets=SIZE_BUCKETS
+    )
+    for name, documentation in (
+        ("prompt_tokens", "Prompt tokens sent to the model per chat turn."),
+        ("completion_tokens", "Completion tokens received per chat turn."),
+        ("history_messages", "Messages in the session history per chat turn."),
+    )
+}
+
+
+class RequestTrace:
+    """Stage timings and sizes recorded while handling one request."""
+
+    def __init__(self):
+        # Appends are atomic, so stages run on helper threads (e.g. hedged
+        # model calls) can record into the same trace.
+        self.stages = []
+        self.sizes = []
+
+    def finish(self, view):
+        for name, seconds in self.stages:
+            stage_seconds.observe(seconds, view=view, stage=name)
+        for name, value in self.sizes:
+            sizes[name].observe(value, view=view)
+
+
+_current_trace = contextvars.ContextVar("chatbot_request_trace", default=None)
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as stage ``name`` of the current request."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.stages.append((name, time.perf_counter() - start))
+
+
+def observe(name, value):
+    """Record a size (``prompt_tokens``, ``completion_tokens``, ...)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.sizes.append((name, value))
+
+
+class SlowRequestProfiler:
+    """Profile a sample of requests and keep the ``keep`` slowest on disk."""
+
+    def __init__(self, sample_rate, keep, directory=None):
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.directory = Path(
+            directory or Path(tempfile.gettempdir()) / "chatbot-profiles"
+        )
+        self._lock = threading.Lock()
+        # Min-heap of (seconds, path), so the fastest kept profile is first.
+        self._kept = []
+
+    def start(self):
+        """Return a running ``cProfile.Profile`` if this request is sampled."""
+        if not (self.sample_rate > 0 and random.random() < self.sample_rate):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Only one profiler can be active at a time; skip this request
+            # if a concurrent one is already being profiled.
+            return None
+        return profile
+
+    def save(self, profiler, seconds, view):
+        with self._lock:
+            if len(self._kept) >= self.keep and seconds <= self._kept[0][0]:
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / (
+                f"{int(seconds * 1000):08d}ms-{view.replace(':', '-')}-"
+                f"{time.time_ns()}.prof"
+            )
+            profiler.dump_stats(path)
+            heapq.heappush(self._kept, (seconds, str(path)))
+            if len(self._kept) > self.keep:
+                _, evicted = heapq.heappop(self._kept)
+                try:
+                    os.remove(evicted)
+                except FileNotFoundError:
+                    pass
+
+
+profiler = SlowRequestProfiler(
+    metrics_settings["PROFILE_SAMPLE_RATE"],
+    metrics_settings["PROFILE_KEEP"],
+    metrics_settings["PROFILE_DIR"],
+)
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match is not None else "unmatched"
+
+
+class MetricsMiddleware:
+    """Trace each request and record its latency; see the module docstring."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = metrics_settings["ENABLED"]
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _start(self):
+        trace = RequestTrace()
+        return trace, _current_trace.set(trace), time.perf_counter()
+
+    def _finish(self, request, response, trace, token, start):
+        # For a streamed response this is the time to the first byte; the
+        # full duration is recorded separately once the stream ends.
+        seconds = time.perf_counter() - start
+        _current_trace.reset(token)
+        view = _view_name(request)
+        request_seconds.observe(
+            seconds,
+            view=view,
+            method=request.method,
+            status=response.status_code,
+        )
+        trace.finish(view)
+        if response.streaming:
+            if response.is_async:
+                content = self._atimed(response.streaming_content, view, start)
+            else:
+                content = self._timed(response.streaming_content, view, start)
+            response.streaming_content = content
+        return seconds, view
+
+    @staticmethod
+    def _timed(content, view, start):
+        try:
+            yield from content
+        finally:
+            stream_seconds.observe(time.perf_counter() - start, view=view)
+
+    @staticmethod
+    async def _atimed(content, view, start):
+        try:
+            async for part in content:
+                yield part
+        finally:
+            stream_seconds.observe(time.perf_counter() - start, view=view)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+        trace, token, start = self._start()
+        profile = profiler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            if profile is not None:
+                profile.disable()
+        seconds, view = self._finish(request, response, trace, token, start)
+        if profile is not None:
+            profiler.save(profile, seconds, view)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+        trace, token, start = self._start()
+        # cProfile only sees the event loop's thread, which is what matters
+        # for async views.
+        profile = profiler.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            if profile is not None:
+                profile.disable()
+        seconds, view = self._finish(request, response, trace, token, start)
+        if profile is not None:
+            profiler.save(profile, seconds, view)
+        return response
+
+
+def pipeline_metrics():
+    """Counters kept by the chat pipeline's components, read at scrape time."""
+    from .admission import admission
+    from .authentication import token_cache
+    from .jobs import job_queue
+    from .persistence import chat_writer
+
+    stats = admission.stats()
+    yield (
+        "chatbot_admission_admitted_total",
+        "counter",
+        "Chat turns admitted.",
+        [({}, stats["admitted"])],
+    )
+    yield (
+        "chatbot_admission_queued_total",
+        "counter",
+        "Chat turns that had to wait for a slot.",
+        [({}, stats["queued"])],
+    )
+    yield (
+        "chatbot_admission_rejected_total",
+        "counter",
+        "Chat requests rejected by admission control.",
+        [({"reason": reason}, count) for reason, count in stats["rejected"].items()],
+    )
+    yield (
+        "chatbot_admission_queue_wait_seconds_total",
+        "counter",
+        "Time admitted chat turns spent queued.",
+        [({}, stats["queue_wait_seconds"])],
+    )
+    yield (
+        "chatbot_admission_waiting",
+        "gauge",
+        "Chat turns waiting in this process.",
+        [({}, stats["waiting"])],
+    )
+    yield (
+        "chatbot_admission_in_flight",
+        "gauge",
+        "Chat turns in flight across all workers.",
+        [({}, stats["in_flight"])],
+    )
+
+    stats = token_cache.stats()
+    yield (
+        "chatbot_auth_cache_hits_total",
+        "counter",
+        "API requests authenticated from the token cache.",
+        [({}, stats["hits"])],
+    )
+    yield (
+        "chatbot_auth_cache_misses_total",
+        "counter",
+        "API requests whose token had to be verified and its user loaded.",
+        [({}, stats["misses"])],
+    )
+
+    stats = chat_writer.stats()
+    yield (
+        "chatbot_chat_writer_pending",
+        "gauge",
+        "Chat turns buffered and not yet written to the database.",
+        [({}, stats["pending"])],
+    )
+    yield (
+        "chatbot_chat_writer_flushed_total",
+        "counter",
+        "Chat turns written to the database by the chat writer.",
+        [({}, stats["flushed"])],
+    )
+    yield (
+        "chatbot_chat_writer_failed_flushes_total",
+        "counter",
+        "Chat writer flushes that failed and will be retried.",
+        [({}, stats["failed_flushes"])],
+    )
+
+    stats = job_queue.stats()
+    yield (
+        "chatbot_job_queue_depth",
+        "gauge",
+        "Background chat jobs waiting to run.",
+        [({}, stats["depth"])],
+    )
+    yield (
+        "chatbot_job_queue_rejected_total",
+        "counter",
+        "Background chat jobs rejected because the queue was full.",
+        [({}, stats["rejected"])],
+    )
+
+
+def llm_metrics():
+    """
+    Counters kept by the LLM stack, once the first chat turn has loaded it.
+
+    Scraping must not load the stack itself (see ``CHATBOT_WARM_UP``), so a
+    worker that has not served a chat turn yet reports none of these.
+    """
+    services = sys.modules.get("chatbot.services")
+    if services is None:
+        return
+    upstream = services.upstream
+    router = services.router
+    response_cache = services.response_cache
+    session_store = services.session_store
+
+    stats = upstream.stats()
+    for name in ("calls", "retries", "timeouts", "hedges"):
+        yield (
+            f"chatbot_upstream_{name}_total",
+            "counter",
+            f"Model {name} made through the resilience layer.",
+            [({}, stats[name])],
+        )
+    breaker = stats["breaker"]
+    yield (
+        "chatbot_upstream_breaker_open",
+        "gauge",
+        "1 while the circuit breaker is failing calls fast.",
+        [({}, int(breaker["state"] != "closed"))],
+    )
+    yield (
+        "chatbot_upstream_breaker_rejected_total",
+        "counter",
+        "Model calls failed fast by the circuit breaker.",
+        [({}, breaker["rejected"])],
+    )
+
+    stats = router.stats()
+    yield (
+        "chatbot_route_decisions_total",
+        "counter",
+        "Chat turns classified to each route, by the reason for it.",
+        [
+            (
+                {"route": decision["route"], "reason": decision["reason"]},
+                decision["count"],
+            )
+            for decision in stats["decisions"]
+        ],
+    )
+    routes = stats["routes"].items()
+    yield (
+        "chatbot_route_fallbacks_total",
+        "counter",
+        "Turns sent to a route's fallback because the route was over its SLO.",
+        [({"route": name}, route["fallbacks"]) for name, route in routes],
+    )
+    yield (
+        "chatbot_route_failures_total",
+        "counter",
+        "Failed model calls on each route.",
+        [({"route": name}, route["failures"]) for name, route in routes],
+    )
+    yield (
+        "chatbot_route_slo_p95_seconds",
+        "gauge",
+        "Latency SLO of each route, on the p95 of its recent calls.",
+        [({"route": name}, route["slo_p95_seconds"]) for name, route in routes],
+    )
+    yield (
+        "chatbot_route_degraded",
+        "gauge",
+        "1 while a route's recent p95 is over its SLO.",
+        [({"route": name}, int(route["degraded"])) for name, route in routes],
+    )
+
+    stats = response_cache.stats()
+    yield (
+        "chatbot_response_cache_hits_total",
+        "counter",
+        "Response cache hits.",
+        [({"tier": tier}, count) for tier, count in stats["hits"].items()],
+    )
+    yield (
+        "chatbot_response_cache_misses_total",
+        "counter",
+        "Response cache misses.",
+        [({}, stats["misses"])],
+    )
+    yield (
+        "chatbot_response_cache_bypassed_total",
+        "counter",
+        "Requests that asked to bypass the response cache.",
+        [({}, stats["bypassed"])],
+    )
+
+    stats = session_store.stats()
+    yield (
+        "chatbot_sessions",
+        "gauge",
+        "Sessions held in this process's memory.",
+        [({}, stats["sessions"])],
+    )
+    yield (
+        "chatbot_session_bytes",
+        "gauge",
+        "Estimated size of the session memory.",
+        [({}, stats["bytes"])],
+    )
+    yield (
+        "chatbot_session_evictions_total",
+        "counter",
+        "Sessions evicted from memory.",
+        [({"reason": reason}, count) for reason, count in stats["evictions"].items()],
+    )
+
+
+registry.collectors.append(pipeline_metrics)
+registry.collectors.append(llm_metrics)
+
+
+def has_metrics_token(request):
+    token = metrics_settings["TOKEN"]
+    if not token:
+        return False
+    scheme, _, given = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(
+        given.encode(), token.encode()
+    )
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint; open to staff users, requests bearing
+    ``TOKEN`` and clients in ``ALLOWED_IPS``.
+    """
+    if not (
+        request.user.is_staff
+        or has_metrics_token(request)
+        or request.META.get("REMOTE_ADDR") in metrics_settings["ALLOWED_IPS"]
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
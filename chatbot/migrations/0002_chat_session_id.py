@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatbot", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chat",
+            name="session_id",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name="chat",
+            index=models.Index(fields=["session_id", "id"], name="chat_session_idx"),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatbot", "0003_chatjob"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chat",
+            index=models.Index(
+                fields=["user", "-created_at", "-id"], name="chat_user_created_idx"
+            ),
+        ),
+    ]
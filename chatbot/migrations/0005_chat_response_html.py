@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatbot", "0004_chat_user_created_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chat",
+            name="response_html",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="chat",
+            name="response_html_version",
+            field=models.CharField(blank=True, default="", max_length=16),
+        ),
+    ]
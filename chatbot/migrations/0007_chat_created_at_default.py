@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:45
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatbot", "0006_chat_user_fk_unindexed"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="chat",
+            name="created_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+    ]
@@ -0,0 +1,89 @@
+from django.db import migrations
+
+# The full-text index of chatbot/search.py, as it was when this migration was
+# written. Backend-specific: other databases get no index and cannot be
+# searched.
+FTS_TABLE = "chatbot_chat_fts"
+
+SQLITE_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        user_id, message, response,
+        content='chatbot_chat', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS chatbot_chat_fts_insert
+    AFTER INSERT ON chatbot_chat BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, user_id, message, response)
+        VALUES (new.id, new.user_id, new.message, new.response);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS chatbot_chat_fts_delete
+    AFTER DELETE ON chatbot_chat BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, user_id, message, response)
+        VALUES ('delete', old.id, old.user_id, old.message, old.response);
+    END
+    """,
+    # Only edits of indexed columns; not, say, a session being cleared.
+    f"""
+    CREATE TRIGGER IF NOT EXISTS chatbot_chat_fts_update
+    AFTER UPDATE OF user_id, message, response ON chatbot_chat BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, user_id, message, response)
+        VALUES ('delete', old.id, old.user_id, old.message, old.response);
+        INSERT INTO {FTS_TABLE} (rowid, user_id, message, response)
+        VALUES (new.id, new.user_id, new.message, new.response);
+    END
+    """,
+    # Index the chats already stored.
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS chatbot_chat_fts_insert",
+    "DROP TRIGGER IF EXISTS chatbot_chat_fts_delete",
+    "DROP TRIGGER IF EXISTS chatbot_chat_fts_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+# The generated column is computed for existing rows as it is added.
+POSTGRES_SCHEMA = [
+    """
+    ALTER TABLE chatbot_chat ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('english', coalesce(message, '') || ' ' || coalesce(response, ''))
+    ) STORED
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS chat_search_idx
+    ON chatbot_chat USING GIN (search_vector)
+    """,
+]
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS chat_search_idx",
+    "ALTER TABLE chatbot_chat DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatbot", "0007_chat_created_at_default"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({"sqlite": SQLITE_SCHEMA, "postgresql": POSTGRES_SCHEMA}),
+            run({"sqlite": SQLITE_DROP, "postgresql": POSTGRES_DROP}),
+            elidable=False,
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+from django.db.models import Count, Max, Min
+
+PREVIEW_LENGTH = 255
+
+
+def preview(text):
+    text = " ".join(text.split())
+    return text if len(text) <= PREVIEW_LENGTH else text[: PREVIEW_LENGTH - 1] + "…"
+
+
+def backfill(apps, schema_editor):
+    """One conversation per (user, session_id) of the existing chats."""
+    Chat = apps.get_model("chatbot", "Chat")
+    Conversation = apps.get_model("chatbot", "Conversation")
+    unattached = Chat.objects.filter(conversation__isnull=True).exclude(session_id="")
+    sessions = list(
+        unattached.values("user_id", "session_id")
+        .annotate(count=Count("id"), first_id=Min("id"), last_id=Max("id"))
+        .order_by()
+    )
+    for session in sessions:
+        first = Chat.objects.only("message", "created_at").get(pk=session["first_id"])
+        last = Chat.objects.only("message", "created_at").get(pk=session["last_id"])
+        conversation = Conversation.objects.create(
+            user_id=session["user_id"],
+            session_id=session["session_id"],
+            title=preview(first.message),
+            last_message=preview(last.message),
+            last_message_at=last.created_at,
+            message_count=session["count"],
+            created_at=first.created_at,
+        )
+        unattached.filter(
+            user_id=session["user_id"], session_id=session["session_id"]
+        ).update(conversation=conversation)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatbot", "0009_conversation"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
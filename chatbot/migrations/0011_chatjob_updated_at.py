@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chatbot", "0010_backfill_conversations"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatjob",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
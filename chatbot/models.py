@@ -1,17 +1,155 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.http import response
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from .rendering import render_markdown, render_version
 
 # Create your models here.
 
 
+class Conversation(models.Model):
+    """
+    One conversation of a user: the turns sharing a ``session_id``.
+
+    ``last_message``, ``last_message_at`` and ``message_count`` duplicate what
+    could be aggregated from the conversation's chats, so that listing a
+    user's conversations reads one index range and nothing else. They are
+    kept current as turns are written (see chatbot/conversations.py).
+    """
+
+    PREVIEW_LENGTH = 255
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    # Key of the conversation's memory in the session store.
+    session_id = models.CharField(max_length=255)
+    title = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default="")
+    last_message = models.CharField(max_length=PREVIEW_LENGTH, blank=True, default="")
+    last_message_at = models.DateTimeField(default=timezone.now)
+    message_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        constraints = [
+            # Also the index for looking a conversation up by its session.
+            models.UniqueConstraint(
+                fields=["user", "session_id"], name="conversation_user_session_uniq"
+            ),
+        ]
+        indexes = [
+            # Serves the most-recent-first conversation list.
+            models.Index(
+                fields=["user", "-last_message_at", "-id"],
+                name="conversation_user_recent_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.title}"
+
+
 class Chat(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # No index of its own: chat_user_created_idx starts with user and serves
+    # the same lookups, so a second index would only slow down every insert.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    # Conversation this turn belongs to; used to rebuild the model's memory.
+    session_id = models.CharField(max_length=255, blank=True, default="")
+    # Set when the turn is written; stays when the session's memory is cleared.
+    conversation = models.ForeignKey(
+        Conversation,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="chats",
+        db_index=False,
+    )
     message = models.TextField()
     response = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Sanitized HTML of ``response``, rendered when the row is saved.
+    response_html = models.TextField(blank=True, default="")
+    response_html_version = models.CharField(max_length=16, blank=True, default="")
+    # Set when the turn is created, not when it is written (see
+    # chatbot/persistence.py), hence not auto_now_add.
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["session_id", "id"], name="chat_session_idx"),
+            # Serves the newest-first history pages in chatbot/pagination.py.
+            models.Index(
+                fields=["user", "-created_at", "-id"], name="chat_user_created_idx"
+            ),
+            models.Index(fields=["conversation", "id"], name="chat_conversation_idx"),
+        ]
 
     # This function returns a string representation of the Chat object,
     # showing the username of the user and their message.
     def __str__(self):
         return f"{self.user.username}: {self.message}"
+
+    def save(self, *args, **kwargs):
+        from .conversations import attach_conversations, record_turns
+
+        adding = self._state.adding
+        if adding:
+            attach_conversations([self])
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "response" in update_fields:
+            self.render_response()
+            if update_fields is not None:
+                kwargs["update_fields"] = {
+                    *update_fields,
+                    "response_html",
+                    "response_html_version",
+                }
+        super().save(*args, **kwargs)
+        if adding:
+            record_turns([self])
+
+    def render_response(self):
+        """Render ``response`` into ``response_html`` (see chatbot/rendering.py)."""
+        self.response_html = render_markdown(self.response)
+        self.response_html_version = render_version()
+
+    @property
+    def rendered_response(self):
+        """The response as sanitized HTML, re-rendered if the stored copy is stale."""
+        if self.response_html_version == render_version():
+            return mark_safe(self.response_html)
+        return render_markdown(self.response)
+
+
+class ChatJob(models.Model):
+    """A chat message queued for background processing (see chatbot/jobs.py)."""
+
+    class Status(models.TextChoices):
+        QUEUED = "queued"
+        RUNNING = "running"
+        DONE = "done"
+        FAILED = "failed"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    session_id = models.CharField(max_length=255, blank=True, default="")
+    message = models.TextField()
+    language = models.CharField(max_length=64, default="English")
+    bypass_cache = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=16, choices=Status.choices, default=Status.QUEUED
+    )
+    chat = models.ForeignKey(Chat, null=True, blank=True, on_delete=models.SET_NULL)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Touched as the job changes status; see LocalJobQueue.reap().
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def is_finished(self):
+        return self.status in (self.Status.DONE, self.Status.FAILED)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.status}"
@@ -0,0 +1,72 @@
+"""
+Keyset pagination of chat history.
+
+Pages are read newest first on ``(created_at, id)``, which the
+``chat_user_created_idx`` index serves directly, so fetching a page costs the
+same whether a user has ten chats or a hundred thousand. Cursors encode the
+position of the last row returned rather than an offset.
+"""
+
+import base64
+from datetime import datetime
+
+from rest_framework.pagination import CursorPagination
+
+HISTORY_PAGE_SIZE = 50
+
+
+class ChatCursorPagination(CursorPagination):
+    """Cursor pagination for the chat list API, newest chat first."""
+
+    ordering = ("-created_at", "-id")
+    page_size = HISTORY_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+class ConversationCursorPagination(CursorPagination):
+    """Cursor pagination for the conversation list, most recent first."""
+
+    # Served by conversation_user_recent_idx.
+    ordering = ("-last_message_at", "-id")
+    page_size = HISTORY_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+def encode_cursor(chat):
+    position = f"{chat.created_at.isoformat()}|{chat.pk}"
+    return base64.urlsafe_b64encode(position.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Return ``(created_at, id)`` for ``cursor``, or ``None`` if it is invalid."""
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, pk = position.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def history_page(queryset, before=None, page_size=HISTORY_PAGE_SIZE):
+    """
+    Return one page of ``queryset`` older than the ``before`` cursor.
+
+    The chats come back oldest first, ready to render, along with the cursor
+    for the next (older) page, or ``None`` when there is nothing left.
+    """
+    position = decode_cursor(before) if before else None
+    if position is not None:
+        created_at, pk = position
+        # A plain range on created_at keeps the scan on the index; ties on
+        # the cursor's timestamp are then cut by id.
+        queryset = queryset.filter(created_at__lte=created_at).exclude(
+            created_at=created_at, id__gte=pk
+        )
+    chats = list(queryset.order_by("-created_at", "-id")[: page_size + 1])
+    next_cursor = None
+    if len(chats) > page_size:
+        chats = chats[:page_size]
+        next_cursor = encode_cursor(chats[-1])
+    return chats[::-1], next_cursor
@@ -0,0 +1,329 @@
+"""
+Write-behind persistence of chat turns.
+
+The chat views hand each finished turn to ``chat_writer`` instead of saving
+it: the ``Chat`` is buffered in memory and a background thread inserts the
+buffer with one ``bulk_create`` once ``BATCH_SIZE`` turns are waiting or
+``FLUSH_INTERVAL`` seconds have passed, rendering the response HTML on the
+way. Buffered turns have no id yet: views that respond with the saved row
+use ``write``, which also flushes the buffer before it returns. Requests
+arriving together then share one insert.
+
+Durability:
+
+* the buffer is flushed when the process exits normally;
+* with ``LOG_DIR`` set, each turn is also appended to a per-process log before
+  the view responds, and ``manage.py recover_chat_log`` inserts whatever a
+  crashed process logged but never flushed. Recovery is at-least-once: a turn
+  flushed just before a crash, before the log recorded it, is inserted twice.
+
+Reads of the user's newest history include ``pending`` turns, so a user sees
+their own turns before they are flushed. Other workers see them after the
+flush. With ``ENABLED`` off, ``submit`` saves each turn right away.
+"""
+
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+CHAT_WRITER_DEFAULTS = {
+    "ENABLED": True,
+    "BATCH_SIZE": 100,
+    "FLUSH_INTERVAL": 0.2,
+    # Beyond this many buffered turns, submit() flushes in the caller's thread.
+    "MAX_PENDING": 5000,
+    "LOG_DIR": None,
+    # fsync every log write: survives a machine crash, not just a process one.
+    "FSYNC": False,
+}
+chat_writer_settings = {
+    **CHAT_WRITER_DEFAULTS,
+    **getattr(settings, "CHATBOT_CHAT_WRITER", {}),
+}
+
+LOGGED_FIELDS = ("user_id", "session_id", "message", "response")
+
+
+class WriteLog:
+    """
+    Append-only log of the turns submitted by this process, in ``directory``.
+
+    Turns are flushed in submission order, so after each flush a marker
+    records how many of the logged turns are in the database; the turns after
+    the last marker are the ones to recover.
+    """
+
+    def __init__(self, directory, fsync=False):
+        self.directory = Path(directory)
+        self.fsync = fsync
+        self._file = None
+        self._pid = None
+
+    @staticmethod
+    def process_of(path):
+        """``(host, pid)`` of the process that wrote the log at ``path``."""
+        name = Path(path).stem.removeprefix("chats-").rpartition("-")[0]
+        host, _, pid = name.rpartition("-")
+        return host, int(pid)
+
+    def append(self, chat):
+        record = {field: getattr(chat, field) for field in LOGGED_FIELDS}
+        record["created_at"] = chat.created_at.isoformat()
+        self._write(record)
+
+    def mark_flushed(self, count, empty):
+        """Record ``count`` more turns as flushed; start over once all are."""
+        if self._file is None:
+            return
+        if empty:
+            self._file.truncate(0)
+            self._file.seek(0)
+        else:
+            self._write({"flushed": count})
+
+    def _write(self, record):
+        if self._pid != os.getpid():
+            # Opened lazily, so that each forked worker gets its own file.
+            self._pid = os.getpid()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # A restarted container has the same host name and often the same
+            # pid; the token keeps it from writing to its predecessor's log.
+            name = f"chats-{socket.gethostname()}-{self._pid}-{uuid.uuid4().hex}"
+            self._file = open(self.directory / f"{name}.log", "x", encoding="utf-8")
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    @staticmethod
+    def unflushed(path):
+        """The turns logged at ``path`` that were never flushed."""
+        records = []
+        flushed = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A write cut short by the crash.
+                    continue
+                if "flushed" in record:
+                    flushed += record["flushed"]
+                else:
+                    records.append(record)
+        return records[flushed:]
+
+
+def merge_pending(chats, pending):
+    """
+    ``chats`` (oldest first) followed by the ``pending`` turns not among them.
+
+    Take ``pending`` before querying ``chats``: a turn flushed in between is
+    then in both, and recognized by the id the flush gave it.
+    """
+    seen = {chat.pk for chat in chats}
+    return list(chats) + [chat for chat in pending if chat.pk not in seen]
+
+
+def chat_from_record(record):
+    from .models import Chat
+
+    return Chat(
+        **{field: record[field] for field in LOGGED_FIELDS},
+        created_at=parse_datetime(record["created_at"]),
+    )
+
+
+def insert_chats(chats):
+    """
+    Insert ``chats`` in one query, along with their conversations (see
+    chatbot/conversations.py). If that violates a constraint (say, the user
+    was deleted meanwhile), insert them one by one and drop the rows that
+    cannot be written, so one bad turn does not block the rest.
+    """
+    from .conversations import attach_conversations, record_turns
+    from .models import Chat
+
+    for chat in chats:
+        chat.render_response()
+    attach_conversations(chats)
+    try:
+        Chat.objects.bulk_create(chats)
+        written = chats
+    except IntegrityError:
+        written = []
+        for chat in chats:
+            try:
+                Chat.objects.bulk_create([chat])
+                written.append(chat)
+            except IntegrityError:
+                logger.exception("Dropping chat turn of user %s", chat.user_id)
+    record_turns(written)
+
+
+class ChatWriter:
+    def __init__(
+        self,
+        enabled=True,
+        batch_size=100,
+        flush_interval=0.2,
+        max_pending=5000,
+        log_dir=None,
+        fsync=False,
+    ):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.log = WriteLog(log_dir, fsync) if enabled and log_dir else None
+        self._lock = threading.Lock()
+        # Flushes are serialized so turns reach the database in order.
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+        self.flushed = 0
+        self.failed_flushes = 0
+
+    def submit(self, chat):
+        """Persist ``chat``: buffer it, or save it now if disabled or closed."""
+        if not self.enabled or self._closed:
+            chat.save()
+            return
+        with self._lock:
+            self._pending.append(chat)
+            if self.log is not None:
+                self.log.append(chat)
+            size = len(self._pending)
+        self._start()
+        if size >= self.max_pending:
+            # The database is not keeping up; make the caller wait for it.
+            self.flush()
+        elif size >= self.batch_size:
+            self._wake.set()
+
+    async def asubmit(self, chat):
+        if not self.enabled or self._closed:
+            await chat.asave()
+        else:
+            self.submit(chat)
+
+    def write(self, chat):
+        """
+        Persist ``chat`` before returning, so that it has its id.
+
+        The turn is buffered like any other and the buffer is flushed in the
+        caller's thread, taking along the turns other requests are waiting
+        on. If the flush fails, the turn stays buffered, without an id, for
+        the flush thread to retry.
+        """
+        self.submit(chat)
+        while chat.pk is None and self.flush():
+            pass
+
+    async def awrite(self, chat):
+        await sync_to_async(self.write)(chat)
+
+    def pending(self, user_id):
+        """Buffered turns of ``user_id``, oldest first."""
+        # A TokenUser's id is the token's claim, which may be a string.
+        user_id = str(user_id)
+        with self._lock:
+            return [chat for chat in self._pending if str(chat.user_id) == user_id]
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch = self._pending[: self.batch_size * 10]
+            if not batch:
+                return 0
+            try:
+                insert_chats(batch)
+            except Exception:
+                self.failed_flushes += 1
+                logger.exception("Could not write %d chat turns", len(batch))
+                return 0
+            with self._lock:
+                del self._pending[: len(batch)]
+                if self.log is not None:
+                    self.log.mark_flushed(len(batch), empty=not self._pending)
+                self.flushed += len(batch)
+            return len(batch)
+
+    def close(self):
+        """Stop the flush thread and write out everything still buffered."""
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        while self._pending:
+            if not self.flush():
+                logger.error("Exiting with %d chat turns unwritten", len(self._pending))
+                break
+        if self.log is not None:
+            self.log.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "pending": len(self._pending),
+                "flushed": self.flushed,
+                "failed_flushes": self.failed_flushes,
+            }
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="chat-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                while self.flush() >= self.batch_size:
+                    pass
+            finally:
+                # Only this thread's connection: flush() also runs on request
+                # threads, whose connection the request may still be using.
+                close_old_connections()
+
+
+def create_chat_writer():
+    options = chat_writer_settings
+    writer = ChatWriter(
+        enabled=options["ENABLED"],
+        batch_size=options["BATCH_SIZE"],
+        flush_interval=options["FLUSH_INTERVAL"],
+        max_pending=options["MAX_PENDING"],
+        log_dir=options["LOG_DIR"],
+        fsync=options["FSYNC"],
+    )
+    atexit.register(writer.close)
+    return writer
+
+
+chat_writer = create_chat_writer()
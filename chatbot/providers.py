@@ -0,0 +1,95 @@
+"""
+LLM providers: where the chat models used by ``services`` come from.
+
+The provider is selected with the ``CHATBOT_LLM_PROVIDER`` setting::
+
+    CHATBOT_LLM_PROVIDER = {
+        "BACKEND": "chatbot.providers.FakeProvider",
+        "OPTIONS": {"latency": 0.2, "tokens_per_second": 200},
+    }
+
+``GroqProvider`` talks to the Groq API. ``FakeProvider`` answers locally and
+deterministically, with configurable latency, token rate and injected
+failures, so the app can be benchmarked and load-tested without a network.
+"""
+
+import os
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class ProviderError(Exception):
+    """An upstream model call failed."""
+
+
+class TransientProviderError(ProviderError):
+    """An upstream failure that is worth retrying (overload, timeout, 5xx)."""
+
+
+class BaseProvider:
+    def chat_model(self, model):
+        """Return a LangChain chat model for ``model``."""
+        raise NotImplementedError
+
+
+class GroqProvider(BaseProvider):
+    def __init__(self, api_key=None):
+        import httpx
+        from langchain_groq import ChatGroq
+
+        self.chat_model_class = ChatGroq
+        self.api_key = api_key or os.getenv("GROQ_API_KEY")
+        # One connection pool per process, shared by every ChatGroq client so
+        # that consecutive chat turns reuse keep-alive connections.
+        self.http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+        self.http_async_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+
+    def chat_model(self, model):
+        return self.chat_model_class(
+            model=model,
+            groq_api_key=self.api_key,
+            http_client=self.http_client,
+            http_async_client=self.http_async_client,
+            # Retries are handled by services.upstream, across providers.
+            max_retries=0,
+        )
+
+
+class FakeProvider(BaseProvider):
+    def __init__(
+        self,
+        latency=0.0,
+        tokens_per_second=0.0,
+        response_tokens=20,
+        failure_rate=0.0,
+        slow_rate=0.0,
+        slow_latency=0.0,
+        seed=0,
+    ):
+        self.options = {
+            "latency": latency,
+            "tokens_per_second": tokens_per_second,
+            "response_tokens": response_tokens,
+            "failure_rate": failure_rate,
+            "slow_rate": slow_rate,
+            "slow_latency": slow_latency,
+            "seed": seed,
+        }
+
+    def chat_model(self, model):
+        from .fake_models import FakeChatModel
+
+        return FakeChatModel(model_name=model, **self.options)
+
+
+def create_provider():
+    config = getattr(settings, "CHATBOT_LLM_PROVIDER", {})
+    backend = import_string(config.get("BACKEND", "chatbot.providers.GroqProvider"))
+    return backend(**config.get("OPTIONS", {}))
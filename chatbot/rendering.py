@@ -0,0 +1,46 @@
+"""
+Markdown rendering of chat responses.
+
+Responses are rendered to sanitized HTML once, when their ``Chat`` row is
+saved, and the HTML is stored on the row with the ``render_version`` it was
+produced under. The version covers the ``MARKDOWNIFY`` setting and the
+versions of the libraries doing the work, so changing either makes stored HTML
+stale; stale rows are re-rendered on read until ``manage.py render_chat_html``
+backfills them.
+"""
+
+import hashlib
+from functools import lru_cache
+from importlib.metadata import PackageNotFoundError, version
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from markdownify.templatetags.markdownify import markdownify
+
+from .metrics import stage
+
+RENDER_PACKAGES = ("django-markdownify", "markdown", "bleach")
+
+
+@lru_cache(maxsize=None)
+def render_version():
+    """Short digest of everything that affects the rendered HTML."""
+    parts = [repr(getattr(settings, "MARKDOWNIFY", {}).get("default"))]
+    for package in RENDER_PACKAGES:
+        try:
+            parts.append(f"{package}=={version(package)}")
+        except PackageNotFoundError:
+            parts.append(f"{package}==?")
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+@receiver(setting_changed)
+def reset_render_version(setting, **kwargs):
+    if setting == "MARKDOWNIFY":
+        render_version.cache_clear()
+
+
+def render_markdown(text):
+    with stage("render"):
+        return markdownify(text)
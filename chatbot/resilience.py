@@ -0,0 +1,444 @@
+"""
+Resilience around upstream model calls.
+
+``Resilience`` runs each model call under a per-attempt timeout and an overall
+deadline, retries transient failures with jittered exponential backoff, can
+hedge a second request when the first is slower than recent calls usually
+are, and trips a circuit breaker after consecutive failures so that a degraded
+upstream fails fast instead of tying up every worker. It is configured with
+the ``CHATBOT_RESILIENCE`` setting (see ``services``).
+"""
+
+import asyncio
+import contextvars
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .providers import ProviderError, TransientProviderError
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and 5xx.
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class UpstreamTimeout(TransientProviderError):
+    """An attempt did not finish within its timeout."""
+
+
+class CircuitOpen(ProviderError):
+    """The circuit breaker is open; the call was not attempted."""
+
+    def __init__(self, retry_after):
+        super().__init__("The model is temporarily unavailable")
+        self.retry_after = retry_after
+
+
+class ChatError(Exception):
+    """
+    A chat turn could not be answered.
+
+    Raised by the ``services`` chat functions in place of an answer, so that a
+    failure is reported to the client instead of being saved as chat text.
+    """
+
+    STATUS = {"timeout": 504, "unavailable": 503, "upstream_error": 502}
+
+    def __init__(self, code, message, retry_after=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.retry_after = retry_after
+
+    @property
+    def status(self):
+        return self.STATUS.get(self.code, 502)
+
+    def as_dict(self):
+        data = {"error": self.message, "code": self.code}
+        if self.retry_after is not None:
+            data["retry_after"] = self.retry_after
+        return data
+
+    @classmethod
+    def from_exception(cls, exc):
+        if isinstance(exc, cls):
+            return exc
+        if isinstance(exc, CircuitOpen):
+            return cls("unavailable", str(exc), retry_after=exc.retry_after)
+        if isinstance(exc, UpstreamTimeout):
+            return cls("timeout", "The model took too long to respond")
+        return cls("upstream_error", "The model could not answer this message")
+
+
+def is_transient(exc):
+    """True if ``exc`` is an upstream failure that a retry may get past."""
+    import httpx
+
+    if isinstance(
+        exc,
+        (
+            TransientProviderError,
+            TimeoutError,
+            httpx.TimeoutException,
+            httpx.NetworkError,
+        ),
+    ):
+        return True
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    try:
+        import groq
+    except ImportError:
+        return False
+    return isinstance(exc, groq.APIConnectionError)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After ``failure_threshold`` transient failures in a row the circuit opens
+    and calls fail with ``CircuitOpen`` for ``reset_timeout`` seconds. Then a
+    single trial call is let through: success closes the circuit, failure
+    opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = None
+        # Start time of the half-open trial call, if one is in flight.
+        self._trial_started = None
+        self.opened = 0
+        self.rejected = 0
+
+    def before_call(self):
+        """Raise ``CircuitOpen`` unless a call may go ahead now."""
+        with self._lock:
+            now = self.clock()
+            if self.state == self.OPEN:
+                elapsed = now - self._opened_at
+                if elapsed < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpen(math.ceil(self.reset_timeout - elapsed))
+                self.state = self.HALF_OPEN
+                self._trial_started = None
+            if self.state == self.HALF_OPEN:
+                # A trial that never reported back does not block forever.
+                if (
+                    self._trial_started is not None
+                    and now - self._trial_started < self.reset_timeout
+                ):
+                    self.rejected += 1
+                    raise CircuitOpen(math.ceil(self.reset_timeout))
+                self._trial_started = now
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = self.clock()
+                self._trial_started = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+class LatencyTracker:
+    """Latencies of the most recent successful calls."""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+_END = object()
+
+
+class Resilience:
+    """
+    Timeouts, retries, hedging and a circuit breaker for one upstream.
+
+    ``call`` and ``acall`` wrap a whole model call. ``stream`` and ``astream``
+    wrap a streamed one up to its first chunk: failures before any output are
+    retried, while a failure after output has been sent is raised as is.
+    Because attempts may overlap when hedging, and a timed-out sync attempt
+    keeps running in its thread, the wrapped call must be free of side
+    effects. The chat functions fold old turns into the session summary
+    before the call and update session history after it.
+    """
+
+    def __init__(
+        self,
+        timeout=30,
+        deadline=60,
+        retries=2,
+        backoff_base=0.25,
+        backoff_max=4.0,
+        hedge=False,
+        hedge_percentile=0.95,
+        hedge_min_delay=0.5,
+        hedge_min_samples=20,
+        breaker_failures=5,
+        breaker_reset=30,
+        max_workers=64,
+        clock=time.monotonic,
+    ):
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.max_workers = max_workers
+        self.clock = clock
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset, clock)
+        self.latencies = LatencyTracker()
+        self.first_chunk_latencies = LatencyTracker()
+        self._lock = threading.Lock()
+        self._executor = None
+        self.counts = {"calls": 0, "retries": 0, "timeouts": 0, "hedges": 0}
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff before retry number ``attempt + 1``."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def hedge_delay(self, latencies):
+        """Seconds to wait before hedging, or ``None`` to not hedge."""
+        if not self.hedge or len(latencies) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, latencies.percentile(self.hedge_percentile))
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        return {
+            **counts,
+            "breaker": self.breaker.stats(),
+            "p95_seconds": self.latencies.percentile(0.95),
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="chat-call"
+                    )
+        return self._executor
+
+    def _record(self, exc):
+        # Only failures that say something about the upstream's health count
+        # against the breaker; a rejected request means it is up.
+        if is_transient(exc):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if isinstance(exc, UpstreamTimeout):
+            self._count("timeouts")
+
+    def _retry_delay(self, exc, attempt, deadline):
+        """Backoff before the next attempt, or ``None`` if ``exc`` is final."""
+        if not is_transient(exc) or attempt >= self.retries:
+            return None
+        delay = self.backoff(attempt)
+        if self.clock() + delay >= deadline:
+            return None
+        self._count("retries")
+        return delay
+
+    def call(self, func, latencies=None):
+        """Return ``func()``, run under the policy; raises the last failure."""
+        latencies = self.latencies if latencies is None else latencies
+        self._count("calls")
+        deadline = self.clock() + self.deadline
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            start = self.clock()
+            try:
+                result = self._attempt(func, deadline, latencies)
+            except Exception as e:
+                self._record(e)
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            latencies.add(self.clock() - start)
+            return result
+
+    def _attempt(self, func, deadline, latencies):
+        end = min(self.clock() + self.timeout, deadline)
+        hedge_at = self.hedge_delay(latencies)
+        if hedge_at is not None:
+            hedge_at += self.clock()
+        pool = self._pool()
+        pending = {pool.submit(contextvars.copy_context().run, func)}
+        while True:
+            now = self.clock()
+            if now >= end:
+                raise UpstreamTimeout(f"No response within {self.timeout}s")
+            until = end if hedge_at is None else min(end, hedge_at)
+            done, pending = wait(
+                pending, timeout=until - now, return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                if not pending:
+                    raise future.exception()
+            if hedge_at is not None and self.clock() >= hedge_at:
+                hedge_at = None
+                self._count("hedges")
+                pending.add(pool.submit(contextvars.copy_context().run, func))
+
+    async def acall(self, afunc, latencies=None):
+        """Async ``call``; ``afunc`` returns a new awaitable for each attempt."""
+        latencies = self.latencies if latencies is None else latencies
+        self._count("calls")
+        deadline = self.clock() + self.deadline
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            start = self.clock()
+            try:
+                result = await self._aattempt(afunc, deadline, latencies)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._record(e)
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            latencies.add(self.clock() - start)
+            return result
+
+    async def _aattempt(self, afunc, deadline, latencies):
+        end = min(self.clock() + self.timeout, deadline)
+        hedge_at = self.hedge_delay(latencies)
+        if hedge_at is not None:
+            hedge_at += self.clock()
+        pending = {asyncio.ensure_future(afunc())}
+        try:
+            while True:
+                now = self.clock()
+                if now >= end:
+                    raise UpstreamTimeout(f"No response within {self.timeout}s")
+                until = end if hedge_at is None else min(end, hedge_at)
+                done, pending = await asyncio.wait(
+                    pending, timeout=until - now, return_when=FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    if not pending:
+                        raise task.exception()
+                if hedge_at is not None and self.clock() >= hedge_at:
+                    hedge_at = None
+                    self._count("hedges")
+                    pending.add(asyncio.ensure_future(afunc()))
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stream(self, start):
+        """
+        Yield the chunks of the iterator returned by ``start()``.
+
+        The attempt covers starting the stream and receiving its first chunk.
+        """
+
+        def first_chunk():
+            iterator = start()
+            return next(iterator, _END), iterator
+
+        first, iterator = self.call(first_chunk, self.first_chunk_latencies)
+        try:
+            if first is not _END:
+                yield first
+            yield from iterator
+        except Exception as e:
+            self._record(e)
+            raise
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    async def astream(self, start):
+        """Async ``stream``; ``start()`` returns an async iterator."""
+
+        async def first_chunk():
+            iterator = start()
+            return await anext(iterator, _END), iterator
+
+        first, iterator = await self.acall(first_chunk, self.first_chunk_latencies)
+        try:
+            if first is not _END:
+                yield first
+            async for chunk in iterator:
+                yield chunk
+        except Exception as e:
+            self._record(e)
+            raise
+        finally:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
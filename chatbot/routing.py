@@ -0,0 +1,196 @@
+"""
+Routing of chat turns to models.
+
+Most turns ("thanks!", "hi", a one-line question early in a conversation) do
+not need the largest model. ``ModelRouter`` classifies each turn with cheap
+local heuristics, namely the message's length, the depth of the history and
+an intent read off the text, and sends it to one of the configured routes:
+simple turns to a fast model, the rest to the full one.
+
+Each route has a latency SLO on the p95 of its recent calls, timed until the
+answer (or, when streaming, its first chunk) arrives; failed calls count as
+over the SLO. While a route's p95 is over its SLO, its turns go to its
+``FALLBACK`` route instead. Samples age out after ``WINDOW_SECONDS``, so a
+degraded route that receives no traffic is tried again once its window has
+emptied. It is configured with the ``CHATBOT_ROUTING`` setting (see
+``services``); decisions, fallbacks and per-route latencies are exported as
+metrics for tuning the thresholds.
+"""
+
+import math
+import re
+import threading
+import time
+from collections import deque
+
+from .metrics import route_seconds
+
+GREETING = re.compile(
+    r"^\W*(hi|hello|hey|yo|thanks?|thank you|thx|ty|ok(ay)?|cool|great|nice|"
+    r"got it|bye|good (morning|afternoon|evening|night)|yes|no|sure)\b[\W\s]*"
+    r"(very much|a lot|so much)?[\W\s]*$",
+    re.IGNORECASE,
+)
+CODE = re.compile(r"```|\b(def|class|function|import|select|return)\b|[{};]\s*$|=>")
+COMPLEX_WORDS = re.compile(
+    r"\b(explain|why|how does|compare|difference|analy[sz]e|design|implement|"
+    r"debug|refactor|optimi[sz]e|prove|derive|calculate|step[- ]by[- ]step|"
+    r"write|translate|summari[sz]e|plan|pros and cons)\b",
+    re.IGNORECASE,
+)
+
+
+class RouteLatencies:
+    """Latencies of a route's calls in the last ``max_age`` seconds."""
+
+    def __init__(self, max_age=60, size=200, clock=time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append((self.clock(), seconds))
+
+    def percentile(self, fraction):
+        """The ``fraction`` percentile and the sample count it is based on."""
+        with self._lock:
+            oldest = self.clock() - self.max_age
+            while self._samples and self._samples[0][0] < oldest:
+                self._samples.popleft()
+            ordered = sorted(seconds for _, seconds in self._samples)
+        if not ordered:
+            return None, 0
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], len(
+            ordered
+        )
+
+
+class Route:
+    def __init__(self, name, model, slo_p95, fallback=None, latencies=None):
+        self.name = name
+        self.model = model
+        self.slo_p95 = slo_p95
+        self.fallback = fallback
+        self.latencies = latencies or RouteLatencies()
+        self.chosen = 0
+        self.fallbacks = 0
+        self.failures = 0
+
+    def p95(self):
+        return self.latencies.percentile(0.95)[0]
+
+    def degraded(self, min_samples):
+        p95, samples = self.latencies.percentile(0.95)
+        return samples >= min_samples and p95 > self.slo_p95
+
+
+class ModelRouter:
+    """Picks a route for each turn; see the module docstring."""
+
+    def __init__(
+        self,
+        routes,
+        simple_route,
+        complex_route,
+        simple_max_words=12,
+        simple_max_history=6,
+        min_samples=20,
+    ):
+        self.routes = {route.name: route for route in routes}
+        self.simple_route = simple_route
+        self.complex_route = complex_route
+        self.simple_max_words = simple_max_words
+        self.simple_max_history = simple_max_history
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        # (route, reason) -> turns classified that way.
+        self.decisions = {}
+
+    def classify(self, message, history_messages):
+        """Return ``(route name, reason)`` for a turn."""
+        text = message.strip()
+        if GREETING.match(text):
+            return self.simple_route, "smalltalk"
+        if CODE.search(text):
+            return self.complex_route, "code"
+        if COMPLEX_WORDS.search(text):
+            return self.complex_route, "intent"
+        if len(text.split()) > self.simple_max_words:
+            return self.complex_route, "length"
+        if history_messages > self.simple_max_history:
+            return self.complex_route, "history"
+        return self.simple_route, "short"
+
+    def choose(self, message, history_messages):
+        """The route to send a turn to, after falling back from degraded ones."""
+        name, reason = self.classify(message, history_messages)
+        route = chosen = self.routes[name]
+        fallback = self.routes.get(route.fallback)
+        if (
+            fallback is not None
+            and route.degraded(self.min_samples)
+            and not fallback.degraded(self.min_samples)
+        ):
+            chosen = fallback
+        with self._lock:
+            self.decisions[(name, reason)] = self.decisions.get((name, reason), 0) + 1
+            if chosen is not route:
+                route.fallbacks += 1
+            chosen.chosen += 1
+        return chosen
+
+    def record(self, route, seconds, ok=True):
+        """Record how long a call on ``route`` took, or that it failed."""
+        if ok:
+            route_seconds.observe(seconds, route=route.name)
+        else:
+            with self._lock:
+                route.failures += 1
+        route.latencies.add(seconds if ok else math.inf)
+
+    def stats(self):
+        with self._lock:
+            decisions = dict(self.decisions)
+        routes = {}
+        for name, route in self.routes.items():
+            p95 = route.p95()
+            routes[name] = {
+                "model": route.model,
+                "slo_p95_seconds": route.slo_p95,
+                # Infinite when failures make up the slowest 5%.
+                "p95_seconds": p95 if p95 is None or math.isfinite(p95) else None,
+                "degraded": route.degraded(self.min_samples),
+                "chosen": route.chosen,
+                "fallbacks": route.fallbacks,
+                "failures": route.failures,
+            }
+        return {
+            "routes": routes,
+            "decisions": [
+                {"route": route, "reason": reason, "count": count}
+                for (route, reason), count in sorted(decisions.items())
+            ],
+        }
+
+
+def create_router(options):
+    routes = [
+        Route(
+            name,
+            route["MODEL"],
+            route["SLO_P95"],
+            route.get("FALLBACK"),
+            RouteLatencies(options["WINDOW_SECONDS"], options["WINDOW_SIZE"]),
+        )
+        for name, route in options["ROUTES"].items()
+    ]
+    return ModelRouter(
+        routes,
+        simple_route=options["SIMPLE_ROUTE"],
+        complex_route=options["COMPLEX_ROUTE"],
+        simple_max_words=options["SIMPLE_MAX_WORDS"],
+        simple_max_history=options["SIMPLE_MAX_HISTORY"],
+        min_samples=options["MIN_SAMPLES"],
+    )
@@ -0,0 +1,146 @@
+"""
+Full-text search of a user's chat history.
+
+A ``LIKE '%word%'`` over ``Chat.message`` and ``Chat.response`` reads every
+row, so it gets slower with each chat stored. Search instead goes through an
+inverted index the database keeps up to date on every insert:
+
+* SQLite: an FTS5 table, ``chatbot_chat_fts``, over the chat table's
+  ``user_id``, ``message`` and ``response``, filled by triggers. The user id is
+  indexed as a token, so restricting a search to one user is an index lookup
+  too.
+* PostgreSQL: a generated ``tsvector`` column, ``search_vector``, with a GIN
+  index.
+
+Both are created by migration 0008. On SQLite, a later migration that makes
+Django rebuild ``chatbot_chat`` (which most column changes do) drops the
+triggers with the old table, and has to create them again.
+
+Results come newest first, a keyset page at a time, and carry HTML snippets
+in which the matched words are wrapped in ``<mark>``.
+"""
+
+import html
+import re
+import sys
+
+from django.db import NotSupportedError, connection
+
+from .models import Chat
+
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+# Words around the matches in a snippet.
+SNIPPET_WORDS = 16
+
+FTS_TABLE = "chatbot_chat_fts"
+# The database marks matches with these; snippet_html() turns them into tags
+# after escaping the text, so chat content can never inject markup.
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+
+def search_terms(query):
+    """The words of ``query``, lowercased; punctuation and operators are dropped."""
+    return re.findall(r"\w+", query.lower())
+
+
+def snippet_html(snippet):
+    """Escape ``snippet`` and turn the database's match markers into ``<mark>``."""
+    return (
+        html.escape(snippet or "")
+        .replace(MATCH_START, "<mark>")
+        .replace(MATCH_END, "</mark>")
+    )
+
+
+def search_chats(user_id, query, before=None, page_size=SEARCH_PAGE_SIZE):
+    """
+    Search ``user_id``'s chats for every word of ``query``, newest first.
+
+    Returns one page of results older than the chat with id ``before``, as
+    dicts with ``id``, ``session_id``, ``created_at`` and ``message`` and
+    ``response`` snippets, along with the ``before`` of the next page, or
+    ``None`` when there is nothing left. Chats still buffered by the chat
+    writer (chatbot/persistence.py) are not searchable until they are written.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return [], None
+    # One extra row tells whether there is a next page.
+    limit = page_size + 1
+    if connection.vendor == "postgresql":
+        sql, params = postgres_search_sql(user_id, terms, before, limit)
+    elif connection.vendor == "sqlite":
+        sql, params = sqlite_search_sql(user_id, terms, before, limit)
+    else:
+        raise NotSupportedError(f"Chat search does not support {connection.vendor}")
+    chats = list(Chat.objects.raw(sql, params))
+    next_before = chats[page_size - 1].id if len(chats) > page_size else None
+    results = [
+        {
+            "id": chat.id,
+            "session_id": chat.session_id,
+            "created_at": chat.created_at,
+            "message": snippet_html(chat.message_snippet),
+            "response": snippet_html(chat.response_snippet),
+        }
+        for chat in chats[:page_size]
+    ]
+    return results, next_before
+
+
+def sqlite_search_sql(user_id, terms, before, limit):
+    # Each word is quoted, so FTS5 reads it as a plain string, never syntax.
+    words = " AND ".join(f'"{term}"' for term in terms)
+    match = f'user_id:"{int(user_id)}" AND {{message response}}:({words})'
+    snippet = f"snippet({FTS_TABLE}, %s, char(2), char(3), '…', {SNIPPET_WORDS})"
+    # FTS5 walks its matches in rowid order, so this stops after one page no
+    # matter how many chats match. Ranking by bm25() would instead score
+    # every match, and look each word up across all users' chats.
+    sql = f"""
+        SELECT chat.id, chat.session_id, chat.created_at,
+               {snippet % 1} AS message_snippet,
+               {snippet % 2} AS response_snippet
+        FROM {FTS_TABLE}
+        JOIN chatbot_chat AS chat ON chat.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid < %s
+        ORDER BY {FTS_TABLE}.rowid DESC
+        LIMIT %s
+    """
+    return sql, [match, before or sys.maxsize, limit]
+
+
+def postgres_search_sql(user_id, terms, before, limit):
+    options = (
+        f"StartSel={MATCH_START}, StopSel={MATCH_END}, "
+        f"MaxWords={SNIPPET_WORDS}, MinWords={SNIPPET_WORDS // 2}, "
+        "MaxFragments=2, FragmentDelimiter=…"
+    )
+    # The costly headlines are made for the returned page alone.
+    sql = """
+        SELECT hit.id, hit.session_id, hit.created_at,
+               ts_headline('english', hit.message, hit.query, %s)
+                   AS message_snippet,
+               ts_headline('english', hit.response, hit.query, %s)
+                   AS response_snippet
+        FROM (
+            SELECT chat.id, chat.session_id, chat.created_at, chat.message,
+                   chat.response, query
+            FROM chatbot_chat AS chat,
+                 plainto_tsquery('english', %s) AS query
+            WHERE chat.user_id = %s AND chat.search_vector @@ query
+                AND chat.id < %s
+            ORDER BY chat.id DESC
+            LIMIT %s
+        ) AS hit
+        ORDER BY hit.id DESC
+    """
+    return sql, [
+        options,
+        options,
+        " ".join(terms),
+        int(user_id),
+        before or sys.maxsize,
+        limit,
+    ]
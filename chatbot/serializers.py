@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Chat
+from .models import Chat, ChatJob, Conversation
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -54,3 +54,26 @@ class ChatSerializer(serializers.ModelSerializer):
         model = Chat
         fields = ("id", "message", "response", "created_at")
         read_only_fields = ("response", "created_at")
+
+
+class ConversationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Conversation
+        fields = (
+            "id",
+            "session_id",
+            "title",
+            "last_message",
+            "last_message_at",
+            "message_count",
+            "created_at",
+        )
+        read_only_fields = fields
+
+
+class ChatJobSerializer(serializers.ModelSerializer):
+    chat = ChatSerializer(read_only=True)
+
+    class Meta:
+        model = ChatJob
+        fields = ("id", "status", "chat", "error", "created_at", "finished_at")
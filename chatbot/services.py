@@ -1,53 +1,760 @@
+import hashlib
+import logging
 import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import aclosing, closing
+from pathlib import Path
+
+from django.conf import settings
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
+from .cache import ResponseCache
+from .memory import create_session_store
+from .metrics import observe, stage
+from .providers import create_provider
+from .resilience import ChatError, LatencyTracker, Resilience
+from .routing import create_router
+
 load_dotenv()
 
-session_store = {}
+logger = logging.getLogger(__name__)
 
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+DEFAULT_LANGUAGE = "English"
+DEFAULT_SYSTEM_PROMPT = "You are a helpful AI assistant."
+SYSTEM_PROMPT_PATH = Path(__file__).resolve().parent.parent / "system_prompt.txt"
+# Languages a turn may be answered in. The language is written into the
+# system prompt and keys a chain, so it is never taken from a request as is.
+LANGUAGES = tuple(getattr(settings, "CHATBOT_LANGUAGES", (DEFAULT_LANGUAGE,)))
 
-def get_session_history(session_id: str) -> BaseChatMessageHistory:
-    if session_id not in session_store:
-        session_store[session_id] = ChatMessageHistory()
-    return session_store[session_id]
+session_store = create_session_store()
 
 
-groq_api_key = os.getenv("GROQ_API_KEY")
+def session_key(user_id, session_id):
+    """
+    Key of a user's session in ``session_store``. Session ids come from the
+    clients, so the same one may be used by several users.
+    """
+    return (user_id, session_id)
 
 
-def ask_groq(message, session_id="default_session", language="English"):
-    try:
-        llm = ChatGroq(model="llama-3.3-70b-versatile", groq_api_key=groq_api_key)
+def get_session_history(key) -> BaseChatMessageHistory:
+    return session_store.get_or_create(key)
+
+
+provider = create_provider()
+
+
+class SystemPrompt:
+    """System prompt file that is only re-read when its mtime changes."""
+
+    def __init__(self, path, default=DEFAULT_SYSTEM_PROMPT):
+        self.path = Path(path)
+        self.default = default
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._text = None
+        self._digest = None
+
+    def _stat(self):
         try:
-            with open("system_prompt.txt", "r", encoding="utf-8") as file:
-                system_prompt = file.read().strip()
+            return os.stat(self.path).st_mtime_ns
         except FileNotFoundError:
-            system_prompt = "You are a helpful AI assistant."
+            return None
+
+    def load(self):
+        """Return ``(text, version)``; ``version`` changes whenever the file does."""
+        mtime = self._stat()
+        if self._text is not None and mtime == self._mtime:
+            return self._text, self._mtime
+        with self._lock:
+            if self._text is None or mtime != self._mtime:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as file:
+                        self._text = file.read().strip()
+                except FileNotFoundError:
+                    self._text = self.default
+                self._digest = hashlib.sha256(self._text.encode("utf-8")).hexdigest()
+                self._mtime = mtime
+            return self._text, self._mtime
+
+    def digest(self):
+        """Hash of the current prompt text, for cache keys."""
+        self.load()
+        return self._digest
+
+
+def build_llm(model):
+    return provider.chat_model(model)
+
+
+CONTEXT_DEFAULTS = {
+    # Most recent tokens of history sent to the model verbatim.
+    "MAX_TOKENS": 4000,
+    # Older turns are only folded into the summary once at least this many
+    # tokens have fallen out of the window, so summarization is amortized.
+    "FOLD_MIN_TOKENS": 1000,
+    "SUMMARY_MAX_WORDS": 250,
+    # Model used to update summaries; ``None`` uses the chat model itself.
+    "SUMMARY_MODEL": None,
+}
+context_settings = {**CONTEXT_DEFAULTS, **getattr(settings, "CHATBOT_CONTEXT", {})}
+
+CHARS_PER_TOKEN = 4
+MESSAGE_TOKEN_OVERHEAD = 4
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an AI "
+    "assistant. Update the existing summary with the new lines, keeping names, "
+    "facts, preferences and open questions the assistant may need later. Reply "
+    "with the updated summary only, in at most {max_words} words."
+)
+
+
+def count_tokens(message):
+    """Cheap token estimate for one message; accurate enough for budgeting."""
+    content = message.content
+    if not isinstance(content, str):
+        content = str(content)
+    return len(content) // CHARS_PER_TOKEN + MESSAGE_TOKEN_OVERHEAD
+
+
+def same_message(message, other):
+    """
+    True if ``message`` is ``other``, or a rebuilt copy of it: compact
+    histories (chatbot/memory.py) make new objects on every read, with the
+    same ``id``.
+    """
+    return message is other or (message.id is not None and message.id == other.id)
+
+
+class ContextState:
+    """Rolling summary of the turns that fell out of a session's window."""
+
+    def __init__(self):
+        self.summary = ""
+        # Last message folded into ``summary``.
+        self.boundary = None
+        # message.id or id(message) -> (message, tokens); the message is kept
+        # so its id cannot be reused while the entry exists.
+        self.token_counts = {}
+
+    def start(self, messages):
+        """Index of the first message in ``messages`` not yet summarized."""
+        if self.boundary is not None:
+            for index in range(len(messages) - 1, -1, -1):
+                if same_message(messages[index], self.boundary):
+                    return index + 1
+        return 0
+
+    def tokens(self, messages):
+        counts = {}
+        result = []
+        for message in messages:
+            key = message.id or id(message)
+            entry = self.token_counts.get(key)
+            if entry is None or not same_message(message, entry[0]):
+                entry = (message, count_tokens(message))
+            counts[key] = entry
+            result.append(entry[1])
+        self.token_counts = counts
+        return result
+
+
+class ContextAssembler:
+    """
+    Chain step that bounds the history sent to the model.
+
+    The newest ``MAX_TOKENS`` of history are passed through verbatim; older
+    turns are folded into a per-session summary, which is updated with only the
+    newly evicted turns instead of being rebuilt from the whole conversation.
 
+    Folding updates the session's state, so the chat functions run this step
+    once per turn, ahead of the model call that ``upstream`` may retry or
+    hedge. The summary call itself has no side effects and goes through
+    ``upstream`` too.
+    """
+
+    def __init__(self, summary_llm, options=None):
+        options = options or context_settings
+        self.summary_llm = summary_llm
+        self.max_tokens = options["MAX_TOKENS"]
+        self.fold_min_tokens = options["FOLD_MIN_TOKENS"]
+        self.summary_prompt = SUMMARY_PROMPT.format(
+            max_words=options["SUMMARY_MAX_WORDS"]
+        )
+
+    def __call__(self, inputs, config):
+        with stage("prompt"):
+            state, evicted = self._plan(inputs, config)
+        if evicted:
+            try:
+                request = self._summary_request(state, evicted)
+                with stage("summary"):
+                    response = upstream.call(
+                        lambda: self.summary_llm.invoke(request), summary_latencies
+                    )
+                state.summary = response.content.strip()
+            except Exception:
+                self._summary_failed()
+            state.boundary = evicted[-1]
+        with stage("prompt"):
+            return self._context(inputs, state)
+
+    async def ainvoke(self, inputs, config):
+        with stage("prompt"):
+            state, evicted = self._plan(inputs, config)
+        if evicted:
+            try:
+                request = self._summary_request(state, evicted)
+                with stage("summary"):
+                    response = await upstream.acall(
+                        lambda: self.summary_llm.ainvoke(request), summary_latencies
+                    )
+                state.summary = response.content.strip()
+            except Exception:
+                self._summary_failed()
+            state.boundary = evicted[-1]
+        with stage("prompt"):
+            return self._context(inputs, state)
+
+    def _plan(self, inputs, config):
+        """Return the session's state and the turns that must be folded now."""
+        messages = inputs["messages"]
+        key = config.get("configurable", {}).get("session_id")
+        state = self._state(key)
+        tokens = state.tokens(messages)
+        start = state.start(messages)
+
+        window_start = len(messages) - 1
+        budget = self.max_tokens - tokens[-1] if messages else 0
+        while window_start > start and tokens[window_start - 1] <= budget:
+            budget -= tokens[window_start - 1]
+            window_start -= 1
+
+        if sum(tokens[start:window_start]) >= self.fold_min_tokens:
+            return state, messages[start:window_start]
+        return state, []
+
+    def _context(self, inputs, state):
+        messages = inputs["messages"]
+        context = list(messages[state.start(messages) :])
+        if state.summary:
+            context.insert(
+                0,
+                SystemMessage(
+                    content=f"Summary of the earlier conversation:\n{state.summary}"
+                ),
+            )
+        return {**inputs, "messages": context}
+
+    def _state(self, key):
+        history = session_store.get(key) if key else None
+        state = getattr(history, "context_state", None)
+        if state is None:
+            state = ContextState()
+            if history is not None:
+                history.context_state = state
+        return state
+
+    def _summary_request(self, state, evicted):
+        transcript = "\n".join(
+            f"{'User' if message.type == 'human' else 'Assistant'}: {message.content}"
+            for message in evicted
+        )
+        return [
+            SystemMessage(content=self.summary_prompt),
+            HumanMessage(
+                content=f"Current summary:\n{state.summary or '(none)'}"
+                f"\n\nNew lines:\n{transcript}"
+            ),
+        ]
+
+    def _summary_failed(self):
+        # Keep the previous summary: dropping the turns keeps the prompt
+        # bounded, which matters more than a perfect summary.
+        logger.exception("Could not update the conversation summary")
+
+
+def request_language(data):
+    """
+    The language asked for in request ``data``, ``DEFAULT_LANGUAGE`` if none;
+    raises ``ValueError`` unless it is one of ``LANGUAGES``.
+    """
+    language = data.get("language") or DEFAULT_LANGUAGE
+    if language not in LANGUAGES:
+        raise ValueError(f"language must be one of {', '.join(LANGUAGES)}")
+    return language
+
+
+class ChainRegistry:
+    """
+    Long-lived chains keyed by (model, language).
+
+    LLM clients are created once per model and chains once per key; a chain is
+    only rebuilt when the system prompt file changes on disk. At most
+    ``max_chains`` are kept, the least recently used going first.
+    """
+
+    def __init__(self, system_prompt, llm_factory=build_llm, max_chains=64):
+        self.system_prompt = system_prompt
+        self.llm_factory = llm_factory
+        self.max_chains = max_chains
+        self._lock = threading.Lock()
+        self._llms = {}
+        self._chains = OrderedDict()
+
+    def _get_llm(self, model):
+        llm = self._llms.get(model)
+        if llm is None:
+            llm = self._llms[model] = self.llm_factory(model)
+        return llm
+
+    def _build(self, model, language, system_prompt):
+        if language and language != DEFAULT_LANGUAGE:
+            system_prompt = f"{system_prompt}\n\nAlways reply in {language}."
         prompt = ChatPromptTemplate.from_messages(
             [
                 ("system", system_prompt),
                 MessagesPlaceholder(variable_name="messages"),
             ]
         )
-        chain = prompt | llm
-        with_message_history = RunnableWithMessageHistory(
-            chain,
-            get_session_history,
-            input_messages_key="messages",
-        )
-        config = {"configurable": {"session_id": session_id}}
+        summary_llm = self._get_llm(context_settings["SUMMARY_MODEL"] or model)
+        assembler = ContextAssembler(summary_llm)
+        return assembler, prompt | self._get_llm(model)
+
+    def _entry(self, model, language):
+        if language not in LANGUAGES:
+            raise ValueError(f"Unsupported language: {language!r}")
+        system_prompt, version = self.system_prompt.load()
+        key = (model, language)
+        entry = self._chains.get(key)
+        if entry is not None and entry[0] == version:
+            try:
+                self._chains.move_to_end(key)
+            except KeyError:
+                # Evicted by another thread meanwhile; the entry is still good.
+                pass
+            return entry[1]
+        with self._lock:
+            entry = self._chains.get(key)
+            if entry is None or entry[0] != version:
+                entry = (version, self._build(model, language, system_prompt))
+                self._chains[key] = entry
+                while len(self._chains) > self.max_chains:
+                    self._chains.popitem(last=False)
+            return entry[1]
+
+    def get_steps(self, model=DEFAULT_MODEL, language=DEFAULT_LANGUAGE):
+        """
+        Return the chain's two steps, to be run separately: the
+        ``ContextAssembler`` and the prompt and model call that follow it.
+        The caller manages the session history itself.
+        """
+        return self._entry(model, language)
+
+    def warm_up(self, models=(DEFAULT_MODEL,), languages=(DEFAULT_LANGUAGE,)):
+        """Build the chains for the given keys ahead of the first request."""
+        for model in models:
+            for language in languages:
+                try:
+                    self.get_steps(model, language)
+                except Exception:
+                    logger.exception(
+                        "Could not warm up chain for %s/%s", model, language
+                    )
+
+    def clear(self):
+        with self._lock:
+            self._chains.clear()
+            self._llms.clear()
+
+
+chain_registry = ChainRegistry(SystemPrompt(SYSTEM_PROMPT_PATH))
 
-        response = with_message_history.invoke(
-            {"messages": [HumanMessage(content=message)]}, config=config
-        )
-        return response.content
 
+RESPONSE_CACHE_DEFAULTS = {
+    "ENABLED": True,
+    "MAX_ENTRIES": 10000,
+    "TTL": 24 * 60 * 60,
+    # Serve near-duplicate prompts using local embeddings.
+    "SEMANTIC": False,
+    "SEMANTIC_THRESHOLD": 0.9,
+    "SEMANTIC_MAX_ENTRIES": 5000,
+}
+cache_settings = {
+    **RESPONSE_CACHE_DEFAULTS,
+    **getattr(settings, "CHATBOT_RESPONSE_CACHE", {}),
+}
+response_cache = ResponseCache(
+    max_entries=cache_settings["MAX_ENTRIES"],
+    ttl=cache_settings["TTL"],
+    semantic=cache_settings["SEMANTIC"],
+    semantic_threshold=cache_settings["SEMANTIC_THRESHOLD"],
+    semantic_max_entries=cache_settings["SEMANTIC_MAX_ENTRIES"],
+)
+
+
+def request_flag(data, name):
+    """Read a boolean flag from request data, accepting JSON and form values."""
+    return str(data.get(name, "")).lower() in ("1", "true", "yes", "on")
+
+
+def wants_fresh_response(data):
+    """True if a request asked to bypass the response cache (``no_cache``)."""
+    return request_flag(data, "no_cache")
+
+
+def cache_scope(model, language, bypass_cache):
+    """
+    Return the response-cache scope for a turn, or ``None`` to skip the cache.
+
+    Only first turns of a session are cached: later answers depend on the
+    conversation so far, not just on the prompt.
+    """
+    if not cache_settings["ENABLED"]:
+        return None
+    if bypass_cache:
+        response_cache.record_bypass()
+        return None
+    return ResponseCache.scope(model, language, chain_registry.system_prompt.digest())
+
+
+RESILIENCE_DEFAULTS = {
+    # Seconds allowed for one attempt, and for the whole call with retries.
+    "TIMEOUT": 30,
+    "DEADLINE": 60,
+    "RETRIES": 2,
+    "BACKOFF_BASE": 0.25,
+    "BACKOFF_MAX": 4.0,
+    # Send a second request when the first is slower than this percentile of
+    # recent calls (but never sooner than HEDGE_MIN_DELAY seconds).
+    "HEDGE": False,
+    "HEDGE_PERCENTILE": 0.95,
+    "HEDGE_MIN_DELAY": 0.5,
+    "HEDGE_MIN_SAMPLES": 20,
+    # Fail fast for BREAKER_RESET seconds after this many failures in a row.
+    "BREAKER_FAILURES": 5,
+    "BREAKER_RESET": 30,
+    # Threads running sync model calls, so that their timeouts can be enforced.
+    "MAX_WORKERS": 64,
+}
+resilience_settings = {
+    **RESILIENCE_DEFAULTS,
+    **getattr(settings, "CHATBOT_RESILIENCE", {}),
+}
+# Summary calls are timed apart from chat calls, so as not to skew hedging.
+summary_latencies = LatencyTracker()
+upstream = Resilience(
+    timeout=resilience_settings["TIMEOUT"],
+    deadline=resilience_settings["DEADLINE"],
+    retries=resilience_settings["RETRIES"],
+    backoff_base=resilience_settings["BACKOFF_BASE"],
+    backoff_max=resilience_settings["BACKOFF_MAX"],
+    hedge=resilience_settings["HEDGE"],
+    hedge_percentile=resilience_settings["HEDGE_PERCENTILE"],
+    hedge_min_delay=resilience_settings["HEDGE_MIN_DELAY"],
+    hedge_min_samples=resilience_settings["HEDGE_MIN_SAMPLES"],
+    breaker_failures=resilience_settings["BREAKER_FAILURES"],
+    breaker_reset=resilience_settings["BREAKER_RESET"],
+    max_workers=resilience_settings["MAX_WORKERS"],
+)
+
+
+ROUTING_DEFAULTS = {
+    "ENABLED": True,
+    # Each route's model, its SLO on the p95 of recent calls (seconds until
+    # the answer or its first streamed chunk), and where its turns go while
+    # it is over the SLO.
+    "ROUTES": {
+        "fast": {"MODEL": "llama-3.1-8b-instant", "SLO_P95": 2.0, "FALLBACK": "full"},
+        "full": {"MODEL": DEFAULT_MODEL, "SLO_P95": 8.0, "FALLBACK": "fast"},
+    },
+    "SIMPLE_ROUTE": "fast",
+    "COMPLEX_ROUTE": "full",
+    # Longer messages, or turns deeper into a conversation, are not simple.
+    "SIMPLE_MAX_WORDS": 12,
+    "SIMPLE_MAX_HISTORY": 6,
+    # A route is judged on the calls of its last WINDOW_SECONDS (at most
+    # WINDOW_SIZE of them), once there are MIN_SAMPLES.
+    "MIN_SAMPLES": 20,
+    "WINDOW_SECONDS": 60,
+    "WINDOW_SIZE": 200,
+}
+routing_settings = {**ROUTING_DEFAULTS, **getattr(settings, "CHATBOT_ROUTING", {})}
+router = create_router(routing_settings)
+
+
+def route_turn(message, messages):
+    """The route for a turn given its session's ``messages``; ``None`` if off."""
+    if not routing_settings["ENABLED"]:
+        return None
+    with stage("route"):
+        return router.choose(message, len(messages))
+
+
+def route_model(route):
+    return DEFAULT_MODEL if route is None else route.model
+
+
+def routed_models():
+    """Every model a turn may be sent to, e.g. for ``ChainRegistry.warm_up``."""
+    if not routing_settings["ENABLED"]:
+        return (DEFAULT_MODEL,)
+    return tuple(dict.fromkeys(route.model for route in router.routes.values()))
+
+
+def warm_up():
+    """Build the chains of every routed model, ahead of the first chat turn."""
+    chain_registry.warm_up(routed_models())
+
+
+class RouteTimer:
+    """Reports the outcome of a routed model call to the router, once."""
+
+    def __init__(self, route):
+        self.route = route
+        self.start = time.monotonic()
+        self.done = route is None
+
+    def success(self):
+        if not self.done:
+            self.done = True
+            router.record(self.route, time.monotonic() - self.start)
+
+    def failure(self):
+        if not self.done:
+            self.done = True
+            router.record(self.route, time.monotonic() - self.start, ok=False)
+
+
+def chat_error(exc):
+    """Log an upstream failure and return it as a ``ChatError``."""
+    if not isinstance(exc, ChatError):
+        logger.warning("Model call failed: %r", exc)
+    return ChatError.from_exception(exc)
+
+
+def record_usage(usage, prompt, answer):
+    """Report a turn's token counts, estimating any the provider left out."""
+    usage = usage or {}
+    observe(
+        "prompt_tokens", usage.get("input_tokens") or sum(map(count_tokens, prompt))
+    )
+    observe(
+        "completion_tokens",
+        usage.get("output_tokens") or count_tokens(AIMessage(content=answer)),
+    )
+
+
+class Turn:
+    """
+    The steps of a chat turn shared by ``ask_groq``, ``stream_groq`` and their
+    async versions, around the reading and writing of the session history
+    (sync or async) and the model call (whole or streamed).
+    """
+
+    def __init__(self, message, session_id, language, bypass_cache, user_id):
+        self.message = message
+        self.language = language
+        self.bypass_cache = bypass_cache
+        self.key = session_key(user_id, session_id)
+        self.history = get_session_history(self.key)
+        self.human_message = HumanMessage(content=message)
+        self.config = {"configurable": {"session_id": self.key}}
+
+    def begin(self, messages):
+        """
+        Route the turn given its session's ``messages``; return the cached
+        answer, or ``None`` if the model must be called.
+        """
+        observe("history_messages", len(messages))
+        self.route = route_turn(self.message, messages)
+        self.model = route_model(self.route)
+        self.inputs = {"messages": messages + [self.human_message]}
+        if messages:
+            self.scope = None
+        else:
+            self.scope = cache_scope(self.model, self.language, self.bypass_cache)
+        with stage("cache"):
+            if self.scope is None:
+                return None
+            return response_cache.get(self.scope, self.message)
+
+    def steps(self):
+        """The ``ContextAssembler`` and model chain; see ``ChainRegistry``."""
+        return chain_registry.get_steps(self.model, self.language)
+
+    def timer(self):
+        return RouteTimer(self.route)
+
+    def answered(self, answer, usage):
+        """Record the model's ``answer`` and cache it if the turn may be."""
+        record_usage(usage, self.inputs["messages"], answer)
+        if self.scope is not None:
+            response_cache.set(self.scope, self.message, answer)
+
+    def messages(self, answer):
+        """The turn's messages, to be added to the session history."""
+        return [self.human_message, AIMessage(content=answer)]
+
+
+def ask_groq(
+    message,
+    session_id="default_session",
+    language="English",
+    bypass_cache=False,
+    user_id=None,
+):
+    """
+    Return the answer to ``message`` in the context of ``user_id``'s session.
+
+    Raises ``ChatError`` if the model cannot answer; the session history is
+    only updated once an answer exists.
+    """
+    turn = Turn(message, session_id, language, bypass_cache, user_id)
+    with stage("history"):
+        messages = turn.history.messages
+    answer = turn.begin(messages)
+
+    if answer is None:
+        assembler, model_chain = turn.steps()
+        timer = turn.timer()
+        try:
+            context = assembler(turn.inputs, turn.config)
+            with stage("llm"):
+                response = upstream.call(lambda: model_chain.invoke(context))
+        except Exception as e:
+            timer.failure()
+            raise chat_error(e) from e
+        timer.success()
+        answer = response.content
+        turn.answered(answer, response.usage_metadata)
+
+    with stage("history"):
+        turn.history.add_messages(turn.messages(answer))
+    return answer
+
+
+async def aask_groq(
+    message,
+    session_id="default_session",
+    language="English",
+    bypass_cache=False,
+    user_id=None,
+):
+    """Async ``ask_groq`` for ASGI views; the model call does not hold a thread."""
+    turn = Turn(message, session_id, language, bypass_cache, user_id)
+    with stage("history"):
+        messages = await turn.history.aget_messages()
+    answer = turn.begin(messages)
+
+    if answer is None:
+        assembler, model_chain = turn.steps()
+        timer = turn.timer()
+        try:
+            context = await assembler.ainvoke(turn.inputs, turn.config)
+            with stage("llm"):
+                response = await upstream.acall(lambda: model_chain.ainvoke(context))
+        except Exception as e:
+            timer.failure()
+            raise chat_error(e) from e
+        timer.success()
+        answer = response.content
+        turn.answered(answer, response.usage_metadata)
+
+    with stage("history"):
+        await turn.history.aadd_messages(turn.messages(answer))
+    return answer
+
+
+def stream_groq(
+    message,
+    session_id="default_session",
+    language="English",
+    bypass_cache=False,
+    user_id=None,
+):
+    """
+    Yield the response to ``message`` as text chunks.
+
+    The turn is added to the session history only once the stream completes,
+    so a client that disconnects half way does not leave a truncated answer
+    in the conversation. A cached answer is yielded as a single chunk. Raises
+    ``ChatError`` if the model fails, before or during the stream.
+    """
+    turn = Turn(message, session_id, language, bypass_cache, user_id)
+    with stage("history"):
+        messages = turn.history.messages
+    answer = turn.begin(messages)
+    if answer is not None:
+        yield answer
+        turn.history.add_messages(turn.messages(answer))
+        return
+
+    assembler, model_chain = turn.steps()
+    parts = []
+    usage = None
+    timer = turn.timer()
+    try:
+        context = assembler(turn.inputs, turn.config)
+        chunks = upstream.stream(lambda: model_chain.stream(context))
+        with closing(chunks):
+            for chunk in chunks:
+                usage = chunk.usage_metadata or usage
+                if chunk.content:
+                    timer.success()
+                    parts.append(chunk.content)
+                    yield chunk.content
+    except Exception as e:
+        timer.failure()
+        raise chat_error(e) from e
+    timer.success()
+    answer = "".join(parts)
+    turn.answered(answer, usage)
+    turn.history.add_messages(turn.messages(answer))
+
+
+async def astream_groq(
+    message,
+    session_id="default_session",
+    language="English",
+    bypass_cache=False,
+    user_id=None,
+):
+    """Async ``stream_groq``."""
+    turn = Turn(message, session_id, language, bypass_cache, user_id)
+    with stage("history"):
+        messages = await turn.history.aget_messages()
+    answer = turn.begin(messages)
+    if answer is not None:
+        yield answer
+        await turn.history.aadd_messages(turn.messages(answer))
+        return
+
+    assembler, model_chain = turn.steps()
+    parts = []
+    usage = None
+    timer = turn.timer()
+    try:
+        context = await assembler.ainvoke(turn.inputs, turn.config)
+        chunks = upstream.astream(lambda: model_chain.astream(context))
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                usage = chunk.usage_metadata or usage
+                if chunk.content:
+                    timer.success()
+                    parts.append(chunk.content)
+                    yield chunk.content
     except Exception as e:
-        return f"Error: {str(e)}"
+        timer.failure()
+        raise chat_error(e) from e
+    timer.success()
+    answer = "".join(parts)
+    turn.answered(answer, usage)
+    await turn.history.aadd_messages(turn.messages(answer))
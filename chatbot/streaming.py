@@ -0,0 +1,116 @@
+"""
+Server-sent events for streamed chat responses.
+
+A stream is a sequence of ``token`` events carrying text chunks, followed by
+either one ``done`` event with the saved chat or one ``error`` event carrying
+a ``ChatError`` (``{"error": ..., "code": ...}``).
+"""
+
+import asyncio
+import json
+import logging
+from contextlib import aclosing, closing
+
+from django.http import StreamingHttpResponse
+
+from .metrics import stage
+from .models import Chat
+from .persistence import chat_writer
+from .resilience import ChatError
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_chat_events(
+    user, message, session_id, language, serialize, bypass_cache=False
+):
+    """
+    Relay the model's tokens as SSE and save the ``Chat`` row once complete.
+
+    ``serialize`` turns the saved ``Chat`` into the payload of the ``done``
+    event. If the client disconnects, the server closes this generator, which
+    closes the upstream stream as well; nothing is saved in that case.
+    """
+    from .services import stream_groq
+
+    parts = []
+    try:
+        with closing(
+            stream_groq(message, session_id, language, bypass_cache, user.id)
+        ) as tokens:
+            for token in tokens:
+                parts.append(token)
+                yield sse_event("token", {"token": token})
+    except GeneratorExit:
+        logger.info("Client disconnected from chat stream %s", session_id)
+        raise
+    except ChatError as e:
+        yield sse_event("error", e.as_dict())
+        return
+    except Exception:
+        logger.exception("Chat stream %s failed", session_id)
+        yield sse_event("error", {"error": "Internal error", "code": "internal_error"})
+        return
+
+    with stage("db_write"):
+        chat = Chat(
+            user=user,
+            session_id=session_id,
+            message=message,
+            response="".join(parts),
+        )
+        chat_writer.write(chat)
+    yield sse_event("done", serialize(chat))
+
+
+async def astream_chat_events(
+    user, message, session_id, language, serialize, bypass_cache=False
+):
+    """
+    Async ``stream_chat_events`` for ASGI views.
+
+    On client disconnect Django cancels the response task; the cancellation
+    propagates into the upstream stream and nothing is saved.
+    """
+    from .services import astream_groq
+
+    parts = []
+    try:
+        async with aclosing(
+            astream_groq(message, session_id, language, bypass_cache, user.id)
+        ) as tokens:
+            async for token in tokens:
+                parts.append(token)
+                yield sse_event("token", {"token": token})
+    except (asyncio.CancelledError, GeneratorExit):
+        logger.info("Client disconnected from chat stream %s", session_id)
+        raise
+    except ChatError as e:
+        yield sse_event("error", e.as_dict())
+        return
+    except Exception:
+        logger.exception("Chat stream %s failed", session_id)
+        yield sse_event("error", {"error": "Internal error", "code": "internal_error"})
+        return
+
+    with stage("db_write"):
+        chat = Chat(
+            user=user,
+            session_id=session_id,
+            message=message,
+            response="".join(parts),
+        )
+        await chat_writer.awrite(chat)
+    yield sse_event("done", serialize(chat))
+
+
+def event_stream_response(events):
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the stream.
+    response["X-Accel-Buffering"] = "no"
+    return response
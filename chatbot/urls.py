@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 from . import api_views
+from . import async_views
+from .metrics import metrics_view
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -8,15 +11,60 @@ from rest_framework_simplejwt.views import (
 
 app_name = "chatbot"
 
+if settings.CHATBOT_ASYNC_VIEWS:
+    chatbot_view = async_views.chatbot
+    chatbot_stream_view = async_views.chatbot_stream
+    api_chat_view = async_views.api_chat
+    api_chat_stream_view = async_views.api_chat_stream
+    api_chat_batch_view = async_views.api_chat_batch
+else:
+    chatbot_view = views.chatbot
+    chatbot_stream_view = views.chatbot_stream
+    api_chat_view = api_views.ChatListCreateView.as_view()
+    api_chat_stream_view = api_views.ChatStreamView.as_view()
+    api_chat_batch_view = api_views.ChatBatchView.as_view()
+
 urlpatterns = [
     path("api/register/", api_views.RegisterView.as_view(), name="api_register"),
-    path("api/chat/", api_views.ChatListCreateView.as_view(), name="api_chat"),
+    path("api/chat/", api_chat_view, name="api_chat"),
+    path("api/chat/stream/", api_chat_stream_view, name="api_chat_stream"),
+    path("api/chat/batch/", api_chat_batch_view, name="api_chat_batch"),
+    path(
+        "api/chat/search/", api_views.ChatSearchView.as_view(), name="api_chat_search"
+    ),
+    path(
+        "api/chat/export/", api_views.ChatExportView.as_view(), name="api_chat_export"
+    ),
+    path(
+        "api/chat/jobs/<uuid:job_id>/",
+        api_views.ChatJobView.as_view(),
+        name="api_chat_job",
+    ),
     path(
         "api/chat/clear/", api_views.ClearSessionView.as_view(), name="api_chat_clear"
     ),
+    path(
+        "api/conversations/",
+        api_views.ConversationListView.as_view(),
+        name="api_conversations",
+    ),
+    path(
+        "api/conversations/<int:pk>/",
+        api_views.ConversationDetailView.as_view(),
+        name="api_conversation",
+    ),
+    path(
+        "api/conversations/<int:pk>/resume/",
+        api_views.ConversationResumeView.as_view(),
+        name="api_conversation_resume",
+    ),
+    path("api/stats/", api_views.StatsView.as_view(), name="api_stats"),
+    path("metrics", metrics_view, name="metrics"),
     path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
-    path("", views.chatbot, name="chatbot"),
+    path("", chatbot_view, name="chatbot"),
+    path("chat/stream/", chatbot_stream_view, name="chatbot_stream"),
+    path("chat/history/", views.chat_history, name="chat_history"),
     path("login/", views.login, name="login"),
     path("register/", views.register, name="register"),
     path("logout/", views.logout, name="logout"),
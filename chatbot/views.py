@@ -1,15 +1,16 @@
-from multiprocessing.connection import answer_challenge
 from django.shortcuts import render, redirect
 from django.contrib import auth
 from django.http import JsonResponse
 from django.contrib.auth.models import User
 from .models import Chat
-from groq import Groq
+from .pagination import history_page
+from .persistence import chat_writer, merge_pending
 import os
-from dotenv import load_dotenv
-from .services import ask_groq, session_store
+from .admission import AdmissionRejected, admission
+from .metrics import stage
+from .resilience import ChatError
+from .streaming import event_stream_response, stream_chat_events
 
-load_dotenv()
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required
 
@@ -34,32 +35,140 @@ from django.contrib.sites.shortcuts import get_current_site
 # ===========================================================================================
 
 
+def get_chat_session_id(request):
+    """Return the chat session id stored in the web session, creating one if needed."""
+    session_id = request.session.get("chat_session_id")
+    if not session_id:
+        session_id = (
+            f"user_{request.user.id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
+        )
+        request.session["chat_session_id"] = session_id
+    return session_id
+
+
+def chat_error_response(error):
+    """
+    JSON response for a ``ChatError`` or ``AdmissionRejected``, with
+    Retry-After when it is known.
+    """
+    response = JsonResponse(error.as_dict(), status=error.status)
+    if error.retry_after is not None:
+        response["Retry-After"] = str(error.retry_after)
+    return response
+
+
 @login_required(login_url="chatbot:login")
 def chatbot(request):
-    chats = Chat.objects.filter(user=request.user)
     if request.method == "POST":
+        # The LLM stack is loaded by the first chat turn, not at startup.
+        from .services import ask_groq, request_language, wants_fresh_response
+
         message = request.POST.get("message")
-        language = request.POST.get("language", "English")
-        session_id = request.session.get("chat_session_id")
-        if not session_id:
-            session_id = (
-                f"user_{request.user.id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}"
-            )
-            request.session["chat_session_id"] = session_id
+        if not message:
+            return JsonResponse({"error": "Message is required"}, status=400)
+        try:
+            language = request_language(request.POST)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        session_id = get_chat_session_id(request)
 
         # Get response using LangChain with session memory
-        response = ask_groq(message, session_id, language)
-        chat = Chat(
-            user=request.user,
-            message=message,
-            response=response,
-            created_at=timezone.now(),
-        )
-        chat.save()
+        try:
+            with admission.admit(request.user, message):
+                response = ask_groq(
+                    message,
+                    session_id,
+                    language,
+                    bypass_cache=wants_fresh_response(request.POST),
+                    user_id=request.user.id,
+                )
+        except (AdmissionRejected, ChatError) as e:
+            return chat_error_response(e)
+        with stage("db_write"):
+            chat_writer.submit(
+                Chat(
+                    user=request.user,
+                    session_id=session_id,
+                    message=message,
+                    response=response,
+                )
+            )
         return JsonResponse(
             {"message": message, "response": response, "session_id": session_id}
         )
-    return render(request, "chatbot.html", {"chats": chats})
+    # Only the latest page is rendered; older chats load from chat_history as
+    # the user scrolls up.
+    with stage("history"):
+        pending = chat_writer.pending(request.user.id)
+        chats, history_cursor = history_page(Chat.objects.filter(user=request.user))
+        chats = merge_pending(chats, pending)
+    with stage("template"):
+        return render(
+            request,
+            "chatbot.html",
+            {"chats": chats, "history_cursor": history_cursor},
+        )
+
+
+@login_required(login_url="chatbot:login")
+def chat_history(request):
+    """Return the page of chats before the ``before`` cursor, for infinite scroll."""
+    chats, next_cursor = history_page(
+        Chat.objects.filter(user=request.user), before=request.GET.get("before")
+    )
+    return JsonResponse(
+        {
+            "chats": [
+                {
+                    "id": chat.id,
+                    "message": chat.message,
+                    "response_html": chat.rendered_response,
+                }
+                for chat in chats
+            ],
+            "next": next_cursor,
+        }
+    )
+
+
+@login_required(login_url="chatbot:login")
+def chatbot_stream(request):
+    """Stream the response to a chat message as server-sent events."""
+    from .services import request_language, wants_fresh_response
+
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    message = request.POST.get("message")
+    if not message:
+        return JsonResponse({"error": "Message is required"}, status=400)
+    try:
+        language = request_language(request.POST)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    session_id = get_chat_session_id(request)
+    try:
+        slot = admission.enter(request.user, message)
+    except AdmissionRejected as e:
+        return chat_error_response(e)
+
+    def serialize(chat):
+        return {
+            "message": chat.message,
+            "response": chat.response,
+            "response_html": chat.rendered_response,
+            "session_id": session_id,
+        }
+
+    events = stream_chat_events(
+        request.user,
+        message,
+        session_id,
+        language,
+        serialize,
+        bypass_cache=wants_fresh_response(request.POST),
+    )
+    return event_stream_response(admission.hold(slot, events))
 
 
 # new
@@ -79,9 +188,10 @@ def new_chat_session(request):
 
 def clear_session_history(request):
     """Clear the conversation history for current session"""
+    from .services import session_key, session_store
+
     session_id = request.session.get("chat_session_id")
-    if session_id and session_id in session_store:
-        del session_store[session_id]
+    if session_id and session_store.delete(session_key(request.user.id, session_id)):
         return JsonResponse({"message": "Session history cleared"})
 
     return JsonResponse({"message": "No active session to clear"})
@@ -9,8 +9,17 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "chatbot_project.settings")
+os.environ.setdefault("CHATBOT_ASYNC_VIEWS", "1")
 
 application = get_asgi_application()
+
+# Load the LLM stack and build its chains before the first request reaches
+# this worker.
+if settings.CHATBOT_WARM_UP:
+    from chatbot.services import warm_up
+
+    warm_up()
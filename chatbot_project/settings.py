@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "chatbot.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -78,12 +79,50 @@ WSGI_APPLICATION = "chatbot_project.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# PostgreSQL when POSTGRES_DB is set, otherwise the local SQLite file. SQLite
+# locks the whole file for every write, so chat turns saved by different
+# workers queue up behind each other; PostgreSQL only locks the rows written.
+# Copy an existing SQLite database over with `manage.py copy_from_sqlite`.
+if os.getenv("POSTGRES_DB"):
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("POSTGRES_DB"),
+            "USER": os.getenv("POSTGRES_USER", "postgres"),
+            "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+            "HOST": os.getenv("POSTGRES_HOST", "localhost"),
+            "PORT": os.getenv("POSTGRES_PORT", "5432"),
+            # Keep each thread's connection open between requests...
+            "CONN_MAX_AGE": int(os.getenv("DB_CONN_MAX_AGE", "60")),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {},
+        }
+    }
+    # ...or, with DB_POOL=1, borrow connections from a psycopg pool shared by
+    # the worker's threads (needs psycopg-pool). Prefer the pool under ASGI,
+    # where sync_to_async threads would each hold a persistent connection.
+    if os.getenv("DB_POOL", "0") == "1":
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+            "timeout": 10,
+        }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "OPTIONS": {
+                # Take the write lock when a transaction starts rather than
+                # failing with "database is locked" when it tries to upgrade,
+                # and let readers proceed while a write is in progress.
+                "transaction_mode": "IMMEDIATE",
+                "timeout": 20,
+                "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;",
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -154,7 +193,7 @@ CORS_ALLOWED_ORIGINS = [
 # Rest Framework Settings
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "chatbot.authentication.CachedJWTAuthentication",
     ),
 }
 
@@ -163,4 +202,183 @@ from datetime import timedelta
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
+    # Tokens carry a hash of the password, so changing it revokes them.
+    # Tokens issued while this was off have no hash and are rejected: turning
+    # it on logs every user out, and clients must obtain new tokens. Read-only
+    # endpoints authenticate from the token's claims alone (see
+    # chatbot/authentication.py) and keep accepting a revoked token, or one
+    # of a deactivated user, until it expires.
+    "CHECK_REVOKE_TOKEN": True,
+}
+
+# Verified access tokens and their users, cached per worker so that repeat
+# API calls skip the user query (see chatbot/authentication.py).
+CHATBOT_AUTH_CACHE = {
+    "MAX_ENTRIES": 10000,
+    "MAX_AGE": 300,
+}
+
+# Chat turns are written to the database in batches by a background thread
+# (see chatbot/persistence.py). Set CHATBOT_CHAT_LOG_DIR to also log each turn
+# before responding, so `manage.py recover_chat_log` can restore the turns a
+# crashed worker had not written yet.
+CHATBOT_CHAT_WRITER = {
+    "ENABLED": True,
+    "BATCH_SIZE": 100,
+    "FLUSH_INTERVAL": 0.2,
+    "MAX_PENDING": 5000,
+    "LOG_DIR": os.environ.get("CHATBOT_CHAT_LOG_DIR") or None,
+    "FSYNC": False,
+}
+
+# Where chat models come from (see chatbot/providers.py). Set
+# CHATBOT_LLM_BACKEND=chatbot.providers.FakeProvider to run without the Groq
+# API, e.g. for benchmarks and load tests.
+CHATBOT_LLM_PROVIDER = {
+    "BACKEND": os.getenv("CHATBOT_LLM_BACKEND", "chatbot.providers.GroqProvider"),
+    "OPTIONS": {},
+}
+
+# Conversation memory (see chatbot/memory.py). DatabaseSessionStore rebuilds
+# history from the Chat table, so it is shared by all workers; use
+# LRUSessionStore to keep memory in-process only. "compact" keeps each
+# history as one UTF-8 buffer rather than a list of message objects: a
+# fraction of the memory, but every read of a history decodes it and rebuilds
+# the messages (about 1000x slower for a long one; see
+# benchmarks/bench_memory.py). Turn it on when memory, not latency, is short.
+CHATBOT_SESSION_STORE = {
+    "BACKEND": "chatbot.memory.DatabaseSessionStore",
+    "OPTIONS": {
+        "max_sessions": 10000,
+        "max_bytes": 256 * 1024 * 1024,
+        "idle_ttl": 60 * 60,
+        "max_messages": 200,
+        "compact": False,
+    },
+}
+
+# Languages a chat turn may ask to be answered in; requests for any other
+# language are refused with a 400 (see chatbot/services.py).
+CHATBOT_LANGUAGES = [
+    "English",
+    "Spanish",
+    "French",
+    "German",
+    "Italian",
+    "Portuguese",
+    "Arabic",
+    "Hindi",
+    "Urdu",
+    "Chinese",
+    "Japanese",
+]
+
+# Context window sent to the model (see chatbot/services.py)
+CHATBOT_CONTEXT = {
+    "MAX_TOKENS": 4000,
+    "FOLD_MIN_TOKENS": 1000,
+    "SUMMARY_MAX_WORDS": 250,
+    "SUMMARY_MODEL": None,
+}
+
+# Cache of answers to first turns (see chatbot/cache.py)
+CHATBOT_RESPONSE_CACHE = {
+    "ENABLED": True,
+    "MAX_ENTRIES": 10000,
+    "TTL": 24 * 60 * 60,
+    "SEMANTIC": False,
+    "SEMANTIC_THRESHOLD": 0.9,
+    "SEMANTIC_MAX_ENTRIES": 5000,
 }
+
+# Timeouts, retries, hedging and circuit breaking around model calls
+# (see chatbot/resilience.py)
+CHATBOT_RESILIENCE = {
+    "TIMEOUT": 30,
+    "DEADLINE": 60,
+    "RETRIES": 2,
+    "HEDGE": False,
+    "BREAKER_FAILURES": 5,
+    "BREAKER_RESET": 30,
+}
+
+# Which model answers each turn (see chatbot/routing.py): simple turns go to
+# the fast route, the rest to the full one, and a route over its latency SLO
+# hands its turns to its fallback.
+CHATBOT_ROUTING = {
+    "ENABLED": os.getenv("CHATBOT_ROUTING", "1") == "1",
+    "ROUTES": {
+        "fast": {"MODEL": "llama-3.1-8b-instant", "SLO_P95": 2.0, "FALLBACK": "full"},
+        "full": {
+            "MODEL": "llama-3.3-70b-versatile",
+            "SLO_P95": 8.0,
+            "FALLBACK": "fast",
+        },
+    },
+    "SIMPLE_MAX_WORDS": 12,
+    "SIMPLE_MAX_HISTORY": 6,
+}
+
+# Per-user rate limits and the global cap on chat turns in flight
+# (see chatbot/admission.py). State is kept in a SQLite file shared by the
+# workers on this host.
+CHATBOT_ADMISSION = {
+    "ENABLED": os.getenv("CHATBOT_ADMISSION", "1") == "1",
+    "BACKEND": "chatbot.admission.SQLiteAdmissionBackend",
+    "OPTIONS": {"path": os.getenv("CHATBOT_ADMISSION_DB")},
+    "REQUESTS_PER_MINUTE": 30,
+    "REQUEST_BURST": 10,
+    "TOKENS_PER_MINUTE": 20000,
+    "TOKEN_BURST": 8000,
+    "MAX_IN_FLIGHT": 32,
+    "MAX_QUEUE": 100,
+    "QUEUE_TIMEOUT": 10,
+}
+
+# Per-stage request timings served in the Prometheus format at /metrics (see
+# chatbot/metrics.py). Set CHATBOT_PROFILE_SAMPLE_RATE to run a fraction of
+# requests under cProfile and keep the profiles of the slowest ones. Staff
+# users may read /metrics; give scrapers CHATBOT_METRICS_TOKEN as a bearer
+# token, or list their addresses in ALLOWED_IPS if no proxy sits in front.
+CHATBOT_METRICS = {
+    "ENABLED": True,
+    "TOKEN": os.getenv("CHATBOT_METRICS_TOKEN") or None,
+    "ALLOWED_IPS": [],
+    "PROFILE_SAMPLE_RATE": float(os.getenv("CHATBOT_PROFILE_SAMPLE_RATE", "0")),
+    "PROFILE_KEEP": 10,
+    "PROFILE_DIR": os.getenv("CHATBOT_PROFILE_DIR"),
+}
+
+# Background chat jobs, used when a message is posted with "background": true
+# (see chatbot/jobs.py)
+CHATBOT_JOB_QUEUE = {
+    "BACKEND": "chatbot.jobs.LocalJobQueue",
+    "OPTIONS": {
+        "workers": 8,
+        "max_depth": 100,
+        "retry_after": 5,
+        # Jobs unchanged for this long were lost with a restarted worker.
+        "stale_after": 15 * 60,
+    },
+}
+
+# Batches of independent prompts posted to /api/chat/batch/ (see
+# chatbot/batch.py). A batch is charged to the admission rate limits as one
+# request, with the estimated tokens of all its prompts.
+CHATBOT_BATCH = {
+    "MAX_ITEMS": 50,
+    "CONCURRENCY": 8,
+}
+
+# Route chat requests to the async views in chatbot/async_views.py. asgi.py
+# turns this on; it can also be set explicitly through the environment.
+CHATBOT_ASYNC_VIEWS = os.getenv("CHATBOT_ASYNC_VIEWS", "0") == "1"
+
+# The LLM stack (LangChain, the provider's client, the response cache) is
+# imported by the first chat turn, so management commands and tests start
+# without it. With this on, wsgi.py and asgi.py load it and build the chains
+# as a worker starts instead, which is worth it for async workers: they would
+# otherwise import it on their event loop, stalling every request in flight.
+# Off by default, as it makes every worker pay for the stack even if it never
+# serves a chat turn.
+CHATBOT_WARM_UP = os.getenv("CHATBOT_WARM_UP", "0") == "1"
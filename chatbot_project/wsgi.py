@@ -9,8 +9,16 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "chatbot_project.settings")
 
 application = get_wsgi_application()
+
+# Load the LLM stack and build its chains before the first request reaches
+# this worker.
+if settings.CHATBOT_WARM_UP:
+    from chatbot.services import warm_up
+
+    warm_up()
@@ -1,7 +1,7 @@
 'use client';
 import { useState, useEffect, useRef } from 'react';
 import { useAuth } from '../../context/AuthContext';
-import api from '../../lib/api';
+import api, { streamChat } from '../../lib/api';
 import ReactMarkdown from 'react-markdown';
 import remarkGfm from 'remark-gfm';
 import { useRouter } from 'next/navigation';
@@ -11,7 +11,12 @@ export default function Chat() {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState('');
   const [isTyping, setIsTyping] = useState(false);
+  // Cursor URL of the next (older) page of history, or null when all is loaded.
+  const [nextPage, setNextPage] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const messagesEndRef = useRef(null);
+  const messagesBoxRef = useRef(null);
+  const prependedRef = useRef(null);
   const inputRef = useRef(null);
   const router = useRouter();
 
@@ -29,19 +34,49 @@ export default function Chat() {
 
   const fetchMessages = async () => {
       try {
+          // The API returns newest first; the chat is displayed oldest first.
           const res = await api.get('chat/');
-          setMessages(res.data);
+          setMessages([...res.data.results].reverse());
+          setNextPage(res.data.next);
           scrollToBottom();
       } catch (error) {
           console.error("Error fetching messages", error);
       }
   };
 
+  const fetchOlderMessages = async () => {
+      if (!nextPage || loadingOlder) return;
+      setLoadingOlder(true);
+      try {
+          const res = await api.get(nextPage);
+          // Remember the scroll height so the view stays put after prepending.
+          prependedRef.current = messagesBoxRef.current?.scrollHeight ?? null;
+          setMessages(prev => [...[...res.data.results].reverse(), ...prev]);
+          setNextPage(res.data.next);
+      } catch (error) {
+          console.error("Error fetching older messages", error);
+      } finally {
+          setLoadingOlder(false);
+      }
+  };
+
+  const handleScroll = (e) => {
+      if (e.currentTarget.scrollTop < 100) {
+          fetchOlderMessages();
+      }
+  };
+
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
   };
 
   useEffect(() => {
+    if (prependedRef.current !== null && messagesBoxRef.current) {
+        const box = messagesBoxRef.current;
+        box.scrollTop += box.scrollHeight - prependedRef.current;
+        prependedRef.current = null;
+        return;
+    }
     scrollToBottom();
   }, [messages, isTyping]);
 
@@ -70,9 +105,15 @@ export default function Chat() {
     setIsTyping(true);
 
     try {
-        const res = await api.post('chat/', { message: input }); // API call
-        // Replace temp message with actual response
-        setMessages(prev => prev.map(msg => msg.id === tempMessage.id ? res.data : msg));
+        const chat = await streamChat({ message: input }, (token) => {
+            setIsTyping(false);
+            // Append each streamed chunk to the pending response
+            setMessages(prev => prev.map(msg => msg.id === tempMessage.id
+                ? { ...msg, response: (msg.response || '') + token }
+                : msg));
+        });
+        // Replace temp message with the saved chat
+        setMessages(prev => prev.map(msg => msg.id === tempMessage.id ? chat : msg));
     } catch (error) {
         console.error("Error sending message", error);
         setMessages(prev => prev.filter(msg => msg.id !== tempMessage.id)); // Remove failed message
@@ -96,7 +137,7 @@ export default function Chat() {
         </div>
       </div>
 
-      <div className="messages-box">
+      <div className="messages-box" ref={messagesBoxRef} onScroll={handleScroll}>
         <ul className="messages-list">
           <li className="message received">
             <div className="message-content">
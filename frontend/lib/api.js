@@ -1,7 +1,9 @@
 import axios from 'axios';
 
+const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000/api/';
+
 const api = axios.create({
-    baseURL: process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000/api/',
+    baseURL: API_URL,
     headers: {
         'Content-Type': 'application/json',
     },
@@ -32,25 +34,13 @@ api.interceptors.response.use(
             originalRequest._retry = true;
 
             try {
-                const refreshToken = localStorage.getItem('refresh_token');
-                if (refreshToken) {
-                    const response = await axios.post(
-                        `${process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000/api/'}token/refresh/`,
-                        { refresh: refreshToken }
-                    );
-
-                    const { access } = response.data;
-                    localStorage.setItem('access_token', access);
-
+                const access = await refreshAccessToken();
+                if (access) {
                     // Retry original request with new token
                     originalRequest.headers.Authorization = `Bearer ${access}`;
                     return api(originalRequest);
                 }
             } catch (refreshError) {
-                // Refresh failed, clear tokens and redirect to login
-                localStorage.removeItem('access_token');
-                localStorage.removeItem('refresh_token');
-                window.location.href = '/login';
                 return Promise.reject(refreshError);
             }
         }
@@ -59,4 +49,74 @@ api.interceptors.response.use(
     }
 );
 
+// Exchange the refresh token for a new access token.
+// Returns null if there is no refresh token; redirects to login if it is rejected.
+async function refreshAccessToken() {
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (!refreshToken) {
+        return null;
+    }
+    try {
+        const response = await axios.post(`${API_URL}token/refresh/`, { refresh: refreshToken });
+        const { access } = response.data;
+        localStorage.setItem('access_token', access);
+        return access;
+    } catch (refreshError) {
+        // Refresh failed, clear tokens and redirect to login
+        localStorage.removeItem('access_token');
+        localStorage.removeItem('refresh_token');
+        window.location.href = '/login';
+        throw refreshError;
+    }
+}
+
+// POST a chat message to the streaming endpoint and call onToken(text) for each
+// chunk of the response as it arrives. Resolves with the saved chat.
+export async function streamChat(body, onToken) {
+    const send = (token) => fetch(`${API_URL}chat/stream/`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            ...(token ? { Authorization: `Bearer ${token}` } : {}),
+        },
+        body: JSON.stringify(body),
+    });
+
+    let response = await send(localStorage.getItem('access_token'));
+    if (response.status === 401) {
+        const access = await refreshAccessToken();
+        if (access) {
+            response = await send(access);
+        }
+    }
+    if (!response.ok) {
+        throw new Error(`Request failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = 'message';
+            let data = '';
+            for (const line of block.split('\n')) {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+            const payload = JSON.parse(data);
+            if (event === 'token') onToken(payload.token);
+            else if (event === 'done') return payload;
+            else if (event === 'error') throw new Error(payload.error);
+        }
+    }
+    throw new Error('Stream ended before the response was complete');
+}
+
 export default api;